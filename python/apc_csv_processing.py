@@ -6,6 +6,8 @@ import codecs
 import csv
 from collections import OrderedDict
 import datetime
+import hashlib
+import json
 import locale
 import logging
 import os
@@ -101,6 +103,138 @@ class CSVColumn(object):
             return old_value
             
             
+class EnrichmentJournal(object):
+    """
+    An append-only journal of enriched rows, used to resume interrupted runs.
+
+    Every enriched row is written to the journal file as a JSON line as soon as
+    it has been processed, together with the warnings and errors logged while
+    enriching it. When resuming, rows found in the journal are taken from there
+    instead of being enriched again and their log records are replayed.
+    The journal also records a hash of the CSV file, resuming is refused if the
+    file has been changed in the meantime.
+    """
+
+    def __init__(self, journal_path, csv_file, resume=False):
+        self.journal_path = journal_path
+        self.finished_rows = {}
+        csv_hash = self._get_file_hash(csv_file)
+        csv_file = os.path.abspath(csv_file)
+        if resume and os.path.isfile(journal_path):
+            line = "\n"
+            with open(journal_path, "r") as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Most likely a partially written line from a crash
+                        continue
+                    if "csv_file" in entry:
+                        if entry["csv_file"] != csv_file:
+                            msg = "Journal file '{}' belongs to a different CSV file ({})"
+                            raise ValueError(msg.format(journal_path, entry["csv_file"]))
+                        if entry.get("csv_sha1") != csv_hash:
+                            msg = ("CSV file '{}' has been changed since journal file '{}' " +
+                                   "was created, cannot resume")
+                            raise ValueError(msg.format(csv_file, journal_path))
+                        continue
+                    self.finished_rows[entry["row_num"]] = (entry["record_type"], entry["row"],
+                                                            entry.get("log", []))
+            self.handle = open(journal_path, "a")
+            if not line.endswith("\n"):
+                # terminate a partially written last line
+                self.handle.write("\n")
+        else:
+            self.handle = open(journal_path, "w")
+            self.handle.write(json.dumps({"csv_file": csv_file, "csv_sha1": csv_hash}) + "\n")
+            self.handle.flush()
+
+    @staticmethod
+    def _get_file_hash(file_path):
+        sha1 = hashlib.sha1()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                sha1.update(chunk)
+        return sha1.hexdigest()
+
+    def get(self, row_num):
+        """
+        Return a tuple (record_type, row, log) for a journaled row or None.
+
+        log is a list of [level, message] pairs.
+        """
+        return self.finished_rows.get(row_num)
+
+    def append(self, row_num, record_type, row, log=None):
+        entry = {"row_num": row_num, "record_type": record_type, "row": row, "log": log or []}
+        self.handle.write(json.dumps(entry) + "\n")
+        self.handle.flush()
+
+    def close(self):
+        self.handle.close()
+
+class RowLogCollector(logging.Handler):
+    """
+    Collect the warnings and errors logged while a single row is enriched.
+
+    The collected [level, message] pairs are stored in the EnrichmentJournal,
+    so they can be replayed when an interrupted run is resumed.
+    """
+
+    def __init__(self):
+        logging.Handler.__init__(self, logging.WARNING)
+        self.records = []
+
+    def emit(self, record):
+        try:
+            self.records.append([record.levelno, record.getMessage()])
+        except Exception:
+            self.handleError(record)
+
+    def pop_records(self):
+        records = self.records
+        self.records = []
+        return records
+
+class EnrichedOutput(object):
+    """
+    Stream enriched rows to one out_<record_type>.csv file per record type.
+
+    Rows are written as soon as they are produced. To keep all output files
+    aligned with each other (and with the input file), every file receives an
+    empty line for each row which belongs to another record type. Files are only
+    created once the first row of their record type turns up, preceding rows are
+    padded with empty lines at that point.
+    """
+
+    def __init__(self, file_name_template="out_{}.csv"):
+        self.file_name_template = file_name_template
+        self.rows_written = 0
+        self.outputs = {}
+
+    def _open(self, record_type):
+        out = open(self.file_name_template.format(record_type), "w")
+        writer = oat.OpenAPCUnicodeWriter(out, oat.OPENAPC_STANDARD_QUOTEMASK, True, True, True)
+        fields = oat.COLUMN_SCHEMAS[record_type]
+        writer.write_row(list(fields))
+        for _ in range(self.rows_written):
+            writer.write_row(["" for x in fields])
+        self.outputs[record_type] = (out, writer)
+
+    def write(self, result_type, enriched_row):
+        if result_type not in self.outputs:
+            self._open(result_type)
+        for record_type, (_, writer) in self.outputs.items():
+            if record_type == result_type:
+                writer.write_row(enriched_row)
+            else:
+                writer.write_row(["" for x in oat.COLUMN_SCHEMAS[record_type]])
+        self.rows_written += 1
+
+    def close(self):
+        for out, _ in self.outputs.values():
+            out.close()
+
 # This reflects the OpenAPC update strategy for the core data / TransAgree files.
 # In general, only article-related data will be updated retroactively, while journal-related
 # data is persistent after first enrichment. Note that the values for ut and issn_l are only
@@ -235,9 +369,10 @@ ARG_HELP_STRINGS = {
                         "Providing additional ISBNs for other variants/editions of a " +
                         "book can be helpful during metadata discovery. These columns won't " +
                         "be mapped to the output file.",
-    "crossref_max_retries": "Maximum number of attempts to retry a crossref " +
-                            "query for a single line if a 504 Error (Gateway " +
-                            "Timeout) is encountered",
+    "crossref_max_retries": "Maximum number of attempts to retry a metadata API " +
+                            "request if a 429 (Too Many Requests) or 5xx error " +
+                            "is encountered. Retries use an exponential backoff " +
+                            "and honour the Retry-After header.",
     "url": "Manually identify the 'url' column if the script fails to detect " +
            "it automatically. The value is the numerical column index in the " +
            "CSV file, with the leftmost column being 0. This is an optional " +
@@ -247,9 +382,73 @@ ARG_HELP_STRINGS = {
              "number. May be used together with '-end' to select a specific " +
              "segment.",
     "end": "Do not process the whole file, but end at this line number. May " +
-           "be used together with '-start' to select a specific segment."
+           "be used together with '-start' to select a specific segment.",
+    "workers": "Number of worker threads used to query the metadata APIs. If " +
+               "larger than 1, Crossref and Pubmed metadata for all DOIs will " +
+               "be fetched concurrently before the actual enrichment starts. " +
+               "Overwrite conflicts will still be resolved line by line afterwards.",
+    "cache_dir": "Store raw Crossref and Pubmed responses in a persistent cache " +
+                 "in this directory. Repeated lookups of the same DOIs (in later " +
+                 "runs for example) will be served from the cache. Lookups which " +
+                 "resulted in a 404 error are cached as well.",
+    "cache_ttl": "Number of days after which cached responses expire (default: " +
+                 "30). Use 0 to never let cache entries expire. Only has an " +
+                 "effect together with --cache-dir.",
+    "offline": "Do not query any metadata APIs, serve Crossref and Pubmed " +
+               "lookups from the cache only. Requires --cache-dir.",
+    "resume": "Resume an interrupted enrichment run. Every enriched line is " +
+              "recorded in a journal file (tempfiles/<csv_file>.journal). With " +
+              "this option, lines already found in the journal will not be " +
+              "enriched again, but their warnings and errors are shown again. " +
+              "Make sure to use the same arguments as in the interrupted run. " +
+              "Resuming is refused if the CSV file has been changed.",
+    "http_pool_size": "Max number of persistent connections to keep open per " +
+                      "metadata API host (default: " + str(oat.HTTP_POOL_SIZE) +
+                      "). Should be at least as large as the number of workers.",
+    "http_timeout": "Timeout in seconds for metadata API requests (default: " +
+                    str(oat.HTTP_TIMEOUT) + ").",
+    "crossref_batch_size": "If larger than 1, look up DOIs in batches of this size " +
+                           "using the Crossref REST API (JSON) before the actual " +
+                           "enrichment starts, which requires far fewer requests. " +
+                           "A value of 50 is a good choice. DOIs from failed batch " +
+                           "requests will be looked up individually.",
+    "pubmed_batch_size": "If larger than 1, look up DOIs in Europe PMC in batches of " +
+                         "this size before the actual enrichment starts. A value of " +
+                         "100 is a good choice.",
+    "check_duplicates": "Check the DOIs and ISBNs of all entries against the " +
+                        "existing OpenAPC data files (APC, TA, BPC and unresolved " +
+                        "duplicates) and log an error for every entry which is " +
+                        "already present. No metadata lookups are performed for " +
+                        "those entries. The identifiers are indexed in " +
+                        "tempfiles/identifier_registry.db, which is updated " +
+                        "automatically when a data file changes."
 }
 
+def _data_rows(reader, has_header, start=None, end=None):
+    """
+    Yield (line number, row) tuples for all data rows selected for enrichment.
+
+    Empty lines and a possible header are skipped, as are lines outside the
+    range given by start and end.
+    """
+    header_processed = False
+    row_num = 0
+    for row in reader:
+        row_num += 1
+        if not row:
+            continue # skip empty lines
+        if not header_processed:
+            header_processed = True
+            if has_header:
+                # If the CSV file has a header, we are currently there - skip it
+                # to get to the first data row
+                continue
+        if start and start > row_num:
+            continue
+        if end and end < row_num:
+            continue
+        yield (row_num, row)
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("csv_file", help=ARG_HELP_STRINGS["csv_file"])
@@ -314,6 +513,25 @@ def main():
                         help=ARG_HELP_STRINGS["crossref_max_retries"])
     parser.add_argument("-start", type=int, help=ARG_HELP_STRINGS["start"])
     parser.add_argument("-end", type=int, help=ARG_HELP_STRINGS["end"])
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help=ARG_HELP_STRINGS["workers"])
+    parser.add_argument("--cache-dir", help=ARG_HELP_STRINGS["cache_dir"])
+    parser.add_argument("--cache-ttl", type=int, default=30,
+                        help=ARG_HELP_STRINGS["cache_ttl"])
+    parser.add_argument("--offline", action="store_true",
+                        help=ARG_HELP_STRINGS["offline"])
+    parser.add_argument("--resume", action="store_true",
+                        help=ARG_HELP_STRINGS["resume"])
+    parser.add_argument("--http-pool-size", type=int, default=oat.HTTP_POOL_SIZE,
+                        help=ARG_HELP_STRINGS["http_pool_size"])
+    parser.add_argument("--http-timeout", type=int, default=oat.HTTP_TIMEOUT,
+                        help=ARG_HELP_STRINGS["http_timeout"])
+    parser.add_argument("--crossref-batch-size", type=int, default=1,
+                        help=ARG_HELP_STRINGS["crossref_batch_size"])
+    parser.add_argument("--pubmed-batch-size", type=int, default=1,
+                        help=ARG_HELP_STRINGS["pubmed_batch_size"])
+    parser.add_argument("--check-duplicates", action="store_true",
+                        help=ARG_HELP_STRINGS["check_duplicates"])
 
     args = parser.parse_args()
 
@@ -323,6 +541,8 @@ def main():
     bufferedHandler.setFormatter(oat.ANSIColorFormatter())
     logging.root.addHandler(handler)
     logging.root.addHandler(bufferedHandler)
+    row_log = RowLogCollector()
+    logging.root.addHandler(row_log)
     logging.root.setLevel(logging.INFO)
 
     if args.locale:
@@ -625,6 +845,25 @@ def main():
         oat.print_r("ERROR: Unindexed update mode (-U) requires the 'indexed_in_crossref' column!")
         sys.exit()
 
+    if args.workers < 1:
+        oat.print_r("ERROR: The number of workers (-w) must be at least 1!")
+        sys.exit()
+
+    oat.HTTP_SESSION = oat.HTTPSession(args.http_pool_size, args.http_timeout,
+                                       args.crossref_max_retries)
+
+    if args.offline and not args.cache_dir:
+        oat.print_r("ERROR: Offline mode (--offline) requires a cache directory (--cache-dir)!")
+        sys.exit()
+
+    if args.cache_dir:
+        ttl = args.cache_ttl * 24 * 60 * 60 if args.cache_ttl > 0 else None
+        oat.RESPONSE_CACHE = oat.HTTPResponseCache(args.cache_dir, ttl, ttl, args.offline)
+        msg = "Using HTTP response cache in '{}'"
+        if args.offline:
+            msg += " (offline mode)"
+        oat.print_g(msg.format(args.cache_dir))
+
     start = input("\nStart metadata aggregation? (y/n):")
     while start not in ["y", "n"]:
         start = input("Please type 'y' or 'n':")
@@ -633,40 +872,63 @@ def main():
 
     print("\n    *** Starting metadata aggregation ***\n")
 
-    enriched_content = {}
-    for record_type, fields in oat.COLUMN_SCHEMAS.items():
-        # add headers
-        enriched_content[record_type] = {
-            "count": 0,
-            "content": [list(fields)]
-        }
+    enriched_output = EnrichedOutput()
 
     if not os.path.isdir("tempfiles"):
         os.mkdir("tempfiles")
     isbn_handling = oat.ISBNHandling("tempfiles/ISBNRangeFile.xml")
     doab_analysis = oat.DOABAnalysis(isbn_handling, "tempfiles/DOAB.csv", verbose=False)
     doaj_analysis = oat.DOAJAnalysis("tempfiles/DOAJ.csv")
+    identifier_registry = None
+    if args.check_duplicates:
+        oat.print_b("Updating identifier registry...")
+        identifier_registry = oat.IdentifierRegistry()
+
+    journal_path = os.path.join("tempfiles", os.path.basename(args.csv_file) + ".journal")
+    try:
+        journal = EnrichmentJournal(journal_path, args.csv_file, args.resume)
+    except ValueError as ve:
+        oat.print_r("ERROR: " + str(ve))
+        sys.exit()
+    if args.resume:
+        msg = "Resuming enrichment, {} lines already processed according to journal '{}'"
+        oat.print_g(msg.format(len(journal.finished_rows), journal_path))
+
+    prefetched_metadata = {}
+    doi_index = column_map["doi"].index
+    prefetch = args.workers > 1 or args.crossref_batch_size > 1 or args.pubmed_batch_size > 1
+    if prefetch and doi_index is not None and not (args.no_crossref and args.no_pubmed):
+        msg = "Prefetching Crossref/Pubmed metadata using {} workers..."
+        oat.print_b(msg.format(args.workers))
+        dois = []
+        csv_file.seek(0)
+        reader = csv.reader(csv_file, dialect=dialect)
+        for row_num, row in _data_rows(reader, has_header, args.start, args.end):
+            if len(row) != num_columns or journal.get(row_num) is not None:
+                continue
+            if args.unindexed_only and row[column_map["indexed_in_crossref"].index] == "TRUE":
+                continue
+            if identifier_registry is not None and identifier_registry.lookup_doi(row[doi_index]):
+                continue
+            dois.append(row[doi_index])
+        prefetched_metadata = oat.prefetch_metadata(dois, args.workers, args.no_crossref,
+                                                    args.no_pubmed, args.crossref_batch_size,
+                                                    args.pubmed_batch_size)
 
     csv_file.seek(0)
     reader = csv.reader(csv_file, dialect=dialect)
-    header_processed = False
-    row_num = 0
 
-    for row in reader:
-        row_num += 1
-        if not row:
-            continue # skip empty lines
-        if not header_processed:
-            header_processed = True
-            if has_header:
-                # If the CSV file has a header, we are currently there - skip it
-                # to get to the first data row
-                continue
-        if args.start and args.start > row_num:
-            continue
-        if args.end and args.end < row_num:
+    for row_num, row in _data_rows(reader, has_header, args.start, args.end):
+        journal_entry = journal.get(row_num)
+        if journal_entry is not None:
+            result_type, enriched_row, log = journal_entry
+            for level, message in log:
+                logging.log(level, message)
+            row_log.pop_records()
+            enriched_output.write(result_type, enriched_row)
             continue
         print("---Processing line number " + str(row_num) + "---")
+        row_log.pop_records()
         no_crossref = args.no_crossref
         no_pubmed = args.no_pubmed
         no_doaj = args.no_doaj
@@ -680,22 +942,15 @@ def main():
         result_type, enriched_row = oat.process_row(row, row_num, column_map, num_columns, additional_isbn_columns, doab_analysis, doaj_analysis,
                                                     no_crossref, no_pubmed,
                                                     no_doaj, args.round_monetary,
-                                                    args.offsetting_mode, args.crossref_max_retries)
-        for record_type, value in enriched_content.items():
-            if record_type == result_type:
-                value["content"].append(enriched_row)
-                value["count"] += 1
-            else:
-                empty_line = ["" for x in value["content"][0]]
-                value["content"].append(empty_line)
+                                                    args.offsetting_mode, prefetched_metadata,
+                                                    identifier_registry)
+        journal.append(row_num, result_type, enriched_row, row_log.pop_records())
+        enriched_output.write(result_type, enriched_row)
     csv_file.close()
-
-    for record_type, value in enriched_content.items():
-        if value["count"] > 0:
-            with open('out_' + record_type + '.csv', 'w') as out:
-                writer = oat.OpenAPCUnicodeWriter(out, oat.OPENAPC_STANDARD_QUOTEMASK, 
-                                                  True, True, True)
-                writer.write_rows(value["content"])
+    journal.close()
+    enriched_output.close()
+    if identifier_registry is not None:
+        identifier_registry.close()
 
     if not bufferedHandler.buffer:
         oat.print_g("Metadata enrichment successful, no errors occured")
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""
+Per-journal APC statistics for the OpenAPC core data.
+
+The euro, journal and institution columns are extracted once. Count, mean and
+standard deviation of the APCs are computed for all journals in a single
+grouped pass, which allows to check the costs of all institutions at once.
+NumPy is used for the computations if available, otherwise the same values
+are computed in pure Python.
+"""
+
+from collections import OrderedDict
+from math import nan, sqrt
+
+import openapc_toolkit as oat
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Column indices in the core data file
+INSTITUTION = 0
+EURO = 2
+DOI = 3
+JOURNAL = 6
+
+# Journals with fewer articles in the data are not checked for deviations
+MIN_JOURNAL_ARTICLES = 20
+# Costs are significantly different if they deviate more than this many
+# standard deviations from the journal mean
+SIGNIFICANCE_THRESHOLD = 2
+
+class APCStatistics(object):
+    """
+    Grouped APC statistics over the rows of the core data file.
+
+    Args:
+        apc_content: The rows of the core data file (as lists, without header).
+                     Rows found to have significant cost differences are
+                     extended by the statistical values, as expected by
+                     generate_apc_report.py.
+    """
+
+    def __init__(self, apc_content):
+        self.apc_content = apc_content
+        self.journal_ids = {}
+        self.rows_by_institution = OrderedDict()
+        row_journals = []
+        euros = []
+        for num, line in enumerate(apc_content):
+            journal_id = self.journal_ids.setdefault(line[JOURNAL], len(self.journal_ids))
+            row_journals.append(journal_id)
+            euros.append(float(line[EURO]))
+            self.rows_by_institution.setdefault(line[INSTITUTION], []).append(num)
+        if numpy is not None:
+            self._compute_numpy(row_journals, euros)
+        else:
+            self._compute_python(row_journals, euros)
+
+    def _compute_numpy(self, row_journals, euros):
+        journal_ids = numpy.array(row_journals, dtype=numpy.intp)
+        euros = numpy.array(euros, dtype=numpy.float64)
+        num_journals = len(self.journal_ids)
+        # bincount sums up the weights in row order, so the results are
+        # identical to the ones of the pure Python implementation.
+        counts = numpy.bincount(journal_ids, minlength=num_journals)
+        means = numpy.bincount(journal_ids, weights=euros, minlength=num_journals) / counts
+        row_means = means[journal_ids]
+        squares = numpy.bincount(journal_ids, weights=(euros - row_means)**2,
+                                 minlength=num_journals)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            stddevs = numpy.sqrt(squares / (counts - 1))
+        stddevs[counts == 1] = nan
+        row_counts = counts[journal_ids]
+        row_stddevs = stddevs[journal_ids]
+        self.counts = counts.tolist()
+        self.means = means.tolist()
+        self.stddevs = stddevs.tolist()
+        self.checked = (row_counts >= MIN_JOURNAL_ARTICLES).tolist()
+        significant = numpy.abs(euros - row_means) > SIGNIFICANCE_THRESHOLD * row_stddevs
+        self.significant = significant.tolist()
+        self.row_journals = row_journals
+
+    def _compute_python(self, row_journals, euros):
+        num_journals = len(self.journal_ids)
+        counts = [0] * num_journals
+        sums = [0.0] * num_journals
+        for journal_id, euro in zip(row_journals, euros):
+            counts[journal_id] += 1
+            sums[journal_id] += euro
+        means = [total / count for total, count in zip(sums, counts)]
+        squares = [0.0] * num_journals
+        for journal_id, euro in zip(row_journals, euros):
+            squares[journal_id] += (euro - means[journal_id])**2
+        stddevs = [sqrt(total / (count - 1)) if count > 1 else nan
+                   for total, count in zip(squares, counts)]
+        self.counts = counts
+        self.means = means
+        self.stddevs = stddevs
+        self.checked = [counts[journal_id] >= MIN_JOURNAL_ARTICLES for journal_id in row_journals]
+        self.significant = [abs(euro - means[journal_id]) > SIGNIFICANCE_THRESHOLD * stddevs[journal_id]
+                            for journal_id, euro in zip(row_journals, euros)]
+        self.row_journals = row_journals
+
+    def get_journal_stats(self, journal):
+        """
+        Return count, mean and standard deviation of the APCs for a journal.
+
+        The standard deviation is nan for journals with only one article.
+        Returns None for journals not occuring in the data.
+        """
+        journal_id = self.journal_ids.get(journal)
+        if journal_id is None:
+            return None
+        return self.counts[journal_id], self.means[journal_id], self.stddevs[journal_id]
+
+    def get_institutions(self):
+        return list(self.rows_by_institution.keys())
+
+    def find_significant_differences(self, institution, verbose=False):
+        """
+        Find all articles of an institution with significantly differing costs.
+
+        Args:
+            institution: An institution as found in the institution column.
+            verbose: Print the result for every single article.
+
+        Returns:
+            A tuple of a list with the significantly differing articles and a
+            stats dict. The article rows are extended by rounded mean,
+            rounded standard deviation, absolute difference, difference in
+            standard deviations and the number of articles of the journal.
+        """
+        stats = {
+            "articles": 0,
+            "not_checked": 0,
+            "within_limits": 0,
+            "significant": 0
+        }
+        sig_articles = []
+        for num in self.rows_by_institution.get(institution, []):
+            article = self.apc_content[num]
+            journal_id = self.row_journals[num]
+            apc = article[EURO]
+            doi = article[DOI]
+            title = article[JOURNAL]
+            count = self.counts[journal_id]
+            stats["articles"] += 1
+            if not self.checked[num]:
+                if verbose:
+                    msg = 'Article {}, journal "{}": Could not check costs, too few occurences ({})'
+                    oat.print_b(msg.format(doi, title, count))
+                stats["not_checked"] += 1
+                continue
+            if self.significant[num]:
+                rounded_mean = round(self.means[journal_id], 2)
+                rounded_stddev = round(self.stddevs[journal_id], 2)
+                diff_absolute = round(float(apc) - rounded_mean, 2)
+                diff_times_stddev = round(diff_absolute / rounded_stddev, 2)
+                if verbose:
+                    msg = ('Article {}, journal "{}": Cost ({}€) differs more than 2 standard ' +
+                           'deviations (2 * {}€) from mean APC ({}€)')
+                    oat.print_y(msg.format(doi, title, apc, rounded_stddev, rounded_mean))
+                stats["significant"] += 1
+                article.append(rounded_mean)
+                article.append(rounded_stddev)
+                article.append(diff_absolute)
+                article.append(diff_times_stddev)
+                article.append(count)
+                sig_articles.append(article)
+            else:
+                if verbose:
+                    msg = ('Article {}, journal "{}": No significant cost difference ({}€, mean ' +
+                           'APC is {}€)')
+                    oat.print_g(msg.format(doi, title, apc, round(self.means[journal_id], 2)))
+                stats["within_limits"] += 1
+        if verbose:
+            oat.print_g("\nAnalysis finished, results:")
+            for key, value in stats.items():
+                oat.print_g(key + ": " + str(value))
+        return sig_articles, stats
+
+    def find_all_significant_differences(self, verbose=False):
+        """
+        Run find_significant_differences for all institutions in the data.
+
+        Returns:
+            An OrderedDict mapping each institution to its result tuple.
+        """
+        results = OrderedDict()
+        for institution in self.rows_by_institution:
+            results[institution] = self.find_significant_differences(institution, verbose)
+        return results
@@ -3,6 +3,7 @@
 
 import argparse
 import codecs
+import os
 import re
 import sys
 
@@ -69,40 +70,43 @@ def main():
             sys.exit()
         mask = [True if x == "t" else False for x in args.quotemask]
     
-    header, content = oat.get_csv_file_content(args.csv_file, enc)
+    header, content = oat.iterate_csv_file(args.csv_file, enc)
     correction_schema = None
     for schema_type, schema in oat.COLUMN_SCHEMAS.items():
-        if header[0] == schema:
+        if header and header[0] == schema:
             oat.print_g("Schema autodetection: " + schema_type)
             correction_schema = CORRECTION_SCHEMAS[schema_type]
             break
     else:
         oat.print_r("Error: CSV header does not match any known OpenAPC data schema")
+        sys.exit()
 
     line_num = 1
-    for line in content:
-        for tup in correction_schema:
-            if tup[0] == "publisher":
-                index = tup[1]
-                publisher = line[index]
-                publisher_new = oat.get_unified_publisher_name(publisher)
-                if publisher_new != publisher:
-                    line[index] = publisher_new
-                    msg = u"Line {}: Updated publisher name ({} -> {})"
-                    oat.print_g(msg.format(line_num, publisher, publisher_new))
-            if tup[0] == "journal_full_title":
-                index = tup[1]
-                journal = line[index]
-                journal_new = oat.get_unified_journal_title(journal)
-                if journal_new != journal:
-                    line[index] = journal_new
-                    msg = u"Line {}: Updated journal_full_title ({} -> {})"
-                    oat.print_g(msg.format(line_num, journal, journal_new))
-        line_num += 1
-    
-    with open('out.csv', 'w') as out:
+    with open('out.csv.part', 'w') as out:
         writer = oat.OpenAPCUnicodeWriter(out, mask, quote_rules, True)
-        writer.write_rows(header + content)
+        for line in header:
+            writer.write_row(line)
+        for line in content:
+            for tup in correction_schema:
+                if tup[0] == "publisher":
+                    index = tup[1]
+                    publisher = line[index]
+                    publisher_new = oat.get_unified_publisher_name(publisher)
+                    if publisher_new != publisher:
+                        line[index] = publisher_new
+                        msg = u"Line {}: Updated publisher name ({} -> {})"
+                        oat.print_g(msg.format(line_num, publisher, publisher_new))
+                if tup[0] == "journal_full_title":
+                    index = tup[1]
+                    journal = line[index]
+                    journal_new = oat.get_unified_journal_title(journal)
+                    if journal_new != journal:
+                        line[index] = journal_new
+                        msg = u"Line {}: Updated journal_full_title ({} -> {})"
+                        oat.print_g(msg.format(line_num, journal, journal_new))
+            writer.write_row(line)
+            line_num += 1
+    os.replace('out.csv.part', 'out.csv')
 
 if __name__ == '__main__':
     main()
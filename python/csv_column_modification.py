@@ -4,6 +4,8 @@
 import argparse
 import codecs
 import csv
+from itertools import chain
+import os
 import sys
 
 import openapc_toolkit as oat
@@ -73,7 +75,7 @@ def main():
                    "guessing.")
             sys.exit()
     
-    header, content = oat.get_csv_file_content(args.csv_file, enc)
+    header, content = oat.iterate_csv_file(args.csv_file, enc)
 
     mask = None
     if args.quotemask:
@@ -86,19 +88,20 @@ def main():
     
     new_rows = args.func(header, content, args)
     
-    with open('out.csv', 'w') as out:
+    with open('out.csv.part', 'w') as out:
         writer = oat.OpenAPCUnicodeWriter(out, mask, quote_rules, True)
-        writer.write_rows(new_rows)
+        for row in new_rows:
+            writer.write_row(row)
+    os.replace('out.csv.part', 'out.csv')
         
 def quote_column(header, content, args):
-    new_rows = header
+    yield from header
     for row in content:
         row[args.column_index] = '"' + row[args.column_index] + '"'
-        new_rows.append(row)
-    return new_rows
+        yield row
 
 def unquote_column(header, content, args):
-    new_rows = header
+    yield from header
     for row in content:
         value = row[args.column_index]
         if value.startswith('"'):
@@ -106,40 +109,30 @@ def unquote_column(header, content, args):
         if value.endswith('"'):
             value = value[:-1]
         row[args.column_index] = value
-        new_rows.append(row)
-    return new_rows
+        yield row
     
 def move_column(header, content, args):
-    new_rows = []
-    merged = header + content
-    for row in merged:
+    for row in chain(header, content):
         if len(row) > 0:
             row.insert(args.target_index, row.pop(args.column_index))
-        new_rows.append(row)
-    return new_rows
+        yield row
     
 def delete_column(header, content, args):
-    new_rows = []
-    merged = header + content
-    for row in merged:
+    for row in chain(header, content):
         if len(row) > 0:
             row.pop(args.column_index)
-        new_rows.append(row)
-    return new_rows
+        yield row
     
 def insert_column(header, content, args):
     header[0].insert(args.target_index, args.column_name)
-    new_rows = header
+    yield from header
     for row in content:
         row.insert(args.target_index, args.default_value)
-        new_rows.append(row)
-    return new_rows
+        yield row
     
 def copy(header, content, _):
-    new_rows = header
-    for row in content:
-        new_rows.append(row)
-    return new_rows
+    yield from header
+    yield from content
 
 if __name__ == '__main__':
     main()
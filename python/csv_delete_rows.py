@@ -3,8 +3,8 @@
 
 import argparse
 import codecs
-import copy
 import csv
+from itertools import chain
 import os
 import sys
 
@@ -101,7 +101,7 @@ def main():
                    "guessing.")
             sys.exit()
             
-    header, content = oat.get_csv_file_content(args.csv_file, enc)
+    header, content = oat.iterate_csv_file(args.csv_file, enc)
         
     mask = None
     if args.quotemask:
@@ -112,45 +112,50 @@ def main():
             sys.exit()
         mask = [True if x == "t" else False for x in args.quotemask]
     
-    empty_line = ['' for element in content[0]]
     column_name = "column " + str(args.index)
     if header:
         header_line = header[0]
         column_name = header_line[args.index]
         empty_line = ['' for element in header_line]
+    else:
+        first_line = next(content)
+        empty_line = ['' for element in first_line]
+        content = chain([first_line], content)
     msg = u"Performing line deletion on condition '{}' in {}".format(column_name, values)
     oat.print_g(msg)
     
-    modified_content = []
-    deleted_lines = []
     num_total_lines = num_deleted_lines = 0
-    for line in content:
-        if len(line) == 0:
-            continue
-        num_total_lines += 1
-        current_value = line[args.index]
-        if args.ignore_case:
-            current_value = current_value.lower()
-        if current_value not in values:
-            modified_content.append(line)
-        else:
-            num_deleted_lines += 1
-            if not args.full_delete:
-                modified_content.append(list(empty_line))
-            if args.results_file:
-                deleted_lines.append(line)
+    deleted_out = None
+    with open('out.csv.part', 'w') as out:
+        writer = oat.OpenAPCUnicodeWriter(out, mask, quote_rules, False)
+        for header_line in header:
+            writer.write_row(list(header_line))
+        for line in content:
+            if len(line) == 0:
+                continue
+            num_total_lines += 1
+            current_value = line[args.index]
+            if args.ignore_case:
+                current_value = current_value.lower()
+            if current_value not in values:
+                writer.write_row(line)
+            else:
+                num_deleted_lines += 1
+                if not args.full_delete:
+                    writer.write_row(list(empty_line))
+                if args.results_file:
+                    if deleted_out is None:
+                        deleted_out = open('del.csv', 'w')
+                        deleted_writer = oat.OpenAPCUnicodeWriter(deleted_out, mask, quote_rules, False)
+                        for header_line in header:
+                            deleted_writer.write_row(list(header_line))
+                    deleted_writer.write_row(line)
+    os.replace('out.csv.part', 'out.csv')
+    if deleted_out is not None:
+        deleted_out.close()
             
     msg = u"Process complete, deleted {} out of {} total lines"        
     oat.print_g(msg.format(num_deleted_lines, num_total_lines))
-    
-    with open('out.csv', 'w') as out:
-        writer = oat.OpenAPCUnicodeWriter(out, mask, quote_rules, False)
-        writer.write_rows(copy.deepcopy(header) + modified_content)
-
-    if args.results_file and len(deleted_lines) > 0:
-        with open('del.csv', 'w') as out:
-            writer = oat.OpenAPCUnicodeWriter(out, mask, quote_rules, False)
-            writer.write_rows(copy.deepcopy(header) + deleted_lines)
 
 
 if __name__ == '__main__':
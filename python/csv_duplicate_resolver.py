@@ -2,18 +2,16 @@
 # -*- coding: UTF-8 -*-
 
 import argparse
+from itertools import chain
 import os
 import sys
 
-import json
-
 import openapc_toolkit as oat
 
 UD_FILE = "../data/unresolved_duplicates.csv"
 
 EMPTY_LINE = ["NA","","NA","NA","NA","NA","NA","NA","NA","NA","NA","NA","FALSE","NA","NA","NA","NA","NA"]
 QUOTE_MASK = [True, False, False, True, True, True, True, True, True, True, True, True, True, True, True, True, True, True]
-REPLACEMENT = "---replace---"
 
 ARG_HELP_STRINGS = {
     "new_file": "The new data file to be integrated into the target data file. Must be duplicate-free itself.",
@@ -43,29 +41,36 @@ def main():
         if not os.path.isfile(path):
             oat.print_r('Error: "' + path + '" is no valid file path!')
             sys.exit()
-        ENRICHED_FILES[path] = {"modified": False, "file_name": get_filename(path)}
-        ENRICHED_FILES[path]["header"], ENRICHED_FILES[path]["content"] = oat.get_csv_file_content(path, enc="utf-8", force_header=True)
-        
+        # Row indices to be replaced by an empty line
+        ENRICHED_FILES[path] = {"deleted": set(), "file_name": get_filename(path)}
     
-    target_header, target_content = oat.get_csv_file_content(args.target_file, enc="utf-8", force_header=True)
     new_header, new_content = oat.get_csv_file_content(args.new_file, enc="utf-8", force_header=True)
     ud_header, ud_content = oat.get_csv_file_content(UD_FILE, enc="utf-8", force_header=True)
+    new_dois = {line[3] for line in new_content if line[3] != "NA"}
     
-    duplicates = []
-    target_dois = [line[3] for line in target_content]
+    # Only rows sharing a DOI with the new file are kept in memory
+    target_index = {}
+    _, target_rows = oat.iterate_csv_file(args.target_file, enc="utf-8", force_header=True)
+    for index, line in enumerate(target_rows):
+        doi = line[3]
+        if doi in new_dois and doi not in target_index:
+            target_index[doi] = (index, line)
     
+    duplicates = []
     for new_index, line in enumerate(new_content):
         doi = line[3]
-        if doi == "NA" or doi not in target_dois:
+        if doi == "NA" or doi not in target_index:
             continue
         else:
-            target_index = get_duplicate_index(target_content, doi)
-            duplicates.append((new_index, target_index))
+            duplicates.append((new_index, target_index[doi]))
     
+    enriched_index = get_enriched_index({target_line[3] for _, (_, target_line) in duplicates})
+    
+    deleted_new_rows = set()
+    deleted_target_rows = set()
     count = 0
-    for pair in duplicates:
-        new_line = new_content[pair[0]]
-        target_line = target_content[pair[1]]
+    for new_index, (target_row_index, target_line) in duplicates:
+        new_line = new_content[new_index]
         doi = target_line[3]
         new_cost = float(new_line[2])
         target_cost = float(target_line[2])
@@ -81,66 +86,82 @@ def main():
         if new_line[0] != target_line[0]:
             msg = 'Institutional mismatch "{}"/"{}". Lines will be deleted and added to the unresolved duplicates file.'
             oat.print_r(msg.format(new_line[0],target_line[0]))
-            new_content[pair[0]] = list(EMPTY_LINE)
-            target_content[pair[1]] = REPLACEMENT
+            deleted_new_rows.add(new_index)
+            deleted_target_rows.add(target_row_index)
             ud_content += [target_line]
             ud_content += [new_line]
-            path, index = find_in_enriched_files(doi)
-            ENRICHED_FILES[path]["content"][index] = list(EMPTY_LINE)
-            ENRICHED_FILES[path]["modified"] = True
+            path, index = find_in_enriched_files(doi, enriched_index)
+            ENRICHED_FILES[path]["deleted"].add(index)
         elif deviation <= args.cost_tolerance:
             msg = "Cost deviation between {} and {} is below tolerance threshold ({} <= {}). Entries are treated as equal, only the new one will be deleted."
             oat.print_g(msg.format(new_cost, target_cost, deviation, args.cost_tolerance))
-            new_content[pair[0]] = list(EMPTY_LINE)
+            deleted_new_rows.add(new_index)
         else:
             msg = "Cost deviation between {} and {} exceeds tolerance threshold ({} > {}). Entries are treated as different, both will be deleted."
             oat.print_y(msg.format(new_cost, target_cost, deviation, args.cost_tolerance))
-            new_content[pair[0]] = list(EMPTY_LINE)
-            target_content[pair[1]] = REPLACEMENT
-            path, index = find_in_enriched_files(doi)
-            ENRICHED_FILES[path]["content"][index] = list(EMPTY_LINE)
-            ENRICHED_FILES[path]["modified"] = True
+            deleted_new_rows.add(new_index)
+            deleted_target_rows.add(target_row_index)
+            path, index = find_in_enriched_files(doi, enriched_index)
+            ENRICHED_FILES[path]["deleted"].add(index)
         count += 1
         if args.batch and count >= args.batch:
             break
 
-    while REPLACEMENT in target_content:
-        target_content.remove(REPLACEMENT)
-    
-    with open(args.target_file, 'w') as out:
-        writer = oat.OpenAPCUnicodeWriter(out, QUOTE_MASK, True, True)
-        writer.write_rows(target_header + target_content)
-    with open(args.new_file, 'w') as out:
-        writer = oat.OpenAPCUnicodeWriter(out, QUOTE_MASK, True, True)
-        writer.write_rows(new_header + new_content)
-    with open(UD_FILE, 'w') as out:
-        writer = oat.OpenAPCUnicodeWriter(out, QUOTE_MASK, True, True)
-        writer.write_rows(ud_header + ud_content)
+    # Deleted rows are removed from the target file, but replaced by empty lines in all other files
+    target_header, target_rows = oat.iterate_csv_file(args.target_file, enc="utf-8", force_header=True,
+                                                      print_results=False)
+    target_rows = (line for index, line in enumerate(target_rows) if index not in deleted_target_rows)
+    rewrite_file(args.target_file, target_header, target_rows)
+    new_rows = (list(EMPTY_LINE) if index in deleted_new_rows else line for index, line in enumerate(new_content))
+    rewrite_file(args.new_file, new_header, new_rows)
+    rewrite_file(UD_FILE, ud_header, ud_content)
     for path, enriched_file in ENRICHED_FILES.items():
-        if enriched_file["modified"]:
-            with open(path, 'w') as out:
-                writer = oat.OpenAPCUnicodeWriter(out, QUOTE_MASK, True, True)
-                writer.write_rows(enriched_file["header"] + enriched_file["content"])
-    
+        deleted = enriched_file["deleted"]
+        if deleted:
+            header, rows = oat.iterate_csv_file(path, enc="utf-8", force_header=True, print_results=False)
+            rows = (list(EMPTY_LINE) if index in deleted else line for index, line in enumerate(rows))
+            rewrite_file(path, header, rows)
+
+def rewrite_file(path, header, rows):
+    """
+    Write header and rows to a file, replacing it only after all rows have been written.
+
+    rows may be a generator reading from the file itself.
+    """
+    with open(path + ".part", 'w') as out:
+        writer = oat.OpenAPCUnicodeWriter(out, QUOTE_MASK, True, True)
+        writer.write_rows(chain(header, rows))
+    os.replace(path + ".part", path)
         
 def get_filename(path):
     base_name = os.path.basename(path)
     return os.path.splitext(base_name)[0]
+
+def get_enriched_index(dois):
+    """
+    Map DOIs to the path and row index of their first occurence in the enriched files.
+
+    Args:
+        dois: A set of DOIs, other DOIs are not indexed.
+    """
+    enriched_index = {}
+    if not dois:
+        return enriched_index
+    for path in ENRICHED_FILES:
+        _, rows = oat.iterate_csv_file(path, enc="utf-8", force_header=True)
+        for index, line in enumerate(rows):
+            doi = line[3]
+            if doi in dois and doi not in enriched_index:
+                enriched_index[doi] = (path, index)
+    return enriched_index
     
-def find_in_enriched_files(doi):
-    for path, enriched_file in ENRICHED_FILES.items():
-        for index, line in enumerate(enriched_file["content"]):
-            if line[3] == doi:
-                msg = "DOI {} found in enriched file {}".format(doi, enriched_file["file_name"])
-                oat.print_b(msg)
-                return (path, index)
-    raise ValueError("DOI " + doi + " not found in any enriched file!")
-        
-def get_duplicate_index(content, doi):
-    for index, line in enumerate(content):
-        if line[3] == doi:
-            return index
-    raise ValueError("DOI " + doi + " not found while searching for index.")
+def find_in_enriched_files(doi, enriched_index):
+    if doi not in enriched_index:
+        raise ValueError("DOI " + doi + " not found in any enriched file!")
+    path, index = enriched_index[doi]
+    msg = "DOI {} found in enriched file {}".format(doi, ENRICHED_FILES[path]["file_name"])
+    oat.print_b(msg)
+    return (path, index)
 
 if __name__ == '__main__':
     main()
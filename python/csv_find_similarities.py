@@ -2,7 +2,9 @@
 # -*- coding: UTF-8 -*-
 
 import argparse
+from bisect import bisect_right
 import codecs
+from multiprocessing import Pool
 import sys
 
 from Levenshtein import ratio
@@ -15,9 +17,74 @@ ARG_HELP_STRINGS = {
     "encoding": "The encoding of the CSV file. Setting this argument will " +
                 "disable automatic guessing of encoding.",
     "min_ratio": "The minimum Levenshtein distance ratio between two entities to appear in the " +
-                 "results list"
+                 "results list. Pairs of entities which cannot reach this ratio because of " +
+                 "their difference in length are skipped without calculating the ratio.",
+    "processes": "Number of processes used to calculate the Levenshtein ratios (default: 1)"
 }
 
+# Number of entities per work unit
+CHUNK_SIZE = 200
+
+ENTITIES = None
+ORDER = None
+MIN_RATIO = None
+
+def get_blocks(entities, min_ratio):
+    """
+    Determine the candidate pairs for the Levenshtein ratio calculation.
+
+    The Levenshtein ratio of two strings of lengths l1 <= l2 cannot exceed
+    2 * l1 / (l1 + l2), so any string can only reach min_ratio with strings
+    up to a length of l1 * (2 - min_ratio) / min_ratio. With the entities
+    sorted by length, the candidates for every entity form a contiguous block.
+
+    Args:
+        entities: A list of unique strings.
+        min_ratio: The minimum Levenshtein ratio.
+
+    Returns:
+        A tuple (order, blocks). order is the list of all entity indices sorted by
+        length, blocks contains a tuple (start, end) for every entity, with
+        order[start] being the entity and order[start + 1:end] its candidates.
+    """
+    order = sorted(range(len(entities)), key=lambda i: len(entities[i]))
+    lengths = [len(entities[i]) for i in order]
+    blocks = []
+    for start, length in enumerate(lengths):
+        if min_ratio > 0.0:
+            # a small tolerance, so that no pair right at the bound is missed
+            max_length = length * (2 - min_ratio) / min_ratio + 1e-9
+            end = bisect_right(lengths, max_length, lo=start + 1)
+        else:
+            end = len(lengths)
+        blocks.append((start, end))
+    return (order, blocks)
+
+def _init_worker(entities, order, min_ratio):
+    global ENTITIES, ORDER, MIN_RATIO
+    ENTITIES = entities
+    ORDER = order
+    MIN_RATIO = min_ratio
+
+def _score_chunk(blocks):
+    """
+    Calculate the Levenshtein ratio for the candidate pairs of a list of blocks.
+
+    Returns:
+        A tuple of the number of calculations and a list of (i, j, ratio) tuples
+        (with entity indices i < j) for all pairs passing the minimum ratio.
+    """
+    num_calcs = 0
+    pairs = []
+    for start, end in blocks:
+        first = ORDER[start]
+        for second in ORDER[start + 1:end]:
+            lev_ratio = ratio(ENTITIES[first], ENTITIES[second])
+            num_calcs += 1
+            if lev_ratio >= MIN_RATIO:
+                pairs.append((min(first, second), max(first, second), lev_ratio))
+    return (num_calcs, pairs)
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("csv_file", help=ARG_HELP_STRINGS["csv_file"])
@@ -25,6 +92,8 @@ def main():
     parser.add_argument("-e", "--encoding", help=ARG_HELP_STRINGS["encoding"])
     parser.add_argument("-m", "--min_ratio", type=float, help=ARG_HELP_STRINGS["min_ratio"],
                         default=0.0)
+    parser.add_argument("-p", "--processes", type=int, default=1,
+                        help=ARG_HELP_STRINGS["processes"])
 
     args = parser.parse_args()
 
@@ -51,38 +120,56 @@ def main():
     header = header.pop()
 
     entities = []
+    known_entities = set()
     line_num = 0
     msg = "Processed {} entries in column '{}', {} unique entities found."
     last_msg = None
     for line in content:
         line_num += 1
-        if line[args.index] not in entities:
+        if line[args.index] not in known_entities:
+            known_entities.add(line[args.index])
             entities.append(line[args.index])
         if line_num == len(content) or line_num % 100 == 0:
             last_msg = msg.format(line_num, header[args.index], len(entities))
             print(last_msg, end="\r")
     print(last_msg)
 
-    sim_pairs = []
     n = len(entities) - 1
     num_pairs = int((n*n + n) / 2)
-    msg = ("Calculated Levenshtein ratio for {} out of {} possible entity combinations ({}%), " +
+    order, blocks = get_blocks(entities, args.min_ratio)
+    num_candidates = sum([end - start - 1 for start, end in blocks])
+    msg = "{} out of {} possible entity combinations are candidates after length blocking."
+    oat.print_b(msg.format(num_candidates, num_pairs))
+
+    results = []
+    msg = ("Calculated Levenshtein ratio for {} out of {} candidate combinations ({}%), " +
            "{} have passed the minimum ratio so far.")
     last_msg = None
     num_calcs = 0
-    while entities:
-        first_part = entities.pop(0)
-        for second_part in entities:
-            lev_ratio = ratio(first_part, second_part)
-            num_calcs += 1
-            if lev_ratio >= args.min_ratio:
-                sim_pairs.append([first_part, second_part, str(lev_ratio)])
-            if num_calcs == num_pairs or num_calcs % 100 == 0:
-                last_msg = msg.format(num_calcs, num_pairs, round(num_calcs/num_pairs * 100, 1),
-                                      len(sim_pairs))
-                print(last_msg, end="\r")
+    num_passed = 0
+    chunks = [blocks[i:i + CHUNK_SIZE] for i in range(0, len(blocks), CHUNK_SIZE)]
+    if args.processes > 1:
+        pool = Pool(args.processes, _init_worker, (entities, order, args.min_ratio))
+        chunk_results = pool.imap_unordered(_score_chunk, chunks)
+    else:
+        _init_worker(entities, order, args.min_ratio)
+        chunk_results = map(_score_chunk, chunks)
+    for chunk_calcs, chunk_pairs in chunk_results:
+        num_calcs += chunk_calcs
+        num_passed += len(chunk_pairs)
+        results += chunk_pairs
+        last_msg = msg.format(num_calcs, num_candidates,
+                              round(num_calcs/max(num_candidates, 1) * 100, 1), num_passed)
+        print(last_msg, end="\r")
+    if args.processes > 1:
+        pool.close()
+        pool.join()
     print(last_msg)
 
+    # Restore the order of the exhaustive pairwise comparison, so that pairs
+    # with equal ratios are listed exactly as before.
+    results.sort()
+    sim_pairs = [[entities[i], entities[j], str(lev_ratio)] for i, j, lev_ratio in results]
     sim_pairs.sort(key=lambda x: x[2], reverse=True)
     sim_pairs.insert(0, ["first_item", "second_item", "levenshtein_ratio"])
     with open("out.csv", "w") as out_file:
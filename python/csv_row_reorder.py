@@ -3,6 +3,7 @@
 
 import argparse
 import codecs
+from itertools import chain
 import sys
 
 import openapc_toolkit as oat
@@ -90,28 +91,35 @@ def main():
     if not args.other_csv_file:
         rearranged_content = header + sorted(content, key=lambda x: x[column])
     else:
-        rearranged_content = []
-        _, second_content = oat.get_csv_file_content(args.other_csv_file, enc=encs[1])
+        _, second_content = oat.iterate_csv_file(args.other_csv_file, enc=encs[1])
         other_column = column # default: use same column index as in first file
         if args.other_column:
             other_column = args.other_column
 
+        # Map every key to the indices of all rows sharing it (in original order)
+        key_index = {}
+        for index, row in enumerate(content):
+            key = row[column].lower() if args.ignore_case else row[column]
+            key_index.setdefault(key, []).append(index)
+
+        order = []
         for other_row in second_content:
+            key = other_row[other_column]
             if args.ignore_case:
-                matching_rows = [row for row in content if row[column].lower() == other_row[other_column].lower()]
-            else:
-                matching_rows = [row for row in content if row[column] == other_row[other_column]]
-            rearranged_content += matching_rows
-            for matching_row in matching_rows:
-                content.remove(matching_row)
+                key = key.lower()
+            # pop, so a key repeated in the second file only matches once
+            order += key_index.pop(key, [])
+        matched = set(order)
+        unmatched = [index for index in range(len(content)) if index not in matched]
         unmatched_msg = ("{} rows could not be rearranged (unmatched in second csv file) " +
                          "and were appended to the end of the result file " +
                          "in original order.")
-        if content:
-            oat.print_y(unmatched_msg.format(len(content)))
+        if unmatched:
+            oat.print_y(unmatched_msg.format(len(unmatched)))
         else:
             oat.print_g("All rows matched.")
-        rearranged_content = header + rearranged_content + content # append any unmatched rows
+        # append any unmatched rows
+        rearranged_content = chain(header, (content[index] for index in order + unmatched))
 
     with open('out.csv', 'w') as out:
         writer = oat.OpenAPCUnicodeWriter(out, mask, quote_rules, False)
@@ -3,12 +3,13 @@
 
 import argparse
 import codecs
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import csv
 import locale
+import os
 import sys
 
-import json
-
 import openapc_toolkit as oat
 
 ARG_HELP_STRINGS = {
@@ -20,7 +21,8 @@ ARG_HELP_STRINGS = {
     "locale": "The locale to parse the original file with (important for monetary values)",
     "update_locale": "The locale to parse the update file with",
     "autocreate_mappings": "Create mappings for all matched column pairs without asking for confirmation",
-    "grouping": "Use grouping (thousands separator) when updating euro field values"
+    "grouping": "Use grouping (thousands separator) when updating euro field values",
+    "workers": "Number of worker threads used to resolve shortDOIs (default: 8)"
 }
 
 class Change(object):
@@ -34,6 +36,43 @@ class Change(object):
     def __str__(self):
         return ' Column "{}", {} -> {}'.format(self.field_name, self.old_value, self.new_value)
 
+def _readlines(f):
+    """
+    Yield the lines of a text file using readline().
+
+    Unlike iterating over the file object directly, this keeps f.tell()
+    usable, so a csv reader on top of it can be used to record the offsets
+    of its rows.
+    """
+    while True:
+        line = f.readline()
+        if not line:
+            return
+        yield line
+
+def resolve_short_dois(doi_strings, workers):
+    """
+    Resolve all shortDOIs in a collection of DOI strings concurrently.
+
+    Regular DOIs are normalised locally by oat.get_normalised_DOI, but a
+    shortDOI requires a request to doi.org. Resolving all of them in advance
+    avoids sequential round trips while merging.
+
+    Returns:
+        A dict mapping every shortDOI string to its normalised DOI (or None if
+        it could not be resolved).
+    """
+    short_dois = [doi_string for doi_string in doi_strings if
+                  oat.DOI_RE.match(doi_string.strip()) is None and
+                  oat.SHORTDOI_RE.match(doi_string.strip()) is not None]
+    if not short_dois:
+        return {}
+    msg = "Resolving {} shortDOIs using {} workers..."
+    oat.print_b(msg.format(len(short_dois), workers))
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        results = executor.map(oat.get_normalised_DOI, short_dois)
+        return dict(zip(short_dois, results))
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("original_file", help=ARG_HELP_STRINGS["original_file"])
@@ -44,6 +83,7 @@ def main():
     parser.add_argument("-lu", "--update_locale", help=ARG_HELP_STRINGS["update_locale"])
     parser.add_argument("-a", "--autocreate_mappings", action="store_true", help=ARG_HELP_STRINGS["autocreate_mappings"])
     parser.add_argument("-g", "--grouping", action="store_true", help=ARG_HELP_STRINGS["grouping"])
+    parser.add_argument("-w", "--workers", type=int, default=8, help=ARG_HELP_STRINGS["workers"])
     
     args = parser.parse_args()
     
@@ -168,56 +208,87 @@ def main():
                         params["original"]["mappings"].append(orig_field)
                         params["update"]["mappings"].append(update_field)
                     
-    update_mappings = {}
-    with open(params["update"]["file"], "r", encoding=params["update"]["encoding"]) as f:
-        doi_field = params["update"]["doi_field"]
-        euro_field = params["update"]["euro_field"]
-        reader = csv.DictReader(f, dialect=params["update"]["csv_analysis"].dialect)
-        locale.setlocale(locale.LC_ALL, params["update"]["locale"])
-        for line in reader:
-            doi = oat.get_normalised_DOI(line[doi_field])
-            if doi is None:
-                msg = 'Warning: Empty or invalid DOI in update file (line {}): "{}"'
-                oat.print_y(msg.format(reader.line_num, line[doi_field]))
-                continue
-            if doi in update_mappings:
-                msg = "Error: Duplicate doi in update file ({})".format(line[doi_field])
-                oat.print_r(msg)
-                sys.exit()
-            update_mappings[doi] = {}
-            euro_value = locale.atof(line[euro_field])
-            orig_euro_field = params["original"]["euro_field"]
-            update_mappings[doi][orig_euro_field] = euro_value
-            for index, update_field_name in enumerate(params["update"]["mappings"]):
-                orig_field_name = params["original"]["mappings"][index]
-                update_mappings[doi][orig_field_name] = line[update_field_name]
-            
-    #print(json.dumps(update_mappings, sort_keys=False, indent=4))
-    
-    modified_content = []
-    fieldnames = None
-    with open(params["original"]["file"], "r", encoding=params["original"]["encoding"]) as f:
+    # Only shortDOIs need a request, so regular DOIs are not collected at all
+    doi_strings = set()
+    for file_type in ["update", "original"]:
+        with open(params[file_type]["file"], "r", encoding=params[file_type]["encoding"]) as f:
+            reader = csv.DictReader(f, dialect=params[file_type]["csv_analysis"].dialect)
+            for line in reader:
+                doi_string = line[params[file_type]["doi_field"]]
+                if (oat.DOI_RE.match(doi_string.strip()) is None and
+                    oat.SHORTDOI_RE.match(doi_string.strip()) is not None):
+                    doi_strings.add(doi_string)
+    short_dois = resolve_short_dois(doi_strings, args.workers)
+    del(doi_strings)
+
+    def normalise_doi(doi_string):
+        if doi_string in short_dois:
+            return short_dois[doi_string]
+        return oat.get_normalised_DOI(doi_string)
+
+    # Index the update file. Only the file offset and the parsed euro value
+    # are kept for every DOI, the other columns are read again on demand.
+    update_index = OrderedDict()
+    update_file = open(params["update"]["file"], "r", encoding=params["update"]["encoding"])
+    update_dialect = params["update"]["csv_analysis"].dialect
+    doi_field = params["update"]["doi_field"]
+    euro_field = params["update"]["euro_field"]
+    locale.setlocale(locale.LC_ALL, params["update"]["locale"])
+    reader = csv.DictReader(_readlines(update_file), dialect=update_dialect)
+    reader.fieldnames # consume the header
+    offset = update_file.tell()
+    for line in reader:
+        line_offset = offset
+        offset = update_file.tell()
+        doi = normalise_doi(line[doi_field])
+        if doi is None:
+            msg = 'Warning: Empty or invalid DOI in update file (line {}): "{}"'
+            oat.print_y(msg.format(reader.line_num, line[doi_field]))
+            continue
+        if doi in update_index:
+            msg = "Error: Duplicate doi in update file ({})".format(line[doi_field])
+            oat.print_r(msg)
+            sys.exit()
+        update_index[doi] = (line_offset, locale.atof(line[euro_field]))
+
+    def get_update_mapping(doi):
+        line_offset, euro_value = update_index.pop(doi)
+        update_file.seek(line_offset)
+        reader = csv.DictReader(_readlines(update_file), params["update"]["fieldnames"],
+                                dialect=update_dialect)
+        line = next(reader)
+        mapping = {params["original"]["euro_field"]: euro_value}
+        for index, update_field_name in enumerate(params["update"]["mappings"]):
+            orig_field_name = params["original"]["mappings"][index]
+            mapping[orig_field_name] = line[update_field_name]
+        return mapping
+
+    with open(params["original"]["file"], "r", encoding=params["original"]["encoding"]) as f, \
+         open("out.csv.part", "w", encoding=params["original"]["encoding"]) as out:
         doi_field = params["original"]["doi_field"]
         euro_field = params["original"]["euro_field"]
         reader = csv.DictReader(f, dialect=params["original"]["csv_analysis"].dialect)
         fieldnames = list(reader.fieldnames)
+        writer = csv.DictWriter(out, fieldnames, dialect=params["original"]["csv_analysis"].dialect)
+        writer.writeheader()
         locale.setlocale(locale.LC_ALL, params["original"]["locale"])
         for line in reader:
-            doi = oat.get_normalised_DOI(line[doi_field])
-            if doi not in update_mappings:
+            doi = normalise_doi(line[doi_field])
+            if doi not in update_index:
                 msg = "line {}: DOI {} not found in update file!"
                 oat.print_r(msg.format(reader.line_num, doi))
                 continue
+            update_mapping = get_update_mapping(doi)
             changes = []
             old_euro_value = locale.atof(line[euro_field])
-            new_euro_value = update_mappings[doi][euro_field]
+            new_euro_value = update_mapping[euro_field]
             if old_euro_value != new_euro_value:
                 changes.append(Change(euro_field, old_euro_value, new_euro_value, monetary=True))
-            for field in update_mappings[doi].keys():
+            for field in update_mapping.keys():
                 if field == euro_field:
                     continue
-                if line[field] != update_mappings[doi][field]:
-                    changes.append(Change(field, line[field], update_mappings[doi][field]))
+                if line[field] != update_mapping[field]:
+                    changes.append(Change(field, line[field], update_mapping[field]))
             if not changes:
                 msg = "line {}: DOI {} found in update file, but nothing changed."
                 oat.print_g(msg.format(reader.line_num, doi))
@@ -230,23 +301,18 @@ def main():
                         line[change.field_name] = locale.currency(change.new_value,symbol=False, grouping=args.grouping)
                     else:
                         line[change.field_name] = change.new_value
-            del(update_mappings[doi])
-            modified_content.append(line)
-        if update_mappings:
-            oat.print_y("{} entries in update file not contained in original file:".format(len(update_mappings)))
-        for doi, changes in update_mappings.items():
+            writer.writerow(line)
+        if update_index:
+            oat.print_y("{} entries in update file not contained in original file:".format(len(update_index)))
+        for doi in list(update_index.keys()):
             oat.print_y(doi)
-            new_line = changes
+            new_line = get_update_mapping(doi)
             new_line[params["original"]["doi_field"]] = doi
             formatted_euro = locale.currency(new_line[params["original"]["euro_field"]], symbol=False, grouping=args.grouping)
             new_line[params["original"]["euro_field"]] = formatted_euro
-            modified_content.append(new_line)
-    
-    with open("out.csv", "w", encoding=params["original"]["encoding"]) as out:
-        writer = csv.DictWriter(out, fieldnames, dialect=params["original"]["csv_analysis"].dialect)
-        writer.writeheader()
-        for line in modified_content:
-            writer.writerow(line)
+            writer.writerow(new_line)
+    update_file.close()
+    os.replace("out.csv.part", "out.csv")
 
 if __name__ == '__main__':
     main()
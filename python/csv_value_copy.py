@@ -4,6 +4,7 @@
 import argparse
 import codecs
 import csv
+import os
 import sys
 
 import openapc_toolkit as oat
@@ -87,7 +88,7 @@ def main():
             sys.exit()
         mask = [True if x == "t" else False for x in args.quotemask]
     
-    source_header, source_content = oat.get_csv_file_content(args.source_file, enc=encs[0])
+    source_header, source_content = oat.iterate_csv_file(args.source_file, enc=encs[0])
     
     key_column_name = "column " + str(args.source_file_key_column)
     value_column_name = "column " + str(args.source_file_value_column)
@@ -124,34 +125,34 @@ def main():
     
     oat.print_g("mapping table created, contains " + str(len(mapping_table)) + " entries")
     
-    target_header, target_content = oat.get_csv_file_content(args.target_file, enc=encs[1])
+    target_header, target_content = oat.iterate_csv_file(args.target_file, enc=encs[1])
     
     
     line_num = 0 if not target_header else 1
     
     replace_msg = u"Line {}: Found matching key '{}', replaced old value '{}' by '{}'"
-    modified_content = []
-    for line in target_content:
-        key = line[args.target_file_key_column]
-        if key in mapping_table:
-            new_value = mapping_table[key]
-            old_value = line[args.target_file_value_column]
-            if old_value != new_value:
-                if len(old_value) == 0 or old_value == "NA":
-                    line[args.target_file_value_column] = new_value
-                    msg = replace_msg.format(line_num, key, old_value, new_value)
-                    oat.print_g(msg)
-                else:
-                    if args.force_overwrite:
+    with open('out.csv.part', 'w') as out:
+        writer = oat.OpenAPCUnicodeWriter(out, mask, quote_rules, True)
+        for header_line in target_header:
+            writer.write_row(header_line)
+        for line in target_content:
+            key = line[args.target_file_key_column]
+            if key in mapping_table:
+                new_value = mapping_table[key]
+                old_value = line[args.target_file_value_column]
+                if old_value != new_value:
+                    if len(old_value) == 0 or old_value == "NA":
                         line[args.target_file_value_column] = new_value
                         msg = replace_msg.format(line_num, key, old_value, new_value)
-                        oat.print_y(msg)
-        modified_content.append(line)
-        line_num += 1
-    
-    with open('out.csv', 'w') as out:
-        writer = oat.OpenAPCUnicodeWriter(out, mask, quote_rules, True)
-        writer.write_rows(target_header + modified_content)
+                        oat.print_g(msg)
+                    else:
+                        if args.force_overwrite:
+                            line[args.target_file_value_column] = new_value
+                            msg = replace_msg.format(line_num, key, old_value, new_value)
+                            oat.print_y(msg)
+            writer.write_row(line)
+            line_num += 1
+    os.replace('out.csv.part', 'out.csv')
 
 
 if __name__ == '__main__':
@@ -25,28 +25,26 @@ def main():
     parser.add_argument("enriched_file", help=ARG_HELP_STRINGS["enriched_file"])
     args = parser.parse_args()
     
-    header, content = oat.get_csv_file_content(args.enriched_file, enc="utf-8", force_header=True)
+    header, content = oat.iterate_csv_file(args.enriched_file, enc="utf-8", force_header=True)
     header_line = header[0]
     
-    core_content = [list(header_line)]
-    ta_content = [list(header_line) + ["agreement"]]
-    print(core_content)
-    print(ta_content)
+    core_header = list(header_line)
+    ta_header = list(header_line) + ["agreement"]
+    print([core_header])
+    print([ta_header])
     
-    for line in content:
-        if line[4] == "TRUE" and line[5] in PUBLISHER_LIST:
-            core_content.append(list(EMPTY_LINE_CORE))
-            ta_content.append(line + [AGREEMENT_NAME])
-        else:
-            core_content.append(line)
-            ta_content.append(list(EMPTY_LINE_TA))
-
-    with open("out_orig.csv", "w") as out:
-        writer = oat.OpenAPCUnicodeWriter(out, QUOTE_MASK, True, True)
-        writer.write_rows(core_content)
-    with open("out_deal_wiley.csv", "w") as out:
-        writer = oat.OpenAPCUnicodeWriter(out, QUOTE_MASK, True, True)
-        writer.write_rows(ta_content)
+    with open("out_orig.csv", "w") as core_out, open("out_deal_wiley.csv", "w") as ta_out:
+        core_writer = oat.OpenAPCUnicodeWriter(core_out, QUOTE_MASK, True, True)
+        ta_writer = oat.OpenAPCUnicodeWriter(ta_out, QUOTE_MASK, True, True)
+        core_writer.write_row(core_header)
+        ta_writer.write_row(ta_header)
+        for line in content:
+            if line[4] == "TRUE" and line[5] in PUBLISHER_LIST:
+                core_writer.write_row(list(EMPTY_LINE_CORE))
+                ta_writer.write_row(line + [AGREEMENT_NAME])
+            else:
+                core_writer.write_row(line)
+                ta_writer.write_row(list(EMPTY_LINE_TA))
     
 if __name__ == '__main__':
     main()
@@ -2,20 +2,21 @@
 # -*- coding: UTF-8 -*-
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import csv
 from datetime import date
-from functools import reduce
 import json
-from math import sqrt, nan
+import os
 from os import listdir
 from subprocess import run
-import ssl
 import sys
-from time import sleep
-from urllib.request import Request, urlopen
+import time
+from urllib.parse import urlsplit
+from urllib.request import Request
 from urllib.error import HTTPError, URLError
 
 from babel.dates import format_date
+from apc_statistics import APCStatistics
 import openapc_toolkit as oat
 
 ARG_HELP_STRINGS = {
@@ -27,35 +28,49 @@ ARG_HELP_STRINGS = {
                             "given institution. Useful if time is short or there's no internet " +
                             "connection."),
     "csv_output": ('Write the APC deviation data to a CSV file ("report.csv") in addition to regular ' +
-                   'report generation')
+                   'report generation'),
+    "all_institutions": ('Create reports for all institutions found in the core data file. ' +
+                         'APC statistics are only computed once, the institution argument ' +
+                         'must be omitted. CSV output is written to one file per institution.'),
+    "doi_resolve_rate": ("Max number of requests per second to doi.org during the DOI resolve " +
+                         "test (default: %(default)s). The same limit applies to every host " +
+                         "the DOIs redirect to."),
+    "doi_cache_file": ("A cache file for the DOI resolve test. DOIs which resolved successfully " +
+                       "will not be checked again for 30 days (default: %(default)s)")
 }
 
+DOI_RESOLVER_URL = "https://doi.org/"
+DOI_RESOLVE_RATE = 10
+DOI_RESOLVE_WORKERS = 16
+DOI_RESOLVE_TIMEOUT = 30
+DOI_CACHE_FILE = "tempfiles/doi_resolve_cache.json"
+DOI_CACHE_MAX_AGE = 30 * 24 * 3600
+
 with open("report/strings.json") as f:
     json_content = f.read()
     LANG = json.loads(json_content)
 
-def mean(sample):
-    return reduce(lambda x, y: x + y, sample) / len(sample)
-
-def stddev(sample):
-    if len(sample) == 1:
-        return nan
-    mean_value = mean(sample)
-    sums = 0.0
-    for obs in sample:
-        sums += (obs - mean_value)**2
-    return sqrt(sums / (len(sample) - 1))
-
 def parse():
     parser = argparse.ArgumentParser()
-    parser.add_argument("institution", help=ARG_HELP_STRINGS["institution"])
+    parser.add_argument("institution", nargs="?", help=ARG_HELP_STRINGS["institution"])
     parser.add_argument("lang", help=ARG_HELP_STRINGS["lang"], choices=LANG.keys())
     parser.add_argument("-v", "--verbose", help=ARG_HELP_STRINGS["verbose"], action="store_true")
     parser.add_argument("-d", "--no-doi-resolve-test", help=ARG_HELP_STRINGS["no_doi_resolve_test"],
                         action="store_true")
     parser.add_argument("-c", "--csv_output", help=ARG_HELP_STRINGS["csv_output"],
                         action="store_true")
-    return parser.parse_args()
+    parser.add_argument("-a", "--all-institutions", help=ARG_HELP_STRINGS["all_institutions"],
+                        action="store_true")
+    parser.add_argument("-r", "--doi-resolve-rate", help=ARG_HELP_STRINGS["doi_resolve_rate"],
+                        type=float, default=DOI_RESOLVE_RATE)
+    parser.add_argument("--doi-cache-file", help=ARG_HELP_STRINGS["doi_cache_file"],
+                        default=DOI_CACHE_FILE)
+    args = parser.parse_args()
+    if args.all_institutions and args.institution is not None:
+        parser.error("institution argument must be omitted if --all-institutions is used")
+    if not args.all_institutions and args.institution is None:
+        parser.error("institution argument is required")
+    return args
 
 def get_data_dir_stats(data_dir):
     path = "../data/" + data_dir
@@ -159,35 +174,100 @@ def generate_duplicates_section(institution, dup_content, ins_content, lang):
         count += 1
     return markdown
     
-def generate_nonresolving_dois_section(institution, apc_content, lang):
+class DOIResolver(object):
+    """
+    Check if DOIs resolve, using concurrent HEAD requests.
+
+    Requests are rate-limited per host, so doi.org and the publisher sites the
+    DOIs redirect to are queried at most rate times per second each. DOIs which
+    resolved successfully are stored in a cache file together with the time of
+    the check and are not checked again until DOI_CACHE_MAX_AGE has passed.
+    """
+
+    def __init__(self, cache_file=DOI_CACHE_FILE, rate=DOI_RESOLVE_RATE,
+                 workers=DOI_RESOLVE_WORKERS):
+        self.cache_file = cache_file
+        self.workers = workers
+        self.session = oat.HTTPSession(pool_size=workers, timeout=DOI_RESOLVE_TIMEOUT,
+                                       rate_limit=rate)
+        self.cache = {}
+        if os.path.isfile(cache_file):
+            with open(cache_file) as f:
+                self.cache = json.load(f)
+
+    def save_cache(self):
+        cache_dir = os.path.dirname(self.cache_file)
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        tmp_file = self.cache_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(self.cache, f)
+        os.replace(tmp_file, self.cache_file)
+
+    def _open(self, doi, method):
+        headers = {"User-Agent": "OpenAPC DOI Tester"}
+        req = Request(DOI_RESOLVER_URL + doi, headers=headers, method=method)
+        self.session.open(req)
+
+    def check_doi(self, doi):
+        """
+        Check if a DOI resolves.
+
+        Returns:
+            True if the DOI resolved, False if the request ended in a 404 error and
+            None if the result is unclear (other errors).
+        """
+        checked = self.cache.get(doi)
+        if checked is not None and time.time() - checked < DOI_CACHE_MAX_AGE:
+            return True
+        try:
+            self._open(doi, "HEAD")
+        # we employ a conservative strategy here. Catching all HTTP/URL errors leads to
+        # many false positives which wouldn't occur in a browser (TLS stuff/User-Agent blocks)
+        except HTTPError as httpe:
+            if httpe.code != 404:
+                return None
+            if urlsplit(httpe.filename).netloc == urlsplit(DOI_RESOLVER_URL).netloc:
+                return False
+            # Some publisher sites don't handle HEAD requests properly
+            try:
+                self._open(doi, "GET")
+            except HTTPError as httpe:
+                return False if httpe.code == 404 else None
+            except URLError:
+                return None
+        except URLError:
+            return None
+        self.cache[doi] = int(time.time())
+        return True
+
+    def find_non_resolving(self, dois):
+        """
+        Check a list of DOIs concurrently and return the ones which do not resolve.
+
+        The result keeps the order of the input list.
+        """
+        msg = "   ({}/{}) DOIs checked, {} not resolving"
+        non_resolving = set()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.check_doi, doi): doi for doi in set(dois)}
+            for index, future in enumerate(as_completed(futures), 1):
+                if future.result() is False:
+                    non_resolving.add(futures[future])
+                print(msg.format(index, len(futures), len(non_resolving)), end="\r")
+        print()
+        self.save_cache()
+        return [doi for doi in dois if doi in non_resolving]
+
+def generate_nonresolving_dois_section(institution, apc_content, lang, doi_resolver):
     articles = []
-    non_resolving_lines = []
     for line in apc_content:
         if line[0] == institution:
             articles.append(line)
-    msg = "   ({}/{}) DOIs checked, {} not resolving"
-    headers = {"User-Agent": "OpenAPC DOI Tester"}
     print("Checking DOIs...")
-    for index, line in enumerate(articles):
-        doi = line[3]
-        if doi != "NA":
-            req = Request("https://doi.org/" + doi, headers=headers)
-            context = ssl.create_default_context()
-            context.check_hostname = False
-            context.verify_mode = ssl.CERT_NONE
-            try:
-                urlopen(req, context=context)
-                sleep(0.5)
-            # we employ a conservative strategy here. Catching all HTTP/URL errors leads to
-            # many false positives which wouldn't occur in a browser (TLS stuff/User-Agent blocks)
-            except HTTPError as httpe:
-                if httpe.getcode() == 404:
-                    non_resolving_lines.append(line)
-            except URLError:
-                pass
-            except ConnectionError:
-                pass
-        print(msg.format(index, len(articles), len(non_resolving_lines)), end="\r")
+    dois = [line[3] for line in articles if line[3] != "NA"]
+    non_resolving_dois = set(doi_resolver.find_non_resolving(dois))
+    non_resolving_lines = [line for line in articles if line[3] in non_resolving_dois]
     md_content = ""
     if non_resolving_lines:
         md_content += LANG[lang]["nrd_header"]
@@ -203,7 +283,8 @@ def generate_nonresolving_dois_section(institution, apc_content, lang):
     return md_content
 
 
-def generate_apc_deviaton_section(institution, articles, stats, lang, csv_output=False):
+def generate_apc_deviaton_section(institution, articles, stats, lang, csv_output=False,
+                                  csv_file="report.csv"):
     if csv_output:
         csv_content = [["Journal", "Publisher", "Journal Articles in OpenAPC", "Period", "DOI", "Reported Costs", "OpenAPC Mean Value", "OpenAPC Standard Deviation", "Difference (absolute)", "Difference (Standard Deviations)"]]
     md_content = ""
@@ -249,102 +330,61 @@ def generate_apc_deviaton_section(institution, articles, stats, lang, csv_output
         md_content += "* " + LANG[lang]["ad_stats_" + stat]
         md_content += ": " + str(stats[stat]) + "\n"
     if csv_output:
-        with open("report.csv", "w") as out:
+        with open(csv_file, "w") as out:
             csv_writer = csv.writer(out)
             csv_writer.writerows(csv_content)
     return md_content
 
-def find_significant_apc_differences(apc_content, institution, verbose=False):
-    titles = {}
-    articles = []
-    # 1st run: Find all journals the institution has published articles in
-    for line in apc_content:
-        if line[0] != institution:
-            continue
-        title = line[6]
-        if title not in titles:
-            titles[title] = {"lines": []}
-        articles.append(line)
-    # 2nd run: Aggregate all articles for the journals found in 1
-    for line in apc_content:
-        title = line[6]
-        if title in titles:
-            titles[title]["lines"].append(line)
-    for title in titles:
-        apc_values = [float(line[2]) for line in titles[title]["lines"]]
-        titles[title]["count"] = len(apc_values)
-        titles[title]["stddev"] = stddev(apc_values)
-        titles[title]["mean"] = mean(apc_values)
+def generate_report(institution, args, apc_stats, apc_content, ins_content, dup_content,
+                    doi_resolver):
+    sig_articles, stats = apc_stats.find_significant_differences(institution, args.verbose)
 
-    stats = {
-        "articles": len(articles),
-        "not_checked": 0,
-        "within_limits": 0,
-        "significant": 0
-    }
-    sig_articles = []
-    for article in articles:
-        apc = article[2]
-        doi = article[3]
-        title = article[6]
-        if titles[title]["count"] < 20:
-            if verbose:
-                msg = 'Article {}, journal "{}": Could not check costs, too few occurences ({})'
-                oat.print_b(msg.format(doi, title, titles[title]["count"]))
-            stats["not_checked"] += 1
-            continue
-        if abs(float(apc) - titles[title]["mean"]) > 2 * titles[title]["stddev"]:
-            rounded_mean = round(titles[title]["mean"], 2)
-            rounded_stddev = round(titles[title]["stddev"], 2)
-            diff_absolute = round(float(apc) - rounded_mean, 2)
-            diff_times_stddev = round(diff_absolute / rounded_stddev, 2)
-            if verbose:
-                msg = ('Article {}, journal "{}": Cost ({}€) differs more than 2 standard ' +
-                       'deviations (2 * {}€) from mean APC ({}€)')
-                oat.print_y(msg.format(doi, title, apc, rounded_stddev, rounded_mean))
-            stats["significant"] += 1
-            article.append(rounded_mean)
-            article.append(rounded_stddev)
-            article.append(diff_absolute)
-            article.append(diff_times_stddev)
-            article.append(titles[title]["count"])
-            sig_articles.append(article)
-        else:
-            if verbose:
-                msg = ('Article {}, journal "{}": No significant cost difference ({}€, mean ' +
-                       'APC is {}€)')
-                oat.print_g(msg.format(doi, title, apc, round(titles[title]["mean"], 2)))
-            stats["within_limits"] += 1
-    if verbose:
-        oat.print_g("\nAnalysis finished, results:")
-        for key, value in stats.items():
-            oat.print_g(key + ": " + str(value))
-    return sig_articles, stats
-
-def main():
-    args = parse()
-    _, apc_content = oat.get_csv_file_content("../data/apc_de.csv", "utf-8", True)
-    _, ins_content = oat.get_csv_file_content("../data/institutions.csv", "utf-8", True)
-    _, dup_content = oat.get_csv_file_content("../data/unresolved_duplicates.csv", "utf-8", True)
-
-    sig_articles, stats = find_significant_apc_differences(apc_content, args.institution,
-                                                           args.verbose)
+    ins = institution.lower().replace(" ", "_")
+    today = format_date(date.today(), format="dd_MM_yy")
+    csv_file = "report.csv"
+    if args.all_institutions:
+        csv_file = "report_" + ins + "_" + today + ".csv"
 
     report = ""
     report += generate_header(args.lang)
-    report += generate_metadata_section(args.institution, ins_content, stats, args.lang)
-    report += generate_duplicates_section(args.institution, dup_content, ins_content, args.lang)
+    report += generate_metadata_section(institution, ins_content, stats, args.lang)
+    report += generate_duplicates_section(institution, dup_content, ins_content, args.lang)
     if not args.no_doi_resolve_test:
-        report += generate_nonresolving_dois_section(args.institution, apc_content, args.lang)
-    report += generate_apc_deviaton_section(args.institution, sig_articles, stats, args.lang, args.csv_output)
+        report += generate_nonresolving_dois_section(institution, apc_content, args.lang,
+                                                     doi_resolver)
+    report += generate_apc_deviaton_section(institution, sig_articles, stats, args.lang,
+                                            args.csv_output, csv_file)
 
-    ins = args.institution.lower().replace(" ", "_")
-    today = format_date(date.today(), format="dd_MM_yy")
     file_name = "report_" + ins + "_" + today + ".pdf"
     with open("report.md", "w") as out:
         out.write(report)
     run(["pandoc", "report.md", "-f", "markdown", "-o", file_name, "--pdf-engine=xelatex"])
 
+def main():
+    args = parse()
+    _, apc_content = oat.get_csv_file_content("../data/apc_de.csv", "utf-8", True)
+    _, ins_content = oat.get_csv_file_content("../data/institutions.csv", "utf-8", True)
+    _, dup_content = oat.get_csv_file_content("../data/unresolved_duplicates.csv", "utf-8", True)
+
+    apc_stats = APCStatistics(apc_content)
+    doi_resolver = None
+    if not args.no_doi_resolve_test:
+        doi_resolver = DOIResolver(args.doi_cache_file, args.doi_resolve_rate)
+    if args.all_institutions:
+        institutions = apc_stats.get_institutions()
+    else:
+        institutions = [args.institution]
+    known_institutions = {line[0] for line in ins_content}
+    for institution in institutions:
+        if args.all_institutions:
+            # generate_metadata_section would stop the whole run on a missing entry
+            if institution not in known_institutions:
+                oat.print_y("WARNING: Entry " + institution + " not found in institutions file, skipping...")
+                continue
+            oat.print_b("Creating report for " + institution + "...")
+        generate_report(institution, args, apc_stats, apc_content, ins_content, dup_content,
+                        doi_resolver)
+
 
 if __name__ == '__main__':
     main()
@@ -8,12 +8,14 @@ from math import inf
 import random
 import sys
 from time import sleep
-from urllib.error import HTTPError
+from urllib.error import HTTPError, URLError
 from urllib.parse import quote_plus, urlencode
-from urllib.request import urlopen, Request
+from urllib.request import Request
 
 from Levenshtein import ratio, matching_blocks, editops
 
+import openapc_toolkit as oat
+
 MATCH_DEFAULT = 0.9
 ASK_DEFAULT = 0.8
 COLORS_DEFAULT = True
@@ -26,7 +28,10 @@ ARG_HELP_STRINGS = {
     "ask_threshold": "a float value determining the minimum Levenshtein ratio to accept a title match (default: " + str(ASK_DEFAULT) + ")",
     "ansi_colors": "Use colorised text for easier visual match recognition (default: " + str(COLORS_DEFAULT) + ")",
     "start": "Start from this line number",
-    "end": "End at this line number"
+    "end": "End at this line number",
+    "check_duplicates": "Look up every matched DOI in the existing OpenAPC data files (APC, TA, BPC " +
+                        "and unresolved duplicates) and issue a warning if it is already present. " +
+                        "The identifiers are indexed in " + oat.IdentifierRegistry.DEFAULT_DB_PATH + "."
 }
 
 L_JUST = 40
@@ -47,7 +52,14 @@ def main():
     parser.add_argument("-c", "--colors", type=bool, default=COLORS_DEFAULT, help=ARG_HELP_STRINGS["ansi_colors"])
     parser.add_argument("--start", type=int, default=0, help=ARG_HELP_STRINGS["start"])
     parser.add_argument("--end", type=int, default=inf, help=ARG_HELP_STRINGS["end"])
+    parser.add_argument("--check-duplicates", action="store_true", help=ARG_HELP_STRINGS["check_duplicates"])
     args = parser.parse_args()
+
+    oat.HTTP_SESSION = oat.HTTPSession(max_retries=MAX_RETRIES_ON_ERROR)
+    identifier_registry = None
+    if args.check_duplicates:
+        print(colorise("Updating identifier registry...", "blue"))
+        identifier_registry = oat.IdentifierRegistry()
     
     header = None
     additional_fields = ["doi", "similarity"]
@@ -78,12 +90,9 @@ def main():
             head = "line " + str(reader.line_num) + ", query title:"
             print(colorise(head.ljust(L_JUST) + "'" + title + "'", "blue"))
             ret = crossref_query_title(title)
-            retries = 0
-            while not ret['success'] and retries < MAX_RETRIES_ON_ERROR:
-                retries += 1
-                msg = "Error while querying CrossRef API ({}), retrying ({})...".format(ret["exception"], retries)
+            if not ret['success']:
+                msg = "Error while querying CrossRef API ({})".format(ret["exception"])
                 print(colorise(msg, "red"))
-                ret = crossref_query_title(title)
             result = ret["result"]
             msg_tail = "'{}' [{}]"
             msg_tail = msg_tail.format(result["crossref_title"], result["doi"])
@@ -91,18 +100,21 @@ def main():
                 msg_head = "Perfect match found ({}):"
                 msg_head = msg_head.format(round(result["similarity"], 2)).ljust(L_JUST)
                 print(colorise(msg_head + msg_tail, "cyan"))
+                check_registry(identifier_registry, result["doi"])
                 line.update(result)
                 line["ask"] = False
             elif result["similarity"] >= args.match_threshold:
                 msg_head = "Good match found ({}):"
                 msg_head = msg_head.format(round(result["similarity"], 2)).ljust(L_JUST)
                 print(colorise(msg_head + msg_tail, "green"))
+                check_registry(identifier_registry, result["doi"])
                 line.update(result)
                 line["ask"] = False
             elif result["similarity"] >= args.ask_threshold:
                 msg_head = "Possible match found ({}):"
                 msg_head = msg_head.format(round(result["similarity"], 2)).ljust(L_JUST)
                 print(colorise(msg_head + msg_tail, "yellow"))
+                check_registry(identifier_registry, result["doi"])
                 line.update(result)
                 line["line_num"] = reader.line_num
                 line["ask"] = True
@@ -154,6 +166,15 @@ def main():
             writer = csv.DictWriter(out, header, extrasaction='ignore', dialect=dialect)
             writer.writeheader()
             writer.writerows(modified_lines)
+    if identifier_registry is not None:
+        identifier_registry.close()
+
+def check_registry(identifier_registry, doi):
+    if identifier_registry is None:
+        return
+    for match in identifier_registry.lookup_doi(doi):
+        msg = "Duplicate: DOI {} is already part of the OpenAPC data ({})"
+        print(colorise(msg.format(doi, oat.IdentifierRegistry.format_match(match)), "red"))
 
 def crossref_query_title(title):
     api_url = "https://api.crossref.org/works?"
@@ -163,7 +184,8 @@ def crossref_query_title(title):
     request = Request(url)
     request.add_header("User-Agent", "OpenAPC DOI Importer (https://github.com/OpenAPC/openapc-de/blob/master/python/import_dois.py; mailto:openapc@uni-bielefeld.de)")
     try:
-        ret = urlopen(request)
+        # 429 and 5xx errors are retried with backoff by the shared session
+        ret = oat.HTTP_SESSION.open(request)
         content = ret.read()
         data = json.loads(content)
         items = data["message"]["items"]
@@ -180,9 +202,8 @@ def crossref_query_title(title):
             if most_similar["similarity"] < result["similarity"]:
                 most_similar = result
         return {"success": True, "result": most_similar}
-    except HTTPError as httpe:
+    except (HTTPError, URLError) as httpe:
         return {"success": False, "result": EMPTY_RESULT, "exception": httpe}
-    time.sleep(1)
     
 def colorise(text, color):
     return colorise_text_segment(text, 0, len(text), color)
@@ -3,7 +3,9 @@
 
 import argparse
 import codecs
+import os
 import re
+import sys
 
 import openapc_toolkit as oat
 
@@ -71,7 +73,7 @@ def main():
                    "guessing.")
             sys.exit()
         
-    header, content = oat.get_csv_file_content(args.apc_file, enc)
+    header, content = oat.iterate_csv_file(args.apc_file, enc)
     
     oat.print_g("Preparing mapping table...")
     itself = other = 0
@@ -93,41 +95,45 @@ def main():
     oat.print_g("Starting enrichment...")
     
     issn_matches = issn_p_matches = issn_e_matches = unmatched = different = corrections = 0
-    enriched_lines = []
-    for line in content:
-        if len(line) == 0:
-            enriched_lines.append(line)
-            continue
-        issn = reformat_issn(line[7])
-        issn_p = reformat_issn(line[8])
-        issn_e = reformat_issn(line[9])
-        target = None
-        if issn in issn_l_dict:
-            target = issn_l_dict[issn]
-            corrected_target = oat.get_corrected_issn_l(target)
-            if corrected_target != target:
-                corrections += 1
-            line[10] = corrected_target
-            issn_matches += 1
-        elif issn_p in issn_l_dict:
-            target = issn_l_dict[issn_p]
-            corrected_target = oat.get_corrected_issn_l(target)
-            if corrected_target != target:
-                corrections += 1
-            line[10] = corrected_target
-            issn_p_matches += 1
-        elif issn_e in issn_l_dict:
-            target = issn_l_dict[issn_e]
-            corrected_target = oat.get_corrected_issn_l(target)
-            if corrected_target != target:
-                corrections += 1
-            line[10] = corrected_target
-            issn_e_matches += 1
-        else:
-            unmatched += 1
-        if target is not None and target not in [issn, issn_p, issn_e]:
-            different += 1
-        enriched_lines.append(line)
+    with open('out.csv.part', 'w') as out:
+        writer = oat.OpenAPCUnicodeWriter(out, mask, quote_rules, True)
+        for line in header:
+            writer.write_row(line)
+        for line in content:
+            if len(line) == 0:
+                writer.write_row(line)
+                continue
+            issn = reformat_issn(line[7])
+            issn_p = reformat_issn(line[8])
+            issn_e = reformat_issn(line[9])
+            target = None
+            if issn in issn_l_dict:
+                target = issn_l_dict[issn]
+                corrected_target = oat.get_corrected_issn_l(target)
+                if corrected_target != target:
+                    corrections += 1
+                line[10] = corrected_target
+                issn_matches += 1
+            elif issn_p in issn_l_dict:
+                target = issn_l_dict[issn_p]
+                corrected_target = oat.get_corrected_issn_l(target)
+                if corrected_target != target:
+                    corrections += 1
+                line[10] = corrected_target
+                issn_p_matches += 1
+            elif issn_e in issn_l_dict:
+                target = issn_l_dict[issn_e]
+                corrected_target = oat.get_corrected_issn_l(target)
+                if corrected_target != target:
+                    corrections += 1
+                line[10] = corrected_target
+                issn_e_matches += 1
+            else:
+                unmatched += 1
+            if target is not None and target not in [issn, issn_p, issn_e]:
+                different += 1
+            writer.write_row(line)
+    os.replace('out.csv.part', 'out.csv')
     
     msg = ("{} issn_l values mapped by issn, {} by issn_p, {} by issn_e. {} " +
            "could not be assigned.\n{} issn_l values were corrected during " +
@@ -135,10 +141,6 @@ def main():
            "existing ISSN values")
     print(msg.format(issn_matches, issn_p_matches, issn_e_matches, 
                      unmatched, corrections, different))
-
-    with open('out.csv', 'w') as out:
-        writer = oat.OpenAPCUnicodeWriter(out, mask, quote_rules, True)
-        writer.write_rows(header + enriched_lines)
             
 
 if __name__ == '__main__':
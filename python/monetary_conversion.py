@@ -5,6 +5,7 @@ import argparse
 import codecs
 import datetime
 import locale
+import os
 from os import path
 import re
 import sys
@@ -114,10 +115,9 @@ def main():
             oat.print_r(msg)
             sys.exit()
         
-    header, content = oat.get_csv_file_content(args.source_file, enc, True)
+    header, content = oat.iterate_csv_file(args.source_file, enc, True)
     fieldnames = header.pop()
     
-    modified_content = []
     line_num = 0
     
     for column_type in ["source_column", "currency_column", "period_column", "target_column"]:
@@ -131,74 +131,76 @@ def main():
     if start == "n":
         sys.exit()
     
-    for line in content:
-        line_num += 1
-        if not oat.has_value(line[args.source_column]):
-            oat.print_y("WARNING: No source value found in line " + str(line_num) + ", skipping...")
-            modified_content.append(line)
-            continue
-        monetary_value = None
-        try: 
-            monetary_value = locale.atof(line[args.source_column])
-        except ValueError:
-            msg = "WARNING: Could not extract a valid monetary value from source column in line {} ('{}'), skipping..."
-            oat.print_y(msg.format(line_num, line[args.source_column]))
-            modified_content.append(line)
-            continue
-        currency = line[args.currency_column]
-        if currency == "EUR":
-            msg = "WARNING: Currency in line {} is already EUR, skipping..."
-            oat.print_y(msg.format(line_num))
-            line[args.target_column] = line[args.source_column]
-            modified_content.append(line)
-            continue
-        if not oat.has_value(currency):
-            msg = "WARNING: Could not extract a valid currency indicator from currency column in line {} ('{}'), skipping..."
-            oat.print_y(msg.format(line_num, currency))
-            modified_content.append(line)
-            continue
-        period = line[args.period_column]
-        frequency = get_frequency(period)
-        if frequency is None:
-            msg = "WARNING: Could not extract a valid date string from period column in line {} ('{}'), skipping..."
-            oat.print_y(msg.format(line_num, period))
-            modified_content.append(line)
-            continue
-        if currency not in EXCHANGE_RATES[frequency]:
-            msg = 'No exchange rates ({}) found for currency "{}", querying ECB data warehouse...'
-            oat.print_b(msg.format(frequency, currency))
-            rates = oat.get_euro_exchange_rates(currency, frequency)
-            EXCHANGE_RATES[frequency][currency] = rates
-        rate = EXCHANGE_RATES[frequency][currency].get(period)
-        if rate is None:
-            if frequency != "D":
-                msg = "Warning: No conversion rate found for currency {} for period {} (line {}), aborting..."
-                oat.print_r(msg.format(currency, period, line_num))
-                sys.exit()
-            day_retries = 0
-            while rate is None:
-                msg = "Warning: No conversion rate found for currency {} for period {} (line {}), trying next day..."
-                oat.print_y(msg.format(currency, period, line_num))
-                period = get_next_day(period)
-                rate = EXCHANGE_RATES[frequency][currency].get(period)
-                day_retries += 1
-                if day_retries > 5:
-                    msg = "Error: Look-ahead limit for days exceeded, aborting..."
-                    oat.print_r(msg)
+    # Rows are written as they are converted. Write to a temporary file first, so an
+    # aborted conversion does not leave a truncated out.csv behind.
+    with open('out.csv.part', 'w') as out:
+        writer = oat.OpenAPCUnicodeWriter(out, mask, quote_rules, True)
+        writer.write_row(fieldnames)
+        for line in content:
+            line_num += 1
+            if not oat.has_value(line[args.source_column]):
+                oat.print_y("WARNING: No source value found in line " + str(line_num) + ", skipping...")
+                writer.write_row(line)
+                continue
+            monetary_value = None
+            try: 
+                monetary_value = locale.atof(line[args.source_column])
+            except ValueError:
+                msg = "WARNING: Could not extract a valid monetary value from source column in line {} ('{}'), skipping..."
+                oat.print_y(msg.format(line_num, line[args.source_column]))
+                writer.write_row(line)
+                continue
+            currency = line[args.currency_column]
+            if currency == "EUR":
+                msg = "WARNING: Currency in line {} is already EUR, skipping..."
+                oat.print_y(msg.format(line_num))
+                line[args.target_column] = line[args.source_column]
+                writer.write_row(line)
+                continue
+            if not oat.has_value(currency):
+                msg = "WARNING: Could not extract a valid currency indicator from currency column in line {} ('{}'), skipping..."
+                oat.print_y(msg.format(line_num, currency))
+                writer.write_row(line)
+                continue
+            period = line[args.period_column]
+            frequency = get_frequency(period)
+            if frequency is None:
+                msg = "WARNING: Could not extract a valid date string from period column in line {} ('{}'), skipping..."
+                oat.print_y(msg.format(line_num, period))
+                writer.write_row(line)
+                continue
+            if currency not in EXCHANGE_RATES[frequency]:
+                msg = 'No exchange rates ({}) found for currency "{}", querying ECB data warehouse...'
+                oat.print_b(msg.format(frequency, currency))
+                rates = oat.get_euro_exchange_rates(currency, frequency)
+                EXCHANGE_RATES[frequency][currency] = rates
+            rate = EXCHANGE_RATES[frequency][currency].get(period)
+            if rate is None:
+                if frequency != "D":
+                    msg = "Warning: No conversion rate found for currency {} for period {} (line {}), aborting..."
+                    oat.print_r(msg.format(currency, period, line_num))
                     sys.exit()
+                day_retries = 0
+                while rate is None:
+                    msg = "Warning: No conversion rate found for currency {} for period {} (line {}), trying next day..."
+                    oat.print_y(msg.format(currency, period, line_num))
+                    period = get_next_day(period)
+                    rate = EXCHANGE_RATES[frequency][currency].get(period)
+                    day_retries += 1
+                    if day_retries > 5:
+                        msg = "Error: Look-ahead limit for days exceeded, aborting..."
+                        oat.print_r(msg)
+                        sys.exit()
 
-        euro_value = round(monetary_value/float(rate), 2)
-        line[args.target_column] = str(euro_value)
+            euro_value = round(monetary_value/float(rate), 2)
+            line[args.target_column] = str(euro_value)
         
-        msg = "Line {}: {} exchange rate ({}) for date {} is {} -> {} / {} = {} EUR"
-        msg = msg.format(line_num, currency, frequency, period, rate, monetary_value, rate, euro_value)
-        oat.print_g(msg)
+            msg = "Line {}: {} exchange rate ({}) for date {} is {} -> {} / {} = {} EUR"
+            msg = msg.format(line_num, currency, frequency, period, rate, monetary_value, rate, euro_value)
+            oat.print_g(msg)
         
-        modified_content.append(line)
-    
-    with open('out.csv', 'w') as out:
-        writer = oat.OpenAPCUnicodeWriter(out, mask, quote_rules, True)
-        writer.write_rows([fieldnames] + modified_content)
+            writer.write_row(line)
+    os.replace('out.csv.part', 'out.csv')
 
 if __name__ == '__main__' and __package__ is None:
     sys.path.append(path.dirname(path.dirname(path.dirname(path.dirname(path.abspath(__file__))))))
@@ -1,17 +1,32 @@
 #!/usr/bin/env python3
 # -*- coding: UTF-8 -*-
 
+from array import array
+import base64
+from bisect import bisect_left, bisect_right
+import codecs
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import csv
-from collections import OrderedDict
+from collections import deque, OrderedDict
+from email.utils import parsedate_to_datetime
+import http.client
+import io
+from itertools import islice, starmap
 import json
 import locale
 import logging
 from logging.handlers import MemoryHandler
 import os
+import random
 import re
 from shutil import copyfileobj
+import sqlite3
+import struct
 import sys
-from urllib.request import build_opener, urlopen, urlretrieve, HTTPErrorProcessor, Request
+import threading
+import time
+from urllib.parse import quote, unquote, urljoin, urlsplit
+from urllib.request import getproxies, proxy_bypass, urlopen, urlretrieve, Request
 from urllib.error import HTTPError, URLError
 import xml.etree.ElementTree as ET
 
@@ -35,6 +50,35 @@ SHORTDOI_RE = re.compile(r"^(https?://)?(dx.)?doi.org/(?P<shortdoi>[a-z0-9]+)$",
 
 ISSN_RE = re.compile(r"^(?P<first_part>\d{4})\-(?P<second_part>\d{3})(?P<check_digit>[\dxX])$")
 
+# An optional HTTPResponseCache used for metadata API lookups, see HTTPResponseCache.
+RESPONSE_CACHE = None
+
+# Crossref REST API work types and the corresponding OpenAPC record types
+CROSSREF_JSON_TYPES = {
+    "journal-article": "journal_article",
+    "book": "book_title",
+    "monograph": "book_title",
+    "edited-book": "book_title",
+    "reference-book": "book_title"
+}
+
+# Memoised names of Crossref DOI prefix owners
+CROSSREF_PREFIX_NAMES = {}
+
+# Default connection pool size, timeout (in seconds) and max number of retries
+# for metadata API requests
+HTTP_POOL_SIZE = 4
+HTTP_TIMEOUT = 60
+HTTP_MAX_RETRIES = 3
+
+# Conservative initial request rates (per second) for the metadata APIs, used
+# until a server announces its actual limit. Other hosts start unlimited.
+HTTP_HOST_RATE_LIMITS = {
+    "api.crossref.org": 5,
+    "www.crossref.org": 5,
+    "www.ebi.ac.uk": 10
+}
+
 OAI_COLLECTION_CONTENT = OrderedDict([
     ("institution", "intact:institution"),
     ("period", "intact:period"),
@@ -166,6 +210,58 @@ COLUMN_SCHEMAS = {
     ]
 }
 
+class _QuotingPlan(object):
+    """
+    The quoting rules of an OpenAPCUnicodeWriter, compiled for rows of a fixed length.
+
+    Rows are formatted in runs with a str.format template which quotes the relevant
+    columns. This is only correct if no value contains a quote char and no value in
+    a column which is quoted on demand contains a comma. The rare rows violating
+    this are formatted cell by cell.
+    """
+
+    RAW = 0
+    QUOTE = 1
+    QUOTE_ON_COMMA = 2
+
+    KEYWORDS = ["TRUE", "FALSE", "NA"]
+
+    def __init__(self, kinds, openapc_quote_rules):
+        self.kinds = kinds
+        self.keywords = frozenset(self.KEYWORDS) if openapc_quote_rules else frozenset()
+        formats = ['"{}"' if kind == self.QUOTE else "{}" for kind in kinds]
+        self.template = ",".join(formats) + "\n"
+        self.comma_columns = [index for index, kind in enumerate(kinds) if kind == self.QUOTE_ON_COMMA]
+
+    def _fill_template(self, rows):
+        text = "".join(starmap(self.template.format, rows))
+        # No value contains a quote char, so a quoted keyword can only be a full cell
+        for keyword in self.keywords:
+            text = text.replace('"' + keyword + '"', keyword)
+        return text
+
+    def _format_cells(self, row):
+        return ",".join([value if (value in self.keywords or kind == self.RAW or
+                                   kind == self.QUOTE_ON_COMMA and "," not in value)
+                         else '"' + value.replace('"', '""') + '"'
+                         for kind, value in zip(self.kinds, row)]) + "\n"
+
+    def format_rows(self, rows):
+        parts = []
+        template_rows = []
+        for row in rows:
+            joined = "".join(row)
+            if '"' in joined or "," in joined and any("," in row[index] for index in self.comma_columns):
+                if template_rows:
+                    parts.append(self._fill_template(template_rows))
+                    template_rows = []
+                parts.append(self._format_cells(row))
+            else:
+                template_rows.append(row)
+        if template_rows:
+            parts.append(self._fill_template(template_rows))
+        return "".join(parts)
+
 class OpenAPCUnicodeWriter(object):
     """
     A customized CSV Writer.
@@ -174,6 +270,9 @@ class OpenAPCUnicodeWriter(object):
     follow the open APC CSV quotation standards. A quote mask can also be
     provided to enable or disable value quotation in distinct CSV columns.
 
+    The quoting rules are compiled once per row length (see _QuotingPlan) and
+    rows are written in batches. Rows passed to the writer are not modified.
+
     Attributes:
         quotemask: A quotemask is a list of boolean values which should have
                    the same length as the number of columns in the csv file.
@@ -192,6 +291,8 @@ class OpenAPCUnicodeWriter(object):
                         csv file otherwise).
     """
 
+    BATCH_SIZE = 1000
+
     def __init__(self, f, quotemask=None, openapc_quote_rules=True,
                  has_header=True, minimal_quotes=True):
         self.outfile = f
@@ -199,60 +300,202 @@ class OpenAPCUnicodeWriter(object):
         self.openapc_quote_rules = openapc_quote_rules
         self.has_header = has_header
         self.minimal_quotes = minimal_quotes
+        self._header_written = False
+        self._plans = {}
+
+    def _get_plan(self, length, use_quotemask):
+        key = (length, use_quotemask)
+        if key not in self._plans:
+            kinds = []
+            for index in range(length):
+                if not use_quotemask or not self.quotemask:
+                    # Always quote without a quotemask
+                    kinds.append(_QuotingPlan.QUOTE)
+                elif index < len(self.quotemask) and self.quotemask[index]:
+                    kinds.append(_QuotingPlan.QUOTE)
+                elif index < len(self.quotemask) and self.minimal_quotes:
+                    kinds.append(_QuotingPlan.QUOTE_ON_COMMA)
+                else:
+                    kinds.append(_QuotingPlan.RAW)
+            self._plans[key] = _QuotingPlan(kinds, self.openapc_quote_rules)
+        return self._plans[key]
 
-    def _prepare_row(self, row, use_quotemask):
-        for index in range(len(row)):
-            if self.openapc_quote_rules and row[index] in ["TRUE", "FALSE", "NA"]:
-                # Never quote these keywords
-                continue
-            if not use_quotemask or not self.quotemask:
-                # Always quote without a quotemask
-                row[index] = row[index].replace('"', '""')
-                row[index] = '"' + row[index] + '"'
-                continue
-            if index < len(self.quotemask):
-                if self.quotemask[index] or "," in row[index] and self.minimal_quotes:
-                    row[index] = row[index].replace('"', '""')
-                    row[index] = '"' + row[index] + '"'
-        return row
+    def _format_rows(self, rows, use_quotemask):
+        lengths = set(map(len, rows))
+        if len(lengths) == 1:
+            return self._get_plan(lengths.pop(), use_quotemask).format_rows(rows)
+        return "".join([self._get_plan(len(row), use_quotemask).format_rows([row]) for row in rows])
 
-    def _write_row(self, row):
-        line = ",".join(row) + "\n"
-        self.outfile.write(line)
+    def write_row(self, row):
+        """
+        Write a single row. If the writer has a header, the first row written this way
+        will be treated as header row.
+        """
+        if self.has_header and not self._header_written:
+            self._header_written = True
+            self.outfile.write(self._get_plan(len(row), False).format_rows([row]))
+        else:
+            self.outfile.write(self._get_plan(len(row), True).format_rows([row]))
 
     def write_rows(self, rows):
+        """
+        Write rows from any iterable. If the writer has a header, the first row will
+        be treated as header row.
+        """
+        rows = iter(rows)
         if self.has_header:
-            self._write_row(self._prepare_row(rows.pop(0), False))
-        for row in rows:
-            self._write_row(self._prepare_row(row, True))
+            header = next(rows, None)
+            if header is None:
+                return
+            self._header_written = True
+            self.outfile.write(self._get_plan(len(header), False).format_rows([header]))
+        batch = list(islice(rows, self.BATCH_SIZE))
+        while batch:
+            self.outfile.write(self._format_rows(batch, True))
+            batch = list(islice(rows, self.BATCH_SIZE))
 
 class DOAJAnalysis(object):
+    """
+    ISSN lookups in the DOAJ journal list.
+
+    The journal list is indexed on the first lookup. ISSNs are stored as packed
+    integers (7 digits times 11 plus the check digit) in sorted arrays, with the
+    journal titles kept in a side table. Only ISSNs in canonical form (upper case
+    check digit X) are packed, all other values are kept as strings, so lookups
+    match exactly like a plain string comparison would. The index is saved as a binary snapshot
+    next to the CSV file and reused as long as the CSV file's size and modification
+    time do not change.
 
-    def __init__(self, doaj_csv_file, update=False):
-        self.doaj_issn_map = {}
-        self.doaj_eissn_map = {}
-        
-        if not os.path.isfile(doaj_csv_file) or update :
-            doaj_csv_file = self.download_doaj_csv(doaj_csv_file)
-
-        handle = open(doaj_csv_file, "r")
-        reader = csv.DictReader(handle)
-        for line in reader:
-            journal_title = line["Journal title"]
-            issn = line["Journal ISSN (print version)"]
-            eissn = line["Journal EISSN (online version)"]
-            if issn:
-                self.doaj_issn_map[issn] = journal_title
-            if eissn:
-                self.doaj_eissn_map[eissn] = journal_title
+    Args:
+        doaj_csv_file: Path to the DOAJ CSV file. Will be downloaded if it does not exist.
+        update: Download a fresh copy of the DOAJ CSV file on first use.
+        index_file: Path to the snapshot file. Defaults to the CSV file path with the
+                    extension replaced by "_index.bin".
+    """
+
+    INDEX_MAGIC = b"OAPC"
+    INDEX_VERSION = 2
+    # magic, version, CSV size, CSV mtime, print/electronic ISSN counts, metadata length
+    INDEX_HEADER = struct.Struct("<4sIqqIII")
+
+    def __init__(self, doaj_csv_file, update=False, index_file=None):
+        self.doaj_csv_file = doaj_csv_file
+        self.update = update
+        if index_file is None:
+            index_file = os.path.splitext(doaj_csv_file)[0] + "_index.bin"
+        self.index_file = index_file
+        self._index = None
+
+    @staticmethod
+    def _pack_issn(issn):
+        match = ISSN_RE.fullmatch(issn)
+        # A lower case x would become indistinguishable from X when packed
+        if match is None or match["check_digit"] == "x":
+            return None
+        check_digit = match["check_digit"]
+        check_value = 10 if check_digit == "X" else int(check_digit)
+        return int(match["first_part"] + match["second_part"]) * 11 + check_value
+
+    def _get_index(self):
+        if self._index is None:
+            if not os.path.isfile(self.doaj_csv_file) or self.update:
+                self.download_doaj_csv(self.doaj_csv_file)
+            stat = os.stat(self.doaj_csv_file)
+            self._index = self._load_index(stat)
+            if self._index is None:
+                self._index = self._build_index()
+                self._save_index(stat)
+        return self._index
+
+    def _build_index(self):
+        titles = []
+        title_ids = {}
+        maps = {"print": {}, "electronic": {}}
+        # ISSN values which can't be packed are kept as strings
+        other = {"print": {}, "electronic": {}}
+        columns = {"print": "Journal ISSN (print version)",
+                   "electronic": "Journal EISSN (online version)"}
+        with open(self.doaj_csv_file, "r") as handle:
+            reader = csv.DictReader(handle)
+            for line in reader:
+                journal_title = line["Journal title"]
+                if journal_title not in title_ids:
+                    title_ids[journal_title] = len(titles)
+                    titles.append(journal_title)
+                for issn_type, column in columns.items():
+                    issn = line[column]
+                    if not issn:
+                        continue
+                    packed_issn = self._pack_issn(issn)
+                    if packed_issn is None:
+                        other[issn_type][issn] = journal_title
+                    else:
+                        maps[issn_type][packed_issn] = title_ids[journal_title]
+        index = {"titles": titles, "other": other}
+        for issn_type, issn_map in maps.items():
+            packed_issns = sorted(issn_map)
+            index[issn_type] = (array("q", packed_issns), array("I", [issn_map[i] for i in packed_issns]))
+        return index
+
+    def _save_index(self, stat):
+        meta = json.dumps({"titles": self._index["titles"], "other": self._index["other"]},
+                          ensure_ascii=False).encode("utf-8")
+        print_keys, print_titles = self._index["print"]
+        electronic_keys, electronic_titles = self._index["electronic"]
+        header = self.INDEX_HEADER.pack(self.INDEX_MAGIC, self.INDEX_VERSION, stat.st_size, stat.st_mtime_ns,
+                                        len(print_keys), len(electronic_keys), len(meta))
+        tmp_file = self.index_file + ".tmp"
+        with open(tmp_file, "wb") as index:
+            index.write(header)
+            for values in [print_keys, print_titles, electronic_keys, electronic_titles]:
+                values.tofile(index)
+            index.write(meta)
+        os.replace(tmp_file, self.index_file)
+
+    def _load_index(self, stat):
+        if not os.path.isfile(self.index_file):
+            return None
+        with open(self.index_file, "rb") as index:
+            header = index.read(self.INDEX_HEADER.size)
+            if len(header) != self.INDEX_HEADER.size:
+                return None
+            magic, version, size, mtime, num_print, num_electronic, meta_len = self.INDEX_HEADER.unpack(header)
+            if (magic, version, size, mtime) != (self.INDEX_MAGIC, self.INDEX_VERSION, stat.st_size, stat.st_mtime_ns):
+                return None
+            try:
+                loaded = {}
+                for issn_type, count in [("print", num_print), ("electronic", num_electronic)]:
+                    keys = array("q")
+                    keys.fromfile(index, count)
+                    title_ids = array("I")
+                    title_ids.fromfile(index, count)
+                    loaded[issn_type] = (keys, title_ids)
+                meta = json.loads(index.read(meta_len).decode("utf-8"))
+            except (EOFError, ValueError):
+                logging.warning("DOAJ index file %s is damaged and will be rebuilt", self.index_file)
+                return None
+        loaded["titles"] = meta["titles"]
+        loaded["other"] = meta["other"]
+        return loaded
+
+    def _lookup_in(self, index, issn_type, any_issn, packed_issn):
+        if packed_issn is None:
+            return index["other"][issn_type].get(any_issn)
+        keys, title_ids = index[issn_type]
+        pos = bisect_left(keys, packed_issn)
+        if pos < len(keys) and keys[pos] == packed_issn:
+            return index["titles"][title_ids[pos]]
+        return None
 
     def lookup(self, any_issn):
-        if any_issn in self.doaj_issn_map:
-            return self.doaj_issn_map[any_issn]
-        elif any_issn in self.doaj_eissn_map:
-            return self.doaj_eissn_map[any_issn]
+        index = self._get_index()
+        packed_issn = self._pack_issn(any_issn)
+        for issn_type in ["print", "electronic"]:
+            journal_title = self._lookup_in(index, issn_type, any_issn, packed_issn)
+            if journal_title is not None:
+                return journal_title
         return None
-        
+
     def download_doaj_csv(self, filename):
         request = Request("https://doaj.org/csv")
         request.add_header("User-Agent", USER_AGENT)
@@ -262,72 +505,127 @@ class DOAJAnalysis(object):
         return filename
 
 class DOABAnalysis(object):
+    """
+    ISBN lookups in the DOAB book list.
 
-    def __init__(self, isbn_handling, doab_csv_file, update=False, verbose=False):
-        self.isbn_map = {}
-        self.isbn_handling = isbn_handling
+    Parsing the DOAB CSV file and normalising its ISBNs is expensive, so the resulting
+    map of normalised ISBNs to (title, publisher, license) is stored in an index file
+    next to the CSV file. The index is only rebuilt if the CSV file (size and
+    modification time) or the ISBN range file changes. Nothing is downloaded or
+    loaded until the first lookup is made.
+
+    Args:
+        isbn_handling: An ISBNHandling object used for ISBN normalisation.
+        doab_csv_file: Path to the DOAB CSV file. Will be downloaded if it does not exist.
+        update: Download a fresh copy of the DOAB CSV file on first use.
+        verbose: Print ISBN normalisation failures and duplicates when building the index.
+        index_file: Path to the index file. Defaults to the CSV file path with the
+                    extension replaced by "_index.json".
+    """
 
-        if not os.path.isfile(doab_csv_file) or update:
-            self.download_doab_csv(doab_csv_file)
+    INDEX_VERSION = 1
 
-        lines = []
+    def __init__(self, isbn_handling, doab_csv_file, update=False, verbose=False, index_file=None):
+        self.isbn_handling = isbn_handling
+        self.doab_csv_file = doab_csv_file
+        self.update = update
+        self.verbose = verbose
+        if index_file is None:
+            index_file = os.path.splitext(doab_csv_file)[0] + "_index.json"
+        self.index_file = index_file
+        self._isbn_map = None
+
+    @property
+    def isbn_map(self):
+        if self._isbn_map is None:
+            self._isbn_map = self._load_isbn_map()
+        return self._isbn_map
+
+    def _get_index_key(self):
+        stat = os.stat(self.doab_csv_file)
+        return {
+            "version": self.INDEX_VERSION,
+            "csv_size": stat.st_size,
+            "csv_mtime": stat.st_mtime_ns,
+            "isbn_ranges": self.isbn_handling.range_message_date
+        }
+
+    def _load_isbn_map(self):
+        if not os.path.isfile(self.doab_csv_file) or self.update:
+            self.download_doab_csv(self.doab_csv_file)
+        index_key = self._get_index_key()
+        if os.path.isfile(self.index_file):
+            try:
+                with open(self.index_file, "r") as index:
+                    content = json.load(index)
+                if content.get("key") == index_key:
+                    return {isbn: tuple(values) for isbn, values in content["isbns"].items()}
+            except ValueError:
+                logging.warning("DOAB index file %s is damaged and will be rebuilt", self.index_file)
+        isbn_map = self._build_isbn_map()
+        tmp_file = self.index_file + ".tmp"
+        with open(tmp_file, "w") as index:
+            json.dump({"key": index_key, "isbns": isbn_map}, index, separators=(",", ":"))
+        os.replace(tmp_file, self.index_file)
+        return isbn_map
+
+    def _build_isbn_map(self):
+        isbn_map = {}
+        duplicate_isbns = set()
         # The file might contain NUL bytes, we need to get rid of them before
         # handing the lines to a DictReader
-        with open(doab_csv_file, "r") as handle:
-            for line in handle:
-                if "\x00" in line:
+        with open(self.doab_csv_file, "r") as handle:
+            lines = (line for line in handle if "\x00" not in line)
+            reader = csv.DictReader(lines)
+            for line in reader:
+                isbn_string = line["ISBN"]
+                record_type = line["Type"]
+                # ATM we focus on books only
+                if record_type != "book":
                     continue
-                lines.append(line)
-        duplicate_isbns = []
-        reader = csv.DictReader(lines)
-        for line in reader:
-            isbn_string = line["ISBN"]
-            record_type = line["Type"]
-            # ATM we focus on books only
-            if record_type != "book":
-                continue
-            # may contain multi-values split by a whitespace, tab, slash or semicolon...
-            isbn_string = isbn_string.replace("/", " ")
-            isbn_string = isbn_string.replace(";", " ")
-            isbn_string = isbn_string.replace("\t", " ")
-            isbn_string = isbn_string.strip()
-            if len(isbn_string) == 0:
-                continue
-            while "  " in isbn_string:
-               isbn_string = isbn_string.replace("  ", " ")
-            isbns = isbn_string.split(" ")
-            # ...which may also contain duplicates
-            for isbn in list(set(isbns)):
-                result = self.isbn_handling.test_and_normalize_isbn(isbn)
-                if not result["valid"]:
-                    if verbose:
-                        msg = "Line {}: ISBN normalization failure ({}): {}"
-                        msg = msg.format(reader.line_num, result["input_value"],
-                                         ISBNHandling.ISBN_ERRORS[result["error_type"]])
-                        print_r(msg)
+                # may contain multi-values split by a whitespace, tab, slash or semicolon...
+                isbn_string = isbn_string.replace("/", " ")
+                isbn_string = isbn_string.replace(";", " ")
+                isbn_string = isbn_string.replace("\t", " ")
+                isbn_string = isbn_string.strip()
+                if len(isbn_string) == 0:
                     continue
-                else:
-                    isbn = result["normalised"]
-                if isbn not in self.isbn_map:
-                    self.isbn_map[isbn] = line
-                else:
-                    if isbn not in duplicate_isbns:
-                        duplicate_isbns.append(isbn)
-                        if verbose:
+                while "  " in isbn_string:
+                   isbn_string = isbn_string.replace("  ", " ")
+                isbns = isbn_string.split(" ")
+                # ...which may also contain duplicates
+                for isbn in list(set(isbns)):
+                    result = self.isbn_handling.test_and_normalize_isbn(isbn)
+                    if not result["valid"]:
+                        if self.verbose:
+                            msg = "Line {}: ISBN normalization failure ({}): {}"
+                            msg = msg.format(reader.line_num, result["input_value"],
+                                             ISBNHandling.ISBN_ERRORS[result["error_type"]])
+                            print_r(msg)
+                        continue
+                    else:
+                        isbn = result["normalised"]
+                    if isbn not in isbn_map:
+                        isbn_map[isbn] = (line["Title"], line["Publisher"], line["License"])
+                    elif isbn not in duplicate_isbns:
+                        duplicate_isbns.add(isbn)
+                        if self.verbose:
                             print_y("ISBN duplicate found in DOAB: " + isbn)
         for duplicate in duplicate_isbns:
             # drop duplicates alltogether
-            del(self.isbn_map[duplicate])
+            del(isbn_map[duplicate])
+        return isbn_map
 
     def lookup(self, isbn):
         result = self.isbn_handling.test_and_normalize_isbn(isbn)
         if result["valid"]:
             norm_isbn = result["normalised"]
             if norm_isbn in self.isbn_map:
+                title, publisher, license_ref = self.isbn_map[norm_isbn]
                 lookup_result =  {
-                    "book_title" : self.isbn_map[norm_isbn]["Title"],
-                    "publisher": self.isbn_map[norm_isbn]["Publisher"],
-                    "license_ref": self.isbn_map[norm_isbn]["License"]
+                    "book_title" : title,
+                    "publisher": publisher,
+                    "license_ref": license_ref
                 }
                 return lookup_result
         return None
@@ -335,6 +633,176 @@ class DOABAnalysis(object):
     def download_doab_csv(self, target):
         urlretrieve("http://www.doabooks.org/doab?func=csv", target)
 
+class IdentifierRegistry(object):
+    """
+    A persistent index of the DOIs and ISBNs found in the OpenAPC data files.
+
+    The index is stored in an SQLite database. For every source file, size and
+    modification time are recorded, update() only re-indexes files which have
+    changed since the last run. Lookups are served from the database, so checking
+    a row for duplicates does not require to load any data file.
+
+    Attributes:
+        db_path: Path to the SQLite database file. Will be created if it doesn't exist.
+                 Defaults to DEFAULT_DB_PATH.
+        source_files: A list of CSV files to index, defaults to DEFAULT_SOURCE_FILES.
+                      Every file must have a "doi" column, the columns "isbn",
+                      "isbn_print" and "isbn_electronic" are indexed if present.
+        update: Bring the index up to date on initialisation.
+    """
+
+    DEFAULT_SOURCE_FILES = [
+        "../data/apc_de.csv",
+        "../data/transformative_agreements/transformative_agreements.csv",
+        "../data/bpc.csv",
+        "../data/unresolved_duplicates.csv"
+    ]
+    ISBN_FIELDS = ["isbn", "isbn_print", "isbn_electronic"]
+    DEFAULT_DB_PATH = "tempfiles/identifier_registry.db"
+    # Increase to discard existing databases when the index format changes
+    SCHEMA_VERSION = 2
+
+    def __init__(self, db_path=None, source_files=None, update=True):
+        if db_path is None:
+            db_path = self.DEFAULT_DB_PATH
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.isdir(db_dir):
+            os.makedirs(db_dir)
+        if source_files is None:
+            source_files = self.DEFAULT_SOURCE_FILES
+        self.source_files = source_files
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        version = self._connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != self.SCHEMA_VERSION:
+            self._connection.execute("DROP TABLE IF EXISTS files")
+            self._connection.execute("DROP TABLE IF EXISTS identifiers")
+            self._connection.execute("PRAGMA user_version = " + str(self.SCHEMA_VERSION))
+        self._connection.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, " +
+                                 "size INTEGER, mtime INTEGER)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS identifiers (value TEXT, " +
+                                 "type TEXT, path TEXT, line INTEGER, institution TEXT, " +
+                                 "period TEXT)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS identifiers_value ON " +
+                                 "identifiers (value, type)")
+        self._connection.commit()
+        if update:
+            self.update()
+
+    @staticmethod
+    def normalise_doi(doi):
+        doi = doi.strip()
+        doi_match = DOI_RE.match(doi)
+        if doi_match:
+            doi = doi_match.groupdict()["doi"]
+        return doi.lower()
+
+    @staticmethod
+    def normalise_isbn(isbn):
+        return "".join([char for char in isbn.upper() if char.isdigit() or char == "X"])
+
+    def update(self):
+        """
+        Re-index all source files which have been changed since the last update.
+
+        Entries of source files which no longer exist (or are no longer part
+        of source_files) are removed.
+
+        Returns:
+            A list of the source files which were (re-)indexed.
+        """
+        updated = []
+        with self._lock:
+            cursor = self._connection.execute("SELECT path, size, mtime FROM files")
+            known_files = {path: (size, mtime) for path, size, mtime in cursor}
+            source_keys = {os.path.abspath(path) for path in self.source_files}
+            for key in known_files:
+                if key not in source_keys:
+                    self._remove_file(key)
+            for path in self.source_files:
+                key = os.path.abspath(path)
+                if not os.path.isfile(path):
+                    if key in known_files:
+                        self._remove_file(key)
+                    continue
+                stat = os.stat(path)
+                if known_files.get(key) == (stat.st_size, stat.st_mtime_ns):
+                    continue
+                self._remove_file(key)
+                self._index_file(path, key, stat)
+                updated.append(path)
+            self._connection.commit()
+        return updated
+
+    def _remove_file(self, key):
+        self._connection.execute("DELETE FROM identifiers WHERE path = ?", (key,))
+        self._connection.execute("DELETE FROM files WHERE path = ?", (key,))
+
+    def _index_file(self, path, key, stat):
+        entries = []
+        with open(path, "r", encoding="utf-8") as csv_file:
+            reader = csv.DictReader(csv_file)
+            isbn_fields = [field for field in self.ISBN_FIELDS if field in reader.fieldnames]
+            for row in reader:
+                # the last physical line of the record, like in other OpenAPC messages
+                line = reader.line_num
+                institution = row.get("institution", "NA")
+                period = row.get("period", "NA")
+                if has_value(row["doi"]):
+                    doi = self.normalise_doi(row["doi"])
+                    entries.append((doi, "doi", key, line, institution, period))
+                isbns = {self.normalise_isbn(row[field]) for field in isbn_fields
+                         if has_value(row[field])}
+                for isbn in isbns:
+                    entries.append((isbn, "isbn", key, line, institution, period))
+        self._connection.executemany("INSERT INTO identifiers VALUES (?, ?, ?, ?, ?, ?)", entries)
+        self._connection.execute("INSERT INTO files VALUES (?, ?, ?)",
+                                 (key, stat.st_size, stat.st_mtime_ns))
+
+    def _lookup(self, value, identifier_type):
+        with self._lock:
+            cursor = self._connection.execute("SELECT path, line, institution, period FROM " +
+                                              "identifiers WHERE value = ? AND type = ? " +
+                                              "ORDER BY path, line", (value, identifier_type))
+            entries = cursor.fetchall()
+        return [{"file": path, "line": line, "institution": institution, "period": period}
+                for path, line, institution, period in entries]
+
+    def lookup_doi(self, doi):
+        """
+        Return all occurences of a DOI in the source files.
+
+        Returns:
+            A list of dicts with the keys "file", "line", "institution" and "period".
+            The list is empty if the DOI is not registered.
+        """
+        if not has_value(doi):
+            return []
+        return self._lookup(self.normalise_doi(doi), "doi")
+
+    def lookup_isbn(self, isbn):
+        """
+        Return all occurences of an ISBN (with or without hyphens) in the source files.
+
+        Returns:
+            A list of dicts, see lookup_doi().
+        """
+        if not has_value(isbn):
+            return []
+        return self._lookup(self.normalise_isbn(isbn), "isbn")
+
+    @staticmethod
+    def format_match(match):
+        """
+        Return a human-readable description of a lookup match.
+        """
+        msg = "{}, line {}, institution: {}, period: {}"
+        return msg.format(match["file"], match["line"], match["institution"], match["period"])
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
 class ISBNHandling(object):
 
     # regex for 13-digit, unsplit ISBNs
@@ -350,14 +818,26 @@ class ISBNHandling(object):
         3: "Input ISBN was split, but the segmentation is invalid"
     }
 
+    # regex for the Range element in the RangeMessage file
+    RANGE_RE = re.compile(r"(?P<min>\d{7})-(?P<max>\d{7})")
+
     def __init__(self, range_file_path, range_file_update=False):
         if not os.path.isfile(range_file_path) or range_file_update:
             self.download_range_file(range_file_path)
         with open(range_file_path, "r") as range_file:
             range_file_content = range_file.read()
             range_file_root = ET.fromstring(range_file_content)
-            self.ean_elements = range_file_root.findall("./EAN.UCCPrefixes/EAN.UCC")
-            self.registration_groups = range_file_root.findall("./RegistrationGroups/Group")
+            self.range_message_date = range_file_root.findtext("MessageDate")
+            # The RangeMessage is compiled once into dicts mapping a prefix (like "978"
+            # or "978-3") to its range table, see _compile_rules.
+            self.ean_rules = OrderedDict()
+            for ean in range_file_root.findall("./EAN.UCCPrefixes/EAN.UCC"):
+                prefix = ean.find("Prefix").text
+                self.ean_rules.setdefault(prefix, self._compile_rules(ean.find("Rules")))
+            self.registration_group_rules = {}
+            for group in range_file_root.findall("./RegistrationGroups/Group"):
+                prefix = group.find("Prefix").text
+                self.registration_group_rules.setdefault(prefix, self._compile_rules(group.find("Rules")))
 
     def download_range_file(self, target):
         urlretrieve("http://www.isbn-international.org/export_rangemessage.xml", target)
@@ -422,15 +902,25 @@ class ISBNHandling(object):
                 checksum += 3 * int(digit)
         return checksum % 10 == 0
 
-    def _get_range_length_from_rules(self, isbn_fragment, rules_element):
-        value = int(isbn_fragment[:7])
-        range_re = re.compile(r"(?P<min>\d{7})-(?P<max>\d{7})")
+    def _compile_rules(self, rules_element):
+        """
+        Turn a Rules element into a tuple of 3 lists (range minimums, range maximums,
+        lengths), sorted by range minimum.
+        """
+        rules = []
         for rule in rules_element.findall("Rule"):
-            range_text = rule.find("Range").text
-            range_match = range_re.match(range_text)
-            if int(range_match["min"]) <= value <= int(range_match["max"]):
-                length = rule.find("Length").text
-                return int(length)
+            range_match = self.RANGE_RE.match(rule.find("Range").text)
+            length = int(rule.find("Length").text)
+            rules.append((int(range_match["min"]), int(range_match["max"]), length))
+        rules.sort()
+        return ([rule[0] for rule in rules], [rule[1] for rule in rules], [rule[2] for rule in rules])
+
+    def _get_range_length_from_rules(self, isbn_fragment, rules):
+        value = int(isbn_fragment[:7])
+        range_mins, range_maxs, lengths = rules
+        index = bisect_right(range_mins, value) - 1
+        if index >= 0 and value <= range_maxs[index]:
+            return lengths[index]
         # Shouldn't happen as the range file is meant to be comprehensive. Undefined ranges are marked
         # with a length of 0 instead.
         msg = ('Could not find a length definition for fragment "' + isbn_fragment + '" in the ISBN ' +
@@ -463,12 +953,10 @@ class ISBNHandling(object):
         if not self.ISBN_RE.match(isbn):
             ret_value['value'] = '"' + str(isbn) + '" is no valid 13-digit ISBN!'
             return ret_value
-        for ean in self.ean_elements:
-            prefix = ean.find("Prefix").text
+        for prefix, rules in self.ean_rules.items():
             if remaining_isbn.startswith(prefix):
                 split_isbn += prefix
                 remaining_isbn = remaining_isbn[len(prefix):]
-                rules = ean.find("Rules")
                 length = self._get_range_length_from_rules(remaining_isbn, rules)
                 if length == 0:
                     msg = ('Invalid ISBN: Remaining fragment "{}" for EAN prefix "{}" is inside a ' +
@@ -483,29 +971,26 @@ class ISBNHandling(object):
             msg = 'ISBN "{}" does not seem to have a valid prefix.'
             ret_value['value'] = msg.format(isbn)
             return ret_value
-        for group in self.registration_groups:
-            prefix = group.find("Prefix").text
-            if split_isbn == prefix:
-                rules = group.find("Rules")
-                length = self._get_range_length_from_rules(remaining_isbn, rules)
-                if length == 0:
-                    msg = ('Invalid ISBN: Remaining fragment "{}" for registration group "{}" is ' +
-                           'inside a range which is not marked for use yet')
-                    ret_value['value'] = msg.format(remaining_isbn, split_isbn)
-                    return ret_value
-                registrant = remaining_isbn[:length]
-                split_isbn += "-" + registrant
-                remaining_isbn = remaining_isbn[length:]
-                check_digit = remaining_isbn[-1:]
-                publication_number = remaining_isbn[:-1]
-                split_isbn += "-" + publication_number + "-" + check_digit
-                ret_value['success'] = True
-                ret_value['value'] = split_isbn
-                return ret_value
-        else:
+        rules = self.registration_group_rules.get(split_isbn)
+        if rules is None:
             msg = 'ISBN "{}" does not seem to have a valid registration group element.'
             ret_value['value'] = msg.format(isbn)
             return ret_value
+        length = self._get_range_length_from_rules(remaining_isbn, rules)
+        if length == 0:
+            msg = ('Invalid ISBN: Remaining fragment "{}" for registration group "{}" is ' +
+                   'inside a range which is not marked for use yet')
+            ret_value['value'] = msg.format(remaining_isbn, split_isbn)
+            return ret_value
+        registrant = remaining_isbn[:length]
+        split_isbn += "-" + registrant
+        remaining_isbn = remaining_isbn[length:]
+        check_digit = remaining_isbn[-1:]
+        publication_number = remaining_isbn[:-1]
+        split_isbn += "-" + publication_number + "-" + check_digit
+        ret_value['success'] = True
+        ret_value['value'] = split_isbn
+        return ret_value
 
 class CSVAnalysisResult(object):
 
@@ -587,17 +1072,427 @@ class BufferedErrorHandler(MemoryHandler):
     def shouldFlush(self, record):
         return False
 
-class NoRedirection(HTTPErrorProcessor):
+class HTTPResponseCache(object):
     """
-    A dummy processor to suppress HTTP redirection.
+    A persistent on-disk cache for metadata API responses.
 
-    This handler serves the simple purpose of stopping redirection for
-    easy extraction of shortDOI redirect targets.
+    Raw responses are stored in an SQLite database inside the cache directory,
+    keyed by request URL and Accept header. 404 results are cached as well
+    (negative caching) since DOIs not registered with an agency are usually looked
+    up again and again. The cache is safe to use from several threads.
+
+    Attributes:
+        cache_dir: The directory to store the cache database in. Will be created
+                   if it doesn't exist.
+        ttl: Number of seconds after which a cached response expires. None means
+             responses will never expire.
+        negative_ttl: Number of seconds after which a cached 404 result expires.
+                      None means 404 results will never expire.
+        offline: If True, no network requests will be made at all. Lookups which
+                 cannot be served from the cache will fail with an URLError.
     """
-    def http_response(self, request, response):
-        return response
 
-    https_response = http_response
+    DB_FILE_NAME = "http_cache.sqlite"
+
+    def __init__(self, cache_dir, ttl=None, negative_ttl=None, offline=False):
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.offline = offline
+        self._lock = threading.Lock()
+        db_path = os.path.join(cache_dir, self.DB_FILE_NAME)
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, " +
+                                 "status INTEGER, content BLOB, timestamp REAL)")
+        self._connection.commit()
+
+    @staticmethod
+    def get_key(request):
+        accept = request.get_header("Accept", "")
+        return request.get_full_url() + " " + accept
+
+    def get(self, request):
+        """
+        Return a cached (status, content) tuple for a request or None if there is
+        no valid cache entry.
+        """
+        key = self.get_key(request)
+        with self._lock:
+            cursor = self._connection.execute("SELECT status, content, timestamp FROM " +
+                                              "responses WHERE key = ?", (key,))
+            entry = cursor.fetchone()
+        if entry is None:
+            return None
+        status, content, timestamp = entry
+        ttl = self.ttl if status == 200 else self.negative_ttl
+        if ttl is not None and time.time() - timestamp > ttl:
+            return None
+        return (status, content)
+
+    def put(self, request, status, content):
+        key = self.get_key(request)
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                                     (key, status, content, time.time()))
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+class RateLimiter(object):
+    """
+    A thread-safe token bucket limiting the request rate to a single host.
+
+    All threads using the same HTTPSession share one RateLimiter per host. The rate
+    is adapted to the limits announced by the server (Crossref uses the headers
+    X-Rate-Limit-Limit and X-Rate-Limit-Interval for this) and the bucket can be
+    blocked for a while if the server asks us to back off (Retry-After).
+
+    When the server complains about too many requests, a throttle factor is
+    applied on top of the rate. The factor is halved on every complaint and
+    recovers gradually, doubling every THROTTLE_RECOVERY seconds, so an
+    announced rate limit does not lift the throttling right away.
+
+    Attributes:
+        rate: Number of requests allowed per second (before throttling). None
+              means unlimited.
+        capacity: Max number of requests which may be sent in a burst.
+    """
+
+    INTERVAL_RE = re.compile(r"^(?P<value>\d+)(?P<unit>ms|s|m|h)?$")
+    UNIT_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    THROTTLE_RECOVERY = 30
+    MIN_THROTTLE_FACTOR = 1 / 64
+
+    def __init__(self, rate=None, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0
+        self._throttle_factor = 1.0
+        self._throttled_at = 0
+        self._lock = threading.Lock()
+
+    def _get_throttle_factor(self, now):
+        if self._throttle_factor >= 1:
+            return 1.0
+        factor = self._throttle_factor * 2 ** ((now - self._throttled_at) / self.THROTTLE_RECOVERY)
+        if factor >= 1:
+            self._throttle_factor = 1.0
+            return 1.0
+        return factor
+
+    def get_effective_rate(self):
+        """
+        Return the current rate including throttling (None if unlimited).
+        """
+        with self._lock:
+            if self.rate is None:
+                return None
+            return self.rate * self._get_throttle_factor(time.monotonic())
+
+    def update_from_headers(self, headers):
+        """
+        Adapt the rate to X-Rate-Limit-Limit/X-Rate-Limit-Interval headers, if present.
+        """
+        limit = headers.get("X-Rate-Limit-Limit")
+        interval = headers.get("X-Rate-Limit-Interval")
+        if limit is None or interval is None:
+            return
+        match = self.INTERVAL_RE.match(interval.strip())
+        if not limit.strip().isdigit() or match is None:
+            return
+        seconds = int(match["value"]) * self.UNIT_SECONDS[match["unit"] or "s"]
+        limit = int(limit)
+        if limit < 1 or seconds <= 0:
+            return
+        with self._lock:
+            self.rate = limit / seconds
+            self.capacity = limit
+            self._tokens = min(self._tokens, self.capacity)
+
+    def block(self, seconds):
+        """
+        Do not hand out any tokens for the given number of seconds.
+        """
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def throttle(self):
+        """
+        Halve the throttle factor, used when the server complains about too many requests.
+        """
+        with self._lock:
+            now = time.monotonic()
+            factor = self._get_throttle_factor(now) / 2
+            self._throttle_factor = max(factor, self.MIN_THROTTLE_FACTOR)
+            self._throttled_at = now
+            self._tokens = min(self._tokens, 1)
+
+    def acquire(self):
+        """
+        Block until a request may be sent.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._blocked_until - now
+                if wait <= 0:
+                    if self.rate is None:
+                        return
+                    rate = self.rate * self._get_throttle_factor(now)
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / rate
+            time.sleep(wait)
+
+class HTTPSession(object):
+    """
+    A minimal HTTP client keeping persistent connections to the metadata APIs.
+
+    Connections are kept alive after a request and reused for the next one to the
+    same host, so consecutive lookups don't have to go through TCP and TLS
+    handshakes again. The session is safe to use from several threads, each
+    request takes an idle connection from the pool of its host or opens a new one.
+
+    Requests are rate-limited per host (see RateLimiter) and retried with
+    exponential backoff and jitter if the server responds with 429 or a 5xx
+    error. A Retry-After header takes precedence over the backoff delay.
+
+    Like urlopen(), the session honours the proxy settings from the environment
+    (http_proxy, https_proxy and no_proxy). HTTPS requests are tunneled through
+    the proxy using CONNECT.
+
+    Attributes:
+        pool_size: Max number of idle connections to keep per host. Additional
+                   connections will be closed after use.
+        timeout: Timeout in seconds for establishing a connection and waiting for
+                 a response.
+        max_retries: Max number of retries for a request on 429 and 5xx responses.
+        backoff_base: Base delay in seconds for the exponential backoff.
+        max_redirects: Max number of redirects to follow for a single request.
+        rate_limit: Initial max number of requests per second for every host. If
+                    None, the rates from HTTP_HOST_RATE_LIMITS are used, other hosts
+                    are unlimited until they announce a rate limit.
+    """
+
+    REDIRECT_CODES = [301, 302, 303, 307, 308]
+    RETRY_CODES = [429, 500, 502, 503, 504]
+    MAX_RETRY_DELAY = 120
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, timeout=HTTP_TIMEOUT, max_retries=HTTP_MAX_RETRIES,
+                 backoff_base=1, max_redirects=5, rate_limit=None):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.max_redirects = max_redirects
+        self.rate_limit = rate_limit
+        self._proxies = getproxies()
+        self._pools = {}
+        self._rate_limiters = {}
+        self._lock = threading.Lock()
+
+    def get_rate_limiter(self, host):
+        with self._lock:
+            if host not in self._rate_limiters:
+                rate = self.rate_limit
+                if rate is None:
+                    rate = HTTP_HOST_RATE_LIMITS.get(host)
+                self._rate_limiters[host] = RateLimiter(rate)
+            return self._rate_limiters[host]
+
+    def _get_retry_delay(self, response, attempt):
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is not None:
+            retry_after = retry_after.strip()
+            if retry_after.isdigit():
+                return min(int(retry_after), self.MAX_RETRY_DELAY)
+            try:
+                retry_date = parsedate_to_datetime(retry_after)
+                delay = retry_date.timestamp() - time.time()
+                return min(max(delay, 0), self.MAX_RETRY_DELAY)
+            except (TypeError, ValueError):
+                pass
+        delay = self.backoff_base * 2 ** attempt + random.uniform(0, self.backoff_base)
+        return min(delay, self.MAX_RETRY_DELAY)
+
+    def _request_with_retries(self, method, url, headers):
+        rate_limiter = self.get_rate_limiter(urlsplit(url).netloc)
+        attempt = 0
+        while True:
+            rate_limiter.acquire()
+            response = self._request(method, url, headers)
+            rate_limiter.update_from_headers(response.headers)
+            if response.code not in self.RETRY_CODES or attempt >= self.max_retries:
+                return response
+            delay = self._get_retry_delay(response, attempt)
+            if response.code == 429:
+                rate_limiter.throttle()
+                rate_limiter.block(delay)
+            msg = "HTTPError: %s - %s (%s), retrying in %.1f seconds..."
+            logging.warning(msg, response.code, response.reason, url, delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def _get_proxy(self, scheme, host):
+        """
+        Return a tuple (proxy host, Proxy-Authorization header value or None) for
+        a request, or None if the request should not be sent through a proxy.
+        """
+        proxy = self._proxies.get(scheme)
+        if not proxy or proxy_bypass(host):
+            return None
+        if "://" not in proxy:
+            proxy = "http://" + proxy
+        parts = urlsplit(proxy)
+        proxy_host = parts.netloc.rpartition("@")[2]
+        authorization = None
+        if parts.username is not None:
+            credentials = unquote(parts.username) + ":" + unquote(parts.password or "")
+            authorization = "Basic " + base64.b64encode(credentials.encode("utf-8")).decode("ascii")
+        return (proxy_host, authorization)
+
+    def _get_connection(self, scheme, host, proxy):
+        with self._lock:
+            pool = self._pools.setdefault((scheme, host), deque())
+            if pool:
+                return (pool.pop(), True)
+        if proxy is None:
+            if scheme == "https":
+                return (http.client.HTTPSConnection(host, timeout=self.timeout), False)
+            return (http.client.HTTPConnection(host, timeout=self.timeout), False)
+        proxy_host, authorization = proxy
+        if scheme == "https":
+            connection = http.client.HTTPSConnection(proxy_host, timeout=self.timeout)
+            tunnel_headers = {}
+            if authorization is not None:
+                tunnel_headers["Proxy-Authorization"] = authorization
+            connection.set_tunnel(host, headers=tunnel_headers)
+            return (connection, False)
+        return (http.client.HTTPConnection(proxy_host, timeout=self.timeout), False)
+
+    def _release_connection(self, scheme, host, connection):
+        with self._lock:
+            pool = self._pools.setdefault((scheme, host), deque())
+            if len(pool) < self.pool_size:
+                pool.append(connection)
+                return
+        connection.close()
+
+    def _request(self, method, url, headers):
+        parts = urlsplit(url)
+        selector = parts.path or "/"
+        if parts.query:
+            selector += "?" + parts.query
+        proxy = self._get_proxy(parts.scheme, parts.netloc)
+        if proxy is not None and parts.scheme == "http":
+            # Plain HTTP requests are sent to the proxy with the full URL
+            selector = parts.scheme + "://" + parts.netloc + selector
+            if proxy[1] is not None:
+                headers = dict(headers)
+                headers["Proxy-Authorization"] = proxy[1]
+        while True:
+            connection, reused = self._get_connection(parts.scheme, parts.netloc, proxy)
+            try:
+                connection.request(method, selector, headers=headers)
+                response = connection.getresponse()
+                content = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                connection.close()
+                if reused:
+                    # The server might have closed an idle connection in the meantime
+                    continue
+                raise URLError(e)
+            if response.will_close:
+                connection.close()
+            else:
+                self._release_connection(parts.scheme, parts.netloc, connection)
+            return _SessionResponse(url, response.status, response.reason, response.headers, content)
+
+    def open(self, request, follow_redirects=True):
+        """
+        Perform a request and return the response with its content fully read.
+
+        Args:
+            request: A urllib Request object.
+            follow_redirects: If False, redirect responses will be returned as they are.
+        Returns:
+            A response object with the attributes 'url', 'code', 'reason' and
+            'headers' and a read() method returning the response body.
+        Raises:
+            HTTPError for responses with an error status code, URLError if the
+            request could not be performed.
+        """
+        url = request.get_full_url()
+        headers = dict(request.header_items())
+        # urllib stores header names capitalized ("User-agent")
+        if not request.has_header("User-agent"):
+            headers["User-Agent"] = USER_AGENT
+        for _ in range(self.max_redirects + 1):
+            response = self._request_with_retries(request.get_method(), url, headers)
+            if follow_redirects and response.code in self.REDIRECT_CODES:
+                url = urljoin(url, response.headers["Location"])
+                continue
+            if response.code >= 400:
+                raise HTTPError(url, response.code, response.reason, response.headers, None)
+            return response
+        raise URLError("Too many redirects for " + request.get_full_url())
+
+    def close(self):
+        with self._lock:
+            for pool in self._pools.values():
+                for connection in pool:
+                    connection.close()
+            self._pools = {}
+
+class _SessionResponse(object):
+
+    def __init__(self, url, code, reason, headers, content):
+        self.url = url
+        self.code = code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+
+    def read(self):
+        return self.content
+
+# The shared HTTPSession used for all metadata API requests
+HTTP_SESSION = HTTPSession()
+
+def _fetch_url(request):
+    """
+    Open a request and return the response body, using the RESPONSE_CACHE if set.
+
+    Raises HTTPError and URLError just like urlopen() does. A cached 404 result
+    will be raised as HTTPError again.
+    """
+    cache = RESPONSE_CACHE
+    if cache is not None:
+        cached = cache.get(request)
+        if cached is not None:
+            status, content = cached
+            if status == 200:
+                return content
+            raise HTTPError(request.get_full_url(), status, "Not Found (cached)", None, None)
+        if cache.offline:
+            raise URLError("Offline mode, no cached response for " + request.get_full_url())
+    try:
+        content = HTTP_SESSION.open(request).read()
+    except HTTPError as httpe:
+        if cache is not None and httpe.code == 404:
+            cache.put(request, 404, b"")
+        raise httpe
+    if cache is not None:
+        cache.put(request, 200, content)
+    return content
 
 def get_normalised_DOI(doi_string):
     doi_string = doi_string.strip()
@@ -610,9 +1505,8 @@ def get_normalised_DOI(doi_string):
         # Extract redirect URL to obtain original DOI
         shortdoi = shortdoi_match.groupdict()["shortdoi"]
         url = "https://doi.org/" + shortdoi
-        opener = build_opener(NoRedirection)
         try:
-            res = opener.open(url)
+            res = HTTP_SESSION.open(Request(url), follow_redirects=False)
             if res.code == 301:
                 doi_match = DOI_RE.match(res.headers["Location"])
                 if doi_match:
@@ -651,7 +1545,42 @@ def is_valid_ISSN(issn_string):
             return True
     return False
 
+# regex matching a whitespace-only line (without the preceding newline) in a byte string
+BLANK_LINE_RE = re.compile(rb"\n[ \t\r\x0b\x0c]*(?=\n)")
+
+def _count_blank_lines(byte_file, chunk_size=1024*1024):
+    """
+    Count the whitespace-only lines in a binary file from its current position onwards.
+
+    The current position must be at the start of a line. The file is scanned in chunks,
+    a line is considered blank under the same conditions as with bytes.strip().
+    """
+    blanks = 0
+    # a virtual newline preceding the first line, followed by the (unfinished)
+    # last line of the previous chunk
+    pending = b"\n"
+    while True:
+        chunk = byte_file.read(chunk_size)
+        if not chunk:
+            break
+        buf = pending + chunk
+        blanks += len(BLANK_LINE_RE.findall(buf))
+        pending = buf[buf.rfind(b"\n"):]
+        if pending.strip():
+            # The unfinished line isn't blank, no need to carry all of it along
+            pending = b"\nx"
+    if len(pending) > 1 and not pending.strip():
+        blanks += 1
+    return blanks
+
 def analyze_csv_file(file_path, test_lines=1000, enc=None):
+    """
+    Guess encoding and CSV dialect of a file and count its blank lines.
+
+    Only a bounded prefix (the first test_lines non-blank lines) is read for
+    encoding detection and dialect sniffing. The remainder of the file is scanned
+    once in chunks to count blank lines.
+    """
     try:
         csv_file = open(file_path, "rb")
     except IOError as ioe:
@@ -662,22 +1591,30 @@ def analyze_csv_file(file_path, test_lines=1000, enc=None):
     guessed_enc = None
     guessed_enc_confidence = None
     blanks = 0
-    if chardet:
-        byte_content = b"" # in python3 chardet operates on bytes
+    detector = chardet.UniversalDetector() if chardet else None # in python3 chardet operates on bytes
+    prefix = bytearray()
+    eof = False
+    with csv_file:
         lines_processed = 0
-        for line in csv_file:
+        while lines_processed <= test_lines:
+            line = csv_file.readline()
+            if not line:
+                eof = True
+                break
+            prefix += line
             if line.strip(): # omit blank lines
                 lines_processed += 1
-                if lines_processed <= test_lines:
-                    byte_content += line
+                if detector is not None and lines_processed <= test_lines and not detector.done:
+                    detector.feed(line)
             else:
                 blanks += 1
-        chardet_result = chardet.detect(byte_content)
+        if not eof:
+            blanks += _count_blank_lines(csv_file)
+    if detector is not None:
+        chardet_result = detector.close()
         guessed_enc = chardet_result["encoding"]
         guessed_enc_confidence = chardet_result["confidence"]
 
-    csv_file.close()
-
     if enc is not None:
         used_encoding = enc
     elif guessed_enc is not None:
@@ -685,22 +1622,18 @@ def analyze_csv_file(file_path, test_lines=1000, enc=None):
     else:
         used_encoding = locale.getpreferredencoding()
 
-    text_content = ""
-    with open(file_path, "r", encoding=used_encoding) as csv_file:
-        try:
-            lines_processed = 0
-            for line in csv_file:
-                if line.strip(): # omit blank lines
-                    lines_processed += 1
-                    text_content += line
-                    if lines_processed > test_lines:
-                        break
-        except UnicodeError as ue:
-            error = ('A UnicodeError occured while trying to read the csv ' +
-                     'file ("{}") - it seems the encoding we used ({}) is ' +
-                     'not correct.')
-            error_msg = error.format(str(ue), used_encoding)
-            return {"success": False, "error_msg": error_msg}
+    try:
+        decoder = codecs.getincrementaldecoder(used_encoding)()
+        text = decoder.decode(prefix, final=eof)
+    except UnicodeError as ue:
+        error = ('A UnicodeError occured while trying to read the csv ' +
+                 'file ("{}") - it seems the encoding we used ({}) is ' +
+                 'not correct.')
+        error_msg = error.format(str(ue), used_encoding)
+        return {"success": False, "error_msg": error_msg}
+    # Mimic reading the file in text mode (universal newlines)
+    text_lines = [line for line in io.StringIO(text, newline=None) if line.strip()]
+    text_content = "".join(text_lines[:test_lines + 1])
 
     sniffer = csv.Sniffer()
     try:
@@ -713,7 +1646,23 @@ def analyze_csv_file(file_path, test_lines=1000, enc=None):
     result = CSVAnalysisResult(blanks, dialect, has_header, guessed_enc, guessed_enc_confidence)
     return {"success": True, "data": result}
 
-def get_csv_file_content(file_name, enc=None, force_header=False, print_results=True):
+def iterate_csv_file(file_name, enc=None, force_header=False, print_results=True):
+    """
+    Open a CSV file for streaming, the iterator-based counterpart to get_csv_file_content.
+
+    Encoding and dialect are guessed with analyze_csv_file (unless an encoding is given),
+    but rows are read lazily, so arbitrarily large files can be processed in constant memory.
+
+    Args:
+        file_name: Path to the CSV file.
+        enc: The file encoding. Will be guessed if omitted.
+        force_header: Treat the first row as header even if the sniffer disagrees.
+        print_results: Print the results of the CSV analysis.
+    Returns:
+        A tuple (header, rows). header is a list containing the header row (or an empty
+        list if there is none), rows is a generator yielding the remaining rows as lists.
+        The file is closed once the generator is exhausted or closed.
+    """
     result = analyze_csv_file(file_name, enc=enc)
     if result["success"]:
         csv_analysis = result["data"]
@@ -731,16 +1680,19 @@ def get_csv_file_content(file_name, enc=None, force_header=False, print_results=
     dialect = csv_analysis.dialect
 
     csv_file = open(file_name, "r", encoding=enc)
-
-    content = []
     reader = csv.reader(csv_file, dialect=dialect)
     header = []
     if csv_analysis.has_header or force_header:
         header.append(next(reader))
-    for row in reader:
-        content.append(row)
-    csv_file.close()
-    return (header, content)
+    return (header, _iterate_csv_rows(csv_file, reader))
+
+def _iterate_csv_rows(csv_file, reader):
+    with csv_file:
+        yield from reader
+
+def get_csv_file_content(file_name, enc=None, force_header=False, print_results=True):
+    header, rows = iterate_csv_file(file_name, enc, force_header, print_results)
+    return (header, list(rows))
 
 def has_value(field):
     return len(field) > 0 and field != "NA"
@@ -855,8 +1807,7 @@ def find_book_dois_in_crossref(isbn_list):
         "dois": []
     }
     try:
-        ret = urlopen(request)
-        content = ret.read()
+        content = _fetch_url(request)
         data = json.loads(content)
         if data["message"]["total-results"] == 0:
             ret_value["success"] = True
@@ -968,8 +1919,7 @@ def get_metadata_from_crossref(doi_string):
     req.add_header("Accept", "application/vnd.crossref.unixsd+xml")
     ret_value = {'success': True}
     try:
-        response = urlopen(req)
-        content_string = response.read()
+        content_string = _fetch_url(req)
         root = ET.fromstring(content_string)
         doi_element = root.findall(".//cr_qr:doi", namespaces)
         doi_type = doi_element[0].attrib['type']
@@ -1007,6 +1957,129 @@ def get_metadata_from_crossref(doi_string):
         ret_value['error_msg'] = str(ve)
     return ret_value
 
+def _get_crossref_prefix_name(prefix):
+    """
+    Look up the name of a DOI prefix owner in Crossref (memoised).
+
+    Returns None if the name could not be obtained, like a missing
+    'prefix-name' in get_metadata_from_crossref(). Only HTTP errors are
+    memoised, connection errors may be transient.
+    """
+    if prefix is None:
+        return None
+    if prefix not in CROSSREF_PREFIX_NAMES:
+        request = Request("https://api.crossref.org/prefixes/" + prefix)
+        request.add_header("User-Agent", USER_AGENT)
+        try:
+            data = json.loads(_fetch_url(request))
+            CROSSREF_PREFIX_NAMES[prefix] = data["message"]["name"]
+        except HTTPError:
+            CROSSREF_PREFIX_NAMES[prefix] = None
+        except (URLError, KeyError, TypeError, ValueError):
+            return None
+    return CROSSREF_PREFIX_NAMES[prefix]
+
+def _get_crossref_data_from_json(item, doi_types):
+    """
+    Map a work item from the Crossref REST API to the same dict of metadata
+    get_metadata_from_crossref() extracts from Crossref XML.
+    """
+    doi_type = doi_types.get(item["type"])
+    if doi_type is None:
+        msg = ('Unsupported DOI type "{}" (OpenAPC only supports the following types: {}')
+        # Use the XML type name, so the message matches the one of get_metadata_from_crossref()
+        msg = msg.format(item["type"].replace("-", "_"), ", ".join(OrderedDict.fromkeys(doi_types.values())))
+        raise ValueError(msg)
+    crossref_data = {
+        "doi_type": doi_type,
+        "publisher": item.get("publisher"),
+        "prefix": _get_crossref_prefix_name(item.get("prefix")),
+        "license_ref": None
+    }
+    licenses = item.get("license", [])
+    if licenses:
+        # If there's more than one license, prefer the one for the version of record
+        crossref_data["license_ref"] = licenses[0]["URL"]
+        for lic in licenses:
+            if lic.get("content-version") == "vor":
+                crossref_data["license_ref"] = lic["URL"]
+                break
+    if doi_type == "journal_article":
+        id_field, id_type_field = "ISSN", "issn-type"
+        titles = item.get("container-title", [])
+        crossref_data["journal_full_title"] = titles[0] if titles else None
+    else:
+        id_field, id_type_field = "ISBN", "isbn-type"
+        titles = item.get("title", [])
+        crossref_data["book_title"] = titles[0] if titles else None
+    id_prefix = id_field.lower()
+    ids = item.get(id_field, [])
+    crossref_data[id_prefix] = ids[0] if ids else None
+    crossref_data[id_prefix + "_print"] = None
+    crossref_data[id_prefix + "_electronic"] = None
+    for typed_id in item.get(id_type_field, []):
+        key = id_prefix + "_" + typed_id["type"]
+        if key in crossref_data and crossref_data[key] is None:
+            crossref_data[key] = typed_id["value"]
+    return crossref_data
+
+def get_metadata_from_crossref_batch(doi_list):
+    """
+    Look up a list of DOIs in Crossref using a single request to the REST API.
+
+    This is a batched variant of get_metadata_from_crossref(). It uses the JSON
+    REST API and a DOI filter to resolve many DOIs at once and maps the results to
+    the same metadata dicts. Note that the 'prefix' value requires an additional
+    lookup for every DOI prefix, results are memoised.
+
+    Args:
+        doi_list: A list of normalised DOIs. DOIs containing commas cannot be
+                  used in a filter and will be ignored.
+    Returns:
+        A dict with a key 'success'. If the request was successful, 'success'
+        will be True and the dict will have a second entry 'results' which maps
+        the DOIs from the input list to result dicts as returned by
+        get_metadata_from_crossref(). DOIs missing from the batch response are
+        left out, they should be looked up with get_metadata_from_crossref().
+
+        If the request failed, 'success' will be False and the dict will
+        contain a second entry 'error_msg' with a string value
+        stating the reason.
+    """
+    dois = [doi.lower() for doi in doi_list if "," not in doi]
+    ret_value = {"success": False}
+    if not dois:
+        ret_value["success"] = True
+        ret_value["results"] = {}
+        return ret_value
+    filters = ",".join(["doi:" + quote(doi, safe="/") for doi in dois])
+    url = "https://api.crossref.org/works?filter=" + filters + "&rows=" + str(len(dois))
+    request = Request(url)
+    request.add_header("User-Agent", USER_AGENT)
+    try:
+        content = _fetch_url(request)
+        data = json.loads(content)
+        results = {}
+        for item in data["message"]["items"]:
+            doi = item["DOI"].lower()
+            try:
+                crossref_data = _get_crossref_data_from_json(item, CROSSREF_JSON_TYPES)
+                results[doi] = {"success": True, "data": crossref_data}
+            except ValueError as ve:
+                results[doi] = {"success": False, "error_msg": str(ve)}
+            except KeyError as ke:
+                msg = "Unexpected Crossref API response: {}".format(str(ke))
+                results[doi] = {"success": False, "error_msg": msg}
+        ret_value["success"] = True
+        ret_value["results"] = results
+    except HTTPError as httpe:
+        ret_value['error_msg'] = "HTTPError: {} - {}".format(httpe.code, httpe.reason)
+    except URLError as urle:
+        ret_value['error_msg'] = "URLError: {}".format(urle.reason)
+    except (KeyError, ValueError) as e:
+        ret_value['error_msg'] = "Unexpected Crossref API response: {}".format(str(e))
+    return ret_value
+
 def get_metadata_from_pubmed(doi_string):
     """
     Look up a DOI in Europe PMC and extract Pubmed ID and Pubmed Central ID
@@ -1034,8 +2107,7 @@ def get_metadata_from_pubmed(doi_string):
     req = Request(url)
     ret_value = {'success': True}
     try:
-        response = urlopen(req)
-        content_string = response.read()
+        content_string = _fetch_url(req)
         root = ET.fromstring(content_string)
         pubmed_data = {}
         xpaths = {
@@ -1057,6 +2129,136 @@ def get_metadata_from_pubmed(doi_string):
         ret_value['error_msg'] = "URLError: {}".format(urle.reason)
     return ret_value
 
+def get_metadata_from_pubmed_batch(doi_list):
+    """
+    Look up a list of DOIs in Europe PMC and extract Pubmed IDs and Pubmed Central IDs
+
+    This is a batched variant of get_metadata_from_pubmed(). All DOIs are combined
+    into a single OR query, the result is paged through if necessary.
+
+    Args:
+        doi_list: A list of normalised DOIs.
+    Returns:
+        A dict with a key 'success'. If the lookup was successful, 'success'
+        will be True and the dict will have a second entry 'results' which maps
+        every DOI from the input list to a result dict as returned by
+        get_metadata_from_pubmed(). DOIs not found in Europe PMC will have None
+        values for pmid and pmcid.
+
+        If the lookup failed, 'success' will be False and the dict will
+        contain a second entry 'error_msg' with a string value
+        stating the reason.
+    """
+    dois = [doi.lower() for doi in doi_list]
+    ret_value = {"success": False}
+    query = " OR ".join(['DOI:"' + doi.replace('"', '') + '"' for doi in dois])
+    url = ("https://www.ebi.ac.uk/europepmc/webservices/rest/search?format=json&" +
+           "resultType=lite&pageSize=1000&query=" + quote(query))
+    pubmed_data = {}
+    cursor_mark = "*"
+    try:
+        while True:
+            req = Request(url + "&cursorMark=" + quote(cursor_mark))
+            data = json.loads(_fetch_url(req))
+            results = data["resultList"]["result"]
+            for result in results:
+                doi = result.get("doi", "").lower()
+                # Use the first result for a DOI, like get_metadata_from_pubmed() does
+                if doi in pubmed_data:
+                    continue
+                pubmed_data[doi] = {"pmid": result.get("pmid"), "pmcid": result.get("pmcid")}
+            next_cursor_mark = data.get("nextCursorMark")
+            if not results or next_cursor_mark is None or next_cursor_mark == cursor_mark:
+                break
+            cursor_mark = next_cursor_mark
+        ret_value["results"] = {}
+        for doi in dois:
+            data = pubmed_data.get(doi, {"pmid": None, "pmcid": None})
+            ret_value["results"][doi] = {"success": True, "data": data}
+        ret_value["success"] = True
+    except HTTPError as httpe:
+        ret_value['error_msg'] = "HTTPError: {} - {}".format(httpe.code, httpe.reason)
+    except URLError as urle:
+        ret_value['error_msg'] = "URLError: {}".format(urle.reason)
+    except (KeyError, ValueError) as e:
+        ret_value['error_msg'] = "Unexpected Europe PMC API response: {}".format(str(e))
+    return ret_value
+
+def _prefetch_doi(doi_string, no_crossref_lookup, no_pubmed_lookup):
+    doi = get_normalised_DOI(doi_string)
+    if doi is None:
+        return (None, None)
+    results = {"crossref": None, "pubmed": None}
+    if not no_crossref_lookup:
+        results["crossref"] = get_metadata_from_crossref(doi)
+    if not no_pubmed_lookup:
+        results["pubmed"] = get_metadata_from_pubmed(doi)
+    return (doi, results)
+
+def prefetch_metadata(doi_list, workers, no_crossref_lookup=False, no_pubmed_lookup=False,
+                      crossref_batch_size=1, pubmed_batch_size=1):
+    """
+    Look up a list of DOIs in Crossref and Europe PMC concurrently.
+
+    The network lookups performed by process_row() are fanned out to a bounded
+    pool of worker threads. The results can be handed to process_row() afterwards,
+    which will then only do the (serial) processing and conflict resolution.
+
+    Args:
+        doi_list: A list of strings representing DOIs. Duplicates and values which
+                  cannot be normalised will be skipped.
+        workers: The number of worker threads to use.
+        no_crossref_lookup: If true, no metadata will be imported from crossref.
+        no_pubmed_lookup: If true, no_metadata will be imported from pubmed.
+        crossref_batch_size: If larger than 1, Crossref lookups will be performed in
+                             batches of this size using get_metadata_from_crossref_batch().
+                             DOIs from failed batch requests or missing from a batch response
+                             will be left out, process_row() will look them up individually.
+        pubmed_batch_size: If larger than 1, Europe PMC lookups will be performed in
+                           batches of this size using get_metadata_from_pubmed_batch().
+    Returns:
+        A dict mapping normalised DOIs to dicts with two keys, 'crossref' and 'pubmed'.
+        Their values are the results of get_metadata_from_crossref() and
+        get_metadata_from_pubmed() or None if the lookup was disabled.
+    """
+    if workers < 1:
+        raise ValueError("Number of workers must be at least 1!")
+    prefetched = {}
+    unique_dois = list(OrderedDict.fromkeys([doi for doi in doi_list if has_value(doi)]))
+    total = len(unique_dois)
+    batch_lookups = []
+    if crossref_batch_size > 1 and not no_crossref_lookup:
+        batch_lookups.append(("crossref", "Crossref", get_metadata_from_crossref_batch, crossref_batch_size))
+    if pubmed_batch_size > 1 and not no_pubmed_lookup:
+        batch_lookups.append(("pubmed", "Pubmed", get_metadata_from_pubmed_batch, pubmed_batch_size))
+    batched_sources = [lookup[0] for lookup in batch_lookups]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_prefetch_doi, doi, no_crossref_lookup or "crossref" in batched_sources,
+                                   no_pubmed_lookup or "pubmed" in batched_sources)
+                   for doi in unique_dois]
+        for num, future in enumerate(as_completed(futures), 1):
+            doi, results = future.result()
+            if doi is not None:
+                prefetched[doi] = results
+            if num % 100 == 0 or num == total:
+                print_b("Prefetching metadata: {} of {} DOIs processed".format(num, total))
+        dois = list(prefetched.keys())
+        for source, source_name, lookup_function, batch_size in batch_lookups:
+            batches = [dois[i:i + batch_size] for i in range(0, len(dois), batch_size)]
+            futures = [executor.submit(lookup_function, batch) for batch in batches]
+            for num, future in enumerate(as_completed(futures), 1):
+                batch_result = future.result()
+                if batch_result["success"]:
+                    for doi, result in batch_result["results"].items():
+                        if doi in prefetched:
+                            prefetched[doi][source] = result
+                else:
+                    msg = "%s batch lookup failed, DOIs will be looked up individually: %s"
+                    logging.warning(msg, source_name, batch_result["error_msg"])
+                msg = "Prefetching {} metadata: {} of {} batches processed"
+                print_b(msg.format(source_name, num, len(batches)))
+    return prefetched
+
 def get_euro_exchange_rates(currency, frequency="D"):
     """
     Obtain historical euro exchange rates against a certain currency from the European Central Bank.
@@ -1262,9 +2464,33 @@ def _process_isbn(row_num, isbn, isbn_handling):
                             ISBNHandling.ISBN_ERRORS[norm_res["error_type"]])
             return "NA"
 
+def _check_registered_identifiers(current_row, row_num, additional_isbns, identifier_registry):
+    """
+    Look up the DOI and ISBNs of a row in an IdentifierRegistry.
+
+    Every match is logged as an error.
+
+    Returns:
+        True if any identifier of the row is already registered, False otherwise.
+    """
+    matches = []
+    if has_value(current_row["doi"]):
+        for match in identifier_registry.lookup_doi(current_row["doi"]):
+            matches.append(("DOI", current_row["doi"], match))
+    isbns = [current_row.get(field, "NA") for field in IdentifierRegistry.ISBN_FIELDS]
+    for isbn in set(isbns + additional_isbns):
+        if has_value(isbn):
+            for match in identifier_registry.lookup_isbn(isbn):
+                matches.append(("ISBN", isbn, match))
+    for identifier_type, value, match in matches:
+        msg = "Line %s: Duplicate: %s %s is already part of the OpenAPC data (%s)"
+        logging.error(msg, row_num, identifier_type, value, IdentifierRegistry.format_match(match))
+    return len(matches) > 0
+
 def process_row(row, row_num, column_map, num_required_columns, additional_isbn_columns,
                 doab_analysis, doaj_analysis, no_crossref_lookup=False, no_pubmed_lookup=False,
-                no_doaj_lookup=False, round_monetary=False, offsetting_mode=None, crossref_max_retries=3):
+                no_doaj_lookup=False, round_monetary=False, offsetting_mode=None,
+                prefetched_metadata=None, identifier_registry=None):
     """
     Enrich a single row of data and reformat it according to OpenAPC standards.
 
@@ -1292,13 +2518,18 @@ def process_row(row, row_num, column_map, num_required_columns, additional_isbn_
                         mark will be rounded. If false, these cases will be treated as errors.
         offsetting_mode: If not None, the row is assumed to originate from an offsetting file
                          and this argument's value will be added to the 'agreement' column
-        crossref_max_retries: Max number of attempts to query the crossref API if a 504 error
-                              is received.
+        prefetched_metadata: An optional dict of Crossref/Pubmed lookup results as returned by
+                             prefetch_metadata(). DOIs found in here will not be looked up again.
+        identifier_registry: An optional IdentifierRegistry. If the DOI or one of the ISBNs of
+                             the row is already registered, an error is logged and no Crossref
+                             or Pubmed lookups are performed for the row.
      Returns:
         A list of values which represents the enriched and re-arranged variant
         of the input row. If no errors were logged during the process, this
         result will conform to the OpenAPC data schema.
     """
+    if prefetched_metadata is None:
+        prefetched_metadata = {}
     if len(row) != num_required_columns:
         msg = "Line %s: " + MESSAGES["num_columns"]
         logging.error(msg, row_num, len(row), num_required_columns)
@@ -1322,12 +2553,23 @@ def process_row(row, row_num, column_map, num_required_columns, additional_isbn_
             else:
                 current_row[column_type] = "NA"
 
+    is_duplicate = False
+    if identifier_registry is not None:
+        additional_isbns = [row[i] for i in additional_isbn_columns]
+        is_duplicate = _check_registered_identifiers(current_row, row_num, additional_isbns,
+                                                     identifier_registry)
+        if is_duplicate:
+            # No need to spend any lookups on an entry which will be rejected anyway
+            no_crossref_lookup = True
+            no_pubmed_lookup = True
+
     doi = current_row["doi"]
     if len(doi) == 0 or doi == 'NA':
-        # lookup ISBNs in crossref
         msg = ("Line %s: No DOI found")
         logging.info(msg, row_num)
         current_row["indexed_in_crossref"] = "FALSE"
+    if (len(doi) == 0 or doi == 'NA') and not is_duplicate:
+        # lookup ISBNs in crossref
         additional_isbns = [row[i] for i in additional_isbn_columns]
         found_doi, r_type = _isbn_lookup(current_row, row_num, additional_isbns, doab_analysis.isbn_handling)
         if r_type is not None:
@@ -1339,7 +2581,8 @@ def process_row(row, row_num, column_map, num_required_columns, additional_isbn_
             row[index] = found_doi
             return process_row(row, row_num, column_map, num_required_columns, additional_isbn_columns,
                 doab_analysis, doaj_analysis, no_crossref_lookup, no_pubmed_lookup,
-                no_doaj_lookup, round_monetary, offsetting_mode)
+                no_doaj_lookup, round_monetary, offsetting_mode,
+                prefetched_metadata, identifier_registry)
     if has_value(doi):
         # Normalise DOI
         norm_doi = get_normalised_DOI(doi)
@@ -1350,18 +2593,12 @@ def process_row(row, row_num, column_map, num_required_columns, additional_isbn_
             doi = norm_doi
         # include crossref metadata
         if not no_crossref_lookup:
-            crossref_result = get_metadata_from_crossref(doi)
-            retries = 0
-            while not crossref_result["success"] and crossref_result["error_msg"].startswith("HTTPError: 504"):
-                if retries >= crossref_max_retries:
-                    break
-                # retry on gateway timeouts, crossref API is quite busy sometimes
-                msg = "%s, retrying..."
-                logging.warning(msg, crossref_result["error_msg"])
-                retries += 1
+            if doi in prefetched_metadata and prefetched_metadata[doi]["crossref"] is not None:
+                crossref_result = prefetched_metadata[doi]["crossref"]
+            else:
                 crossref_result = get_metadata_from_crossref(doi)
             if crossref_result["success"]:
-                data = crossref_result["data"]
+                data = dict(crossref_result["data"])
                 record_type = data.pop("doi_type")
                 logging.info("Crossref: DOI resolved: " + doi + " [" + record_type + "]")
                 current_row["indexed_in_crossref"] = "TRUE"
@@ -1386,10 +2623,14 @@ def process_row(row, row_num, column_map, num_required_columns, additional_isbn_
                     row[index] = found_doi
                     return process_row(row, row_num, column_map, num_required_columns, additional_isbn_columns,
                                        doab_analysis, doaj_analysis, no_crossref_lookup, no_pubmed_lookup,
-                                       no_doaj_lookup, round_monetary, offsetting_mode)
+                                       no_doaj_lookup, round_monetary, offsetting_mode,
+                                       prefetched_metadata, identifier_registry)
         # include pubmed metadata
         if not no_pubmed_lookup:
-            pubmed_result = get_metadata_from_pubmed(doi)
+            if doi in prefetched_metadata and prefetched_metadata[doi]["pubmed"] is not None:
+                pubmed_result = prefetched_metadata[doi]["pubmed"]
+            else:
+                pubmed_result = get_metadata_from_pubmed(doi)
             if pubmed_result["success"]:
                 logging.info("Pubmed: DOI resolved: " + doi)
                 data = pubmed_result["data"]
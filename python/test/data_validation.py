@@ -0,0 +1,707 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""
+Row-level validation of the OpenAPC data files.
+
+All data files are read once in the main process, where the cross-row
+indices (ISSN and ISBN lookups, identifier occurrence counts) are built.
+The row checks are then sharded across a pool of worker processes. The
+workers are forked after the data has been loaded, so they inherit rows
+and indices read-only and only shard boundaries and error messages have
+to be passed between processes.
+
+In incremental mode, a manifest of row hashes from the last validation run
+is used to restrict the checks to new or changed rows. The cross-row
+indices are then only built for the identifiers (DOIs, ISSNs, ISBNs and
+ISBN group-publisher keys) those rows touch.
+
+Can be used as a standalone script (run from the python/test directory or
+as "python -m test.data_validation" from python/) or through the pytest
+items in test_apc_csv.py.
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+from collections import Counter, OrderedDict
+from csv import DictReader
+from os.path import abspath, dirname, join
+import sys
+
+TEST_DIR = dirname(abspath(__file__))
+ROOT_DIR = dirname(dirname(TEST_DIR))
+
+sys.path.append(dirname(TEST_DIR))
+import openapc_toolkit as oat
+
+if __package__:
+    from . import whitelists as wl
+else:
+    import whitelists as wl
+
+ARG_HELP_STRINGS = {
+    "data_files": "Only validate the given data files (default: all). " +
+                  "Possible values: apc, ta, bpc",
+    "processes": "Number of worker processes to shard the rows across " +
+                 "(default: number of CPU cores). Use 1 to run all checks " +
+                 "in the main process.",
+    "chunk_size": "Number of rows per shard (default: %(default)s)",
+    "incremental": "Only validate rows which were added or changed since " +
+                   "the last run. Row hashes are stored in a manifest file, " +
+                   "which can be given as argument (default: " +
+                   "validation_manifest.json in the python/test directory)."
+}
+
+DATA_FILES = OrderedDict([
+    ("apc", {
+        "file_path": "data/apc_de.csv",
+        "unused_fields": ["institution", "period", "license_ref", "pmid", "pmcid", "ut"],
+        "data_set": "apc",
+        "row_length": 18,
+        "has_issn": True,
+        "has_isbn": False
+    }),
+    ("ta", {
+        "file_path": "data/transformative_agreements/transformative_agreements.csv",
+        "unused_fields": ["institution", "period", "license_ref", "pmid", "pmcid", "ut"],
+        "data_set": "apc",
+        "row_length": 19,
+        "has_issn": True,
+        "has_isbn": False
+    }),
+    ("bpc", {
+        "file_path": "data/bpc.csv",
+        "unused_fields": ["institution", "period", "license_ref"],
+        "data_set": "bpc",
+        "row_length": 13,
+        "has_issn": False,
+        "has_isbn": True
+    })
+])
+
+CHUNK_SIZE = 5000
+
+MANIFEST_VERSION = 1
+DEFAULT_MANIFEST_FILE = join(TEST_DIR, "validation_manifest.json")
+
+ISSN_FIELDS = ["issn", "issn_print", "issn_electronic", "issn_l"]
+
+# Rows grouped by data file key. Populated by load_data().
+ROWS = OrderedDict()
+# The csv header of each loaded data file
+HEADERS = {}
+# Indices of the rows to validate per data file, None meaning all rows.
+SELECTED_ROWS = OrderedDict()
+# Indices of the rows which failed validation per data file. Populated by
+# validate().
+FAILED_ROWS = {}
+
+# Manifest contents and validation fingerprint of the current load_data() run
+_MANIFEST = None
+_FINGERPRINT = None
+
+ISBNHANDLING = None
+
+doi_counter = Counter()
+isbn_counter = Counter()
+# IssnSummary objects for each ISSN, grouped by the column it occured in
+issn_dict = {}
+issn_p_dict = {}
+issn_e_dict = {}
+issn_l_dict = {}
+ISSN_DICTS = [issn_dict, issn_p_dict, issn_e_dict, issn_l_dict]
+
+isbn_dict = {}
+
+class RowObject(object):
+    """
+    A minimal container class to store contextual information along with csv rows.
+    """
+    def __init__(self, file_name, line_number, row, origin, row_hash=None):
+        self.file_name = file_name
+        self.line_number = line_number
+        self.row = row
+        self.origin = origin
+        self.row_hash = row_hash
+
+class IssnSummary(object):
+    """
+    Aggregated journal metadata of all rows sharing an ISSN.
+
+    The conflicts between the collected values are computed once by freeze()
+    and reported on a single row only (the reporter), identified by its data
+    file key and line number. Every distinct value is stored along with the
+    location (file:line) of its first occurence, so a conflict can name the
+    rows which actually disagree.
+    """
+    def __init__(self):
+        self.reporter = None
+        self.publishers = {}
+        self.titles = {}
+        self.hybrid_states = {}
+        self.issn_ls = {}
+        self.hybrid_checked = False
+        self.name_conflicts = []
+        self.issn_l_conflicts = []
+
+    def add(self, row, location, hybrid_checked):
+        self.publishers.setdefault(row["publisher"], location)
+        self.titles.setdefault(row["journal_full_title"], location)
+        self.hybrid_states.setdefault(row["is_hybrid"], location)
+        self.issn_ls.setdefault(row["issn_l"], location)
+        # Differing hybrid states are only an error if at least one row
+        # involved is not whitelisted in JOURNAL_HYBRID_STATUS_CHANGED
+        self.hybrid_checked = self.hybrid_checked or hybrid_checked
+
+    def freeze(self, issn):
+        for first, second in _get_pairs(self.publishers):
+            if not in_whitelist(issn, first[0], second[0]):
+                self.name_conflicts.append(("publisher name", first, second))
+        for first, second in _get_pairs(self.titles):
+            self.name_conflicts.append(("journal title", first, second))
+        if self.hybrid_checked:
+            for first, second in _get_pairs(self.hybrid_states):
+                self.name_conflicts.append(("hybrid status", first, second))
+        for first, second in _get_pairs(self.issn_ls):
+            if first[0] == "NA":
+                first, second = second, first
+            self.issn_l_conflicts.append((first, second))
+
+def _get_pairs(locations):
+    """
+    Return all pairs of (value, location) tuples from a dict mapping values to locations.
+    """
+    values = sorted(locations.items())
+    return [(first, second) for num, first in enumerate(values) for second in values[num + 1:]]
+
+def _get_isbn_group_publisher(isbn):
+    if ISBNHANDLING.ISBN_SPLIT_RE.match(isbn):
+        parts = isbn.split("-")
+        group_and_publisher = parts[1:3]
+        key = ("-").join(group_and_publisher)
+        return key
+    return None
+
+def _get_duplicate_candidate_isbns(row):
+    isbn_list = []
+    for isbn in [row["isbn"], row["isbn_print"], row["isbn_electronic"]]:
+        # clear row-internal duplicates
+        if oat.has_value(isbn) and isbn not in isbn_list and isbn not in wl.NON_DUPLICATE_ISBNS:
+            isbn_list.append(isbn)
+    return isbn_list
+
+def _add_to_issn_dict(target_dict, issn, row, location, reporter, hybrid_checked, keys):
+    if not oat.has_value(issn) or (keys is not None and issn not in keys):
+        return
+    summary = target_dict.get(issn)
+    if summary is None:
+        summary = target_dict[issn] = IssnSummary()
+    if summary.reporter is None:
+        summary.reporter = reporter
+    summary.add(row, location, hybrid_checked)
+
+def _get_row_hash(row):
+    values = []
+    for value in row.values():
+        if value is None:
+            # missing field in a row which is too short
+            value = "\x00"
+        elif isinstance(value, list):
+            # DictReader stores surplus fields of a row which is too long as a list
+            value = "\x1e".join(value)
+        values.append(value)
+    content = "\x1f".join(values).encode("utf-8")
+    return hashlib.blake2b(content, digest_size=8).hexdigest()
+
+def _get_fingerprint(isbn_range_file):
+    """
+    Hash everything besides the data which affects the validation result.
+
+    A manifest created with a different fingerprint is discarded, so any
+    change to the checks, the whitelists or the toolkit functions used by
+    the checks leads to a full validation.
+    """
+    fingerprint = hashlib.sha1(str(MANIFEST_VERSION).encode("ascii"))
+    for file_path in [abspath(__file__), join(TEST_DIR, "whitelists.py"),
+                      abspath(oat.__file__), isbn_range_file]:
+        with open(file_path, "rb") as handle:
+            fingerprint.update(handle.read())
+    return fingerprint.hexdigest()
+
+def _read_manifest(manifest_file, fingerprint):
+    try:
+        with open(manifest_file, "r") as handle:
+            manifest = json.load(handle)
+    except (IOError, ValueError):
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("fingerprint") != fingerprint:
+        return {}
+    return manifest["files"]
+
+def _get_touched_keys():
+    keys = {"doi": set(), "issn": set(), "isbn": set(), "isbn_group": set()}
+    for data_file, selected in SELECTED_ROWS.items():
+        metadata = DATA_FILES[data_file]
+        rows = ROWS[data_file]
+        for index in selected:
+            row = rows[index].row
+            keys["doi"].add(row["doi"])
+            if metadata["has_issn"]:
+                for field in ISSN_FIELDS:
+                    keys["issn"].add(row[field])
+            if metadata["has_isbn"]:
+                if oat.has_value(row["isbn"]):
+                    keys["isbn_group"].add(_get_isbn_group_publisher(row["isbn"]))
+                keys["isbn"].update(_get_duplicate_candidate_isbns(row))
+    return keys
+
+def _build_indices(keys=None):
+    """
+    Build the cross-row indices from the loaded rows.
+
+    Args:
+        keys: A dict of identifier sets as returned by _get_touched_keys().
+              If given, only entries for these identifiers are indexed.
+    """
+    for index in [doi_counter, isbn_counter, issn_dict, issn_p_dict,
+                  issn_e_dict, issn_l_dict, isbn_dict]:
+        index.clear()
+    doi_keys = issn_keys = isbn_keys = isbn_group_keys = None
+    if keys is not None:
+        doi_keys, issn_keys = keys["doi"], keys["issn"]
+        isbn_keys, isbn_group_keys = keys["isbn"], keys["isbn_group"]
+    for data_file, rows in ROWS.items():
+        metadata = DATA_FILES[data_file]
+        selected = SELECTED_ROWS.get(data_file)
+        if selected is not None:
+            selected = set(selected)
+        for num, row_object in enumerate(rows):
+            row = row_object.row
+            if doi_keys is None or row["doi"] in doi_keys:
+                doi_counter[row["doi"]] += 1
+
+            if metadata["has_issn"]:
+                reporter = None
+                if selected is None or num in selected:
+                    reporter = (data_file, row_object.line_number)
+                issns = {row[field] for field in ISSN_FIELDS}
+                hybrid_checked = issns.isdisjoint(wl.JOURNAL_HYBRID_STATUS_CHANGED)
+                location = "{}:{}".format(row_object.file_name, row_object.line_number)
+                for target_dict, field in zip(ISSN_DICTS, ISSN_FIELDS):
+                    _add_to_issn_dict(target_dict, row[field], row, location, reporter,
+                                      hybrid_checked, issn_keys)
+
+            if metadata["has_isbn"]:
+                isbn = row["isbn"]
+                if oat.has_value(isbn):
+                    key = _get_isbn_group_publisher(isbn)
+                    if key is not None and (isbn_group_keys is None or key in isbn_group_keys):
+                        publisher = row["publisher"]
+                        if key not in isbn_dict:
+                            isbn_dict[key] = [publisher]
+                        elif publisher not in isbn_dict[key]:
+                            isbn_dict[key].append(publisher)
+                for isbn in _get_duplicate_candidate_isbns(row):
+                    if isbn_keys is None or isbn in isbn_keys:
+                        isbn_counter[isbn] += 1
+    for target_dict in ISSN_DICTS:
+        for issn, summary in target_dict.items():
+            summary.freeze(issn)
+
+def load_data(data_files=None, root_dir=ROOT_DIR, isbn_range_file=None, manifest_file=None):
+    """
+    Read data files and build the cross-row indices used by the checks.
+
+    Any previously loaded data is discarded.
+
+    Args:
+        data_files: A list of keys from DATA_FILES. All files are loaded if
+                    omitted.
+        root_dir: The directory the file paths in DATA_FILES are relative to.
+        isbn_range_file: Path to an ISBN range file. Defaults to the one
+                         stored next to this module.
+        manifest_file: Path to a manifest written by write_manifest(). If
+                       given, only rows which are not listed in the manifest
+                       are selected for validation. A missing or outdated
+                       manifest selects all rows.
+
+    Returns:
+        The ROWS dict, mapping each data file key to a list of RowObjects.
+    """
+    global ISBNHANDLING, _MANIFEST, _FINGERPRINT
+    if data_files is None:
+        data_files = list(DATA_FILES.keys())
+    if isbn_range_file is None:
+        isbn_range_file = join(TEST_DIR, "ISBNRangeFile.xml")
+    if ISBNHANDLING is None:
+        ISBNHANDLING = oat.ISBNHandling(isbn_range_file)
+    _MANIFEST = _FINGERPRINT = None
+    if manifest_file is not None:
+        _FINGERPRINT = _get_fingerprint(isbn_range_file)
+        _MANIFEST = _read_manifest(manifest_file, _FINGERPRINT)
+    ROWS.clear()
+    HEADERS.clear()
+    SELECTED_ROWS.clear()
+    FAILED_ROWS.clear()
+    for data_file in data_files:
+        metadata = DATA_FILES[data_file]
+        rows = ROWS[data_file] = []
+        with open(join(root_dir, metadata["file_path"]), "r") as csv_file:
+            reader = DictReader(csv_file)
+            HEADERS[data_file] = reader.fieldnames
+            known_rows = None
+            if _MANIFEST is not None:
+                SELECTED_ROWS[data_file] = []
+                known_rows = Counter()
+                file_manifest = _MANIFEST.get(data_file)
+                if file_manifest is not None and file_manifest["header"] == reader.fieldnames:
+                    known_rows.update(file_manifest["rows"])
+            else:
+                SELECTED_ROWS[data_file] = None
+            line = 2
+            for row in reader:
+                row_hash = None
+                if known_rows is not None:
+                    row_hash = _get_row_hash(row)
+                    # Counting down makes sure that a copy of a validated row
+                    # is still selected (it might be a duplicate).
+                    if known_rows[row_hash] > 0:
+                        known_rows[row_hash] -= 1
+                    else:
+                        SELECTED_ROWS[data_file].append(len(rows))
+                for field in metadata["unused_fields"]:
+                    del(row[field])
+                rows.append(RowObject(metadata["file_path"], line, row, data_file, row_hash))
+                line += 1
+    keys = None
+    if _MANIFEST is not None:
+        keys = _get_touched_keys()
+    _build_indices(keys)
+    return ROWS
+
+def write_manifest(manifest_file):
+    """
+    Store the hashes of all loaded rows which passed validation.
+
+    Must be called after load_data() was run with a manifest_file and
+    validate() has finished. Entries for data files which were not loaded
+    are taken over from the previous manifest.
+
+    Args:
+        manifest_file: The path of the manifest file.
+    """
+    files = dict(_MANIFEST)
+    for data_file, rows in ROWS.items():
+        failed = FAILED_ROWS.get(data_file, set())
+        files[data_file] = {
+            "header": HEADERS[data_file],
+            "rows": [row.row_hash for num, row in enumerate(rows) if num not in failed]
+        }
+    manifest = {"version": MANIFEST_VERSION, "fingerprint": _FINGERPRINT, "files": files}
+    tmp_file = manifest_file + ".tmp"
+    with open(tmp_file, "w") as handle:
+        json.dump(manifest, handle)
+    os.replace(tmp_file, manifest_file)
+
+def publisher_identity(first_publisher, second_publisher):
+    for entry in wl.PUBLISHER_IDENTITY:
+        if first_publisher in entry[0] and second_publisher in entry[1]:
+            return True
+        if first_publisher in entry[1] and second_publisher in entry[0]:
+            return True
+    return False
+
+def in_whitelist(issn, first_publisher, second_publisher):
+    if publisher_identity(first_publisher, second_publisher):
+        return True
+    if issn in wl.JOURNAL_OWNER_CHANGED:
+        return (first_publisher in wl.JOURNAL_OWNER_CHANGED[issn] and
+                second_publisher in wl.JOURNAL_OWNER_CHANGED[issn])
+    return False
+
+def _line_str(row_object):
+    return '{}, line {}: '.format(row_object.file_name, row_object.line_number)
+
+def check_line_length(row_object, errors):
+    correct_length = DATA_FILES[row_object.origin]["row_length"]
+    target_length = correct_length - len(DATA_FILES[row_object.origin]["unused_fields"])
+    if len(row_object.row) != target_length:
+        errors.append(_line_str(row_object) + 'Row must consist of exactly ' +
+                      str(correct_length) + ' items')
+
+def check_optional_identifier(row_object, errors):
+    row = row_object.row
+    if row['doi'] == "NA":
+        if not oat.has_value(row['url']):
+            errors.append(_line_str(row_object) + 'if no DOI is given, the column ' +
+                          '"url" must not be empty')
+
+def check_common_field_content(row_object, errors):
+    row = row_object.row
+    line_str = _line_str(row_object)
+    if not oat.has_value(row['publisher']):
+        errors.append(line_str + 'the column "publisher" must not be empty')
+    if row['indexed_in_crossref'] not in ["TRUE", "FALSE"]:
+        errors.append(line_str + 'value in row "indexed_in_crossref" must either be TRUE or FALSE')
+    if not row['doi'] == "NA":
+        doi_norm = oat.get_normalised_DOI(row['doi'])
+        if doi_norm is None:
+            errors.append(line_str + 'value in row "doi" must either be NA or represent a valid DOI')
+        elif doi_norm != row['doi']:
+            errors.append(line_str + 'value in row "doi" contains a valid DOI, but the format ' +
+                          'is not correct. It should be the simple DOI name, not ' +
+                          'handbook notation (doi:...) or a HTTP URI (http://dx.doi.org/...)')
+    if len(row['publisher']) != len(row['publisher'].strip()):
+        errors.append(line_str + 'publisher name (' + row['publisher'] + ') has leading or trailing whitespaces')
+
+def check_apc_field_content(row_object, errors):
+    row = row_object.row
+    line_str = _line_str(row_object)
+    if not oat.has_value(row['journal_full_title']):
+        errors.append(line_str + 'the column "journal_full_title" must not be empty')
+    if len(row['journal_full_title']) != len(row['journal_full_title'].strip()):
+        errors.append(line_str + 'journal title (' + row['journal_full_title'] + ') has leading or trailing whitespaces')
+    if not oat.has_value(row['issn']):
+        errors.append(line_str + 'the column "issn" must not be empty')
+    if row['doaj'] not in ["TRUE", "FALSE"]:
+        errors.append(line_str + 'value in row "doaj" must either be TRUE or FALSE')
+    if row['is_hybrid'] not in ["TRUE", "FALSE"]:
+        errors.append(line_str + 'value in row "is_hybrid" must either be TRUE or FALSE')
+
+    if row_object.origin == "ta":
+        if not oat.has_value(row['agreement']):
+            errors.append(line_str + 'the column "agreement" must not be empty')
+    if not row_object.origin == "ta":
+        try:
+            euro = float(row['euro'])
+            if euro <= 0:
+                errors.append(line_str + 'value in row "euro" (' + row['euro'] + ') must be larger than 0')
+        except ValueError:
+            errors.append(line_str + 'value in row "euro" (' + row['euro'] + ') is no valid number')
+
+def check_bpc_field_content(row_object, errors):
+    row = row_object.row
+    line_str = _line_str(row_object)
+    if not oat.has_value(row['book_title']):
+        errors.append(line_str + 'the column "book_title" must not be empty')
+    if len(row['book_title']) != len(row['book_title'].strip()):
+        errors.append(line_str + 'book title (' + row['book_title'] + ') has leading or trailing whitespaces')
+
+def check_issns(row_object, errors):
+    row = row_object.row
+    line_str = _line_str(row_object)
+    for issn_column in [row["issn"], row["issn_print"], row["issn_electronic"], row["issn_l"]]:
+        if issn_column != "NA":
+            if not oat.is_wellformed_ISSN(issn_column):
+                errors.append(line_str + 'value "' + issn_column + '" is not a ' +
+                              'well-formed ISSN')
+            elif not oat.is_valid_ISSN(issn_column):
+                errors.append(line_str + 'value "' + issn_column + '" is no valid ' +
+                              'ISSN (check digit mismatch)')
+    reporter = (row_object.origin, row_object.line_number)
+    msg = line_str + "Two entries share a common {} ({}), but the issn_l differs ({} in {} vs {} in {})"
+    for issn_type, field, index in [("issn", "issn", issn_dict), ("issn_p", "issn_print", issn_p_dict),
+                                    ("issn_e", "issn_electronic", issn_e_dict)]:
+        summary = index.get(row[field])
+        if summary is None or summary.reporter != reporter:
+            continue
+        for (issn_l, location), (other_issn_l, other_location) in summary.issn_l_conflicts:
+            errors.append(msg.format(issn_type, row[field], issn_l, location,
+                                     other_issn_l, other_location))
+
+def check_isbns(row_object, errors):
+    row = row_object.row
+    line_str = _line_str(row_object)
+    isbn = row["isbn"]
+    publisher = row["publisher"]
+    if not oat.has_value(isbn):
+        errors.append(line_str + 'The isbn column may not be empty')
+        return
+    test_result = ISBNHANDLING.test_and_normalize_isbn(isbn)
+    if not test_result["valid"]:
+        error = ISBNHANDLING.ISBN_ERRORS[test_result["error_type"]]
+        errors.append(line_str + 'The isbn is invalid: ' + error)
+        return
+    group_and_publisher = _get_isbn_group_publisher(isbn)
+    for other_publisher in isbn_dict[group_and_publisher]:
+        if other_publisher != publisher and not publisher_identity(publisher, other_publisher):
+            msg = line_str + ('Two book entries share a common group-publisher combination in ' +
+                              'their ISBNs ({}), but the publisher name differs ("{}" vs "{}")')
+            errors.append(msg.format(group_and_publisher, publisher, other_publisher))
+
+def check_for_doi_duplicates(row_object, errors):
+    doi = row_object.row["doi"]
+    if doi and doi != "NA" and doi_counter[doi] > 1:
+        errors.append(_line_str(row_object) + 'Duplicate: DOI "' + doi + '" was ' +
+                      'encountered more than one time')
+
+def check_for_isbn_duplicates(row_object, errors):
+    for isbn in _get_duplicate_candidate_isbns(row_object.row):
+        if isbn_counter[isbn] > 1:
+            errors.append(_line_str(row_object) + 'Duplicate: ISBN "' + isbn + '" was ' +
+                          'encountered more than one time')
+
+def check_hybrid_status(row_object, errors):
+    doaj = row_object.row["doaj"]
+    is_hybrid = row_object.row["is_hybrid"]
+    issn = row_object.row["issn"]
+    title = row_object.row["journal_full_title"]
+    if doaj == "TRUE" and is_hybrid == "TRUE" and issn not in wl.JOURNAL_HYBRID_STATUS_CHANGED:
+        msg = 'Journal "{}" ({}) is listed in the DOAJ but is marked as hybrid (DOAJ only lists fully OA journals)'
+        errors.append(_line_str(row_object) + msg.format(title, issn))
+
+def check_name_consistency(row_object, errors):
+    row = row_object.row
+    reporter = (row_object.origin, row_object.line_number)
+    msg = (u'' + _line_str(row_object) + 'Two entries share a common {}ISSN ({}), but the ' +
+           '{} differs ("{}" in {} vs "{}" in {})')
+    for issn_type, field, index in [("", "issn", issn_dict), ("Print ", "issn_print", issn_p_dict),
+                                    ("Electronic ", "issn_electronic", issn_e_dict),
+                                    ("Linking ", "issn_l", issn_l_dict)]:
+        summary = index.get(row[field])
+        if summary is None or summary.reporter != reporter:
+            continue
+        for conflict_type, (value, location), (other_value, other_location) in summary.name_conflicts:
+            errors.append(msg.format(issn_type, row[field], conflict_type, value, location,
+                                     other_value, other_location))
+
+CHECKS = {
+    "apc": [
+        check_line_length,
+        check_common_field_content,
+        check_apc_field_content,
+        check_optional_identifier,
+        check_issns,
+        check_hybrid_status,
+        check_for_doi_duplicates,
+        check_name_consistency
+    ],
+    "bpc": [
+        check_line_length,
+        check_common_field_content,
+        check_bpc_field_content,
+        check_isbns,
+        check_for_isbn_duplicates,
+        check_for_doi_duplicates
+    ]
+}
+
+def _validate_row(row_object, errors):
+    for check in CHECKS[DATA_FILES[row_object.origin]["data_set"]]:
+        try:
+            check(row_object, errors)
+        except Exception as e:
+            # A check failing on malformed content must not abort the whole
+            # validation, report it as an error of this row instead.
+            msg = "{} failed with {}: {}".format(check.__name__, type(e).__name__, str(e))
+            errors.append(_line_str(row_object) + msg)
+
+def validate_rows(row_objects):
+    """
+    Run all checks applicable to the given rows.
+
+    Args:
+        row_objects: An iterable of RowObjects.
+
+    Returns:
+        A list of error messages, prefixed with file name and line number.
+    """
+    errors = []
+    for row_object in row_objects:
+        _validate_row(row_object, errors)
+    return errors
+
+def _validate_shard(shard):
+    data_file, indices = shard
+    rows = ROWS[data_file]
+    errors = []
+    failed = []
+    for index in indices:
+        error_count = len(errors)
+        _validate_row(rows[index], errors)
+        if len(errors) > error_count:
+            failed.append(index)
+    return data_file, errors, failed
+
+def _get_shards(chunk_size):
+    shards = []
+    for data_file, rows in ROWS.items():
+        selected = SELECTED_ROWS[data_file]
+        if selected is None:
+            selected = range(len(rows))
+        for start in range(0, len(selected), chunk_size):
+            shards.append((data_file, selected[start:start + chunk_size]))
+    return shards
+
+def validate(processes=None, chunk_size=CHUNK_SIZE):
+    """
+    Validate the rows selected by load_data().
+
+    The rows are split into shards of chunk_size rows which are processed by
+    a pool of forked worker processes. On platforms without fork support or
+    with processes=1 all shards are processed in the current process.
+
+    Args:
+        processes: Number of worker processes. Defaults to the number of
+                   CPU cores.
+        chunk_size: The number of rows per shard.
+
+    Returns:
+        An OrderedDict mapping each loaded data file key to a list of error
+        messages, ordered by line number.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    results = OrderedDict((data_file, []) for data_file in ROWS)
+    FAILED_ROWS.clear()
+    shards = _get_shards(chunk_size)
+    if processes > 1 and len(shards) > 1 and "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+        with context.Pool(min(processes, len(shards))) as pool:
+            shard_results = list(pool.imap(_validate_shard, shards))
+    else:
+        shard_results = [_validate_shard(shard) for shard in shards]
+    for data_file, errors, failed in shard_results:
+        results[data_file] += errors
+        FAILED_ROWS.setdefault(data_file, set()).update(failed)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("data_files", nargs="*", help=ARG_HELP_STRINGS["data_files"])
+    parser.add_argument("-p", "--processes", type=int, help=ARG_HELP_STRINGS["processes"])
+    parser.add_argument("-c", "--chunk-size", type=int, default=CHUNK_SIZE,
+                        help=ARG_HELP_STRINGS["chunk_size"])
+    parser.add_argument("-i", "--incremental", nargs="?", const=DEFAULT_MANIFEST_FILE,
+                        metavar="MANIFEST_FILE", help=ARG_HELP_STRINGS["incremental"])
+    args = parser.parse_args()
+
+    for data_file in args.data_files:
+        if data_file not in DATA_FILES:
+            parser.error("unknown data file: " + data_file)
+    data_files = args.data_files if args.data_files else None
+    load_data(data_files, manifest_file=args.incremental)
+    for data_file, rows in ROWS.items():
+        msg = str(len(rows)) + " records collected from " + DATA_FILES[data_file]["file_path"]
+        if SELECTED_ROWS[data_file] is not None:
+            msg += " (" + str(len(SELECTED_ROWS[data_file])) + " new or changed)"
+        oat.print_b(msg)
+    oat.print_b("Starting tests...")
+    results = validate(args.processes, args.chunk_size)
+    if args.incremental:
+        write_manifest(args.incremental)
+    error_count = 0
+    for data_file, errors in results.items():
+        for error in errors:
+            oat.print_r(error)
+        error_count += len(errors)
+    if error_count:
+        oat.print_r(str(error_count) + " errors found")
+        sys.exit(1)
+    oat.print_g("All checks passed")
+
+if __name__ == '__main__':
+    main()
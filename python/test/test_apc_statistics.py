@@ -0,0 +1,127 @@
+# -*- coding: UTF-8 -*-
+
+from functools import reduce
+from math import isnan, nan, sqrt
+import os
+from sys import path
+
+import pytest
+
+path.append(os.path.join(path[0], "python"))
+import apc_statistics
+from apc_statistics import APCStatistics, MIN_JOURNAL_ARTICLES
+
+def legacy_mean(sample):
+    return reduce(lambda x, y: x + y, sample) / len(sample)
+
+def legacy_stddev(sample):
+    if len(sample) == 1:
+        return nan
+    mean_value = legacy_mean(sample)
+    sums = 0.0
+    for obs in sample:
+        sums += (obs - mean_value)**2
+    return sqrt(sums / (len(sample) - 1))
+
+def legacy_significant_differences(apc_content, institution):
+    """
+    The previous per-institution implementation from generate_apc_report.py, used as reference.
+    """
+    titles = {}
+    articles = []
+    for line in apc_content:
+        if line[0] != institution:
+            continue
+        title = line[6]
+        if title not in titles:
+            titles[title] = {"lines": []}
+        articles.append(line)
+    for line in apc_content:
+        title = line[6]
+        if title in titles:
+            titles[title]["lines"].append(line)
+    for title in titles:
+        apc_values = [float(line[2]) for line in titles[title]["lines"]]
+        titles[title]["count"] = len(apc_values)
+        titles[title]["stddev"] = legacy_stddev(apc_values)
+        titles[title]["mean"] = legacy_mean(apc_values)
+    stats = {
+        "articles": len(articles),
+        "not_checked": 0,
+        "within_limits": 0,
+        "significant": 0
+    }
+    sig_articles = []
+    for article in articles:
+        apc = article[2]
+        title = article[6]
+        if titles[title]["count"] < 20:
+            stats["not_checked"] += 1
+            continue
+        if abs(float(apc) - titles[title]["mean"]) > 2 * titles[title]["stddev"]:
+            rounded_mean = round(titles[title]["mean"], 2)
+            rounded_stddev = round(titles[title]["stddev"], 2)
+            diff_absolute = round(float(apc) - rounded_mean, 2)
+            diff_times_stddev = round(diff_absolute / rounded_stddev, 2)
+            stats["significant"] += 1
+            article.append(rounded_mean)
+            article.append(rounded_stddev)
+            article.append(diff_absolute)
+            article.append(diff_times_stddev)
+            article.append(titles[title]["count"])
+            sig_articles.append(article)
+        else:
+            stats["within_limits"] += 1
+    return sig_articles, stats
+
+def _row(institution, euro, num, journal):
+    return [institution, "2020", euro, "10.1234/" + str(num), "FALSE", "Publisher", journal]
+
+def get_apc_content():
+    """
+    Journal A has exactly MIN_JOURNAL_ARTICLES articles (checked) with an outlier,
+    journal B has one article less (not checked) and journal C a single article.
+    """
+    content = []
+    euros = ["1000.10", "1010.20", "990.30", "1005.00", "998.70"]
+    for num in range(MIN_JOURNAL_ARTICLES - 1):
+        institution = "Uni A" if num % 2 else "Uni B"
+        content.append(_row(institution, euros[num % len(euros)], num, "Journal A"))
+    content.append(_row("Uni A", "2500.00", 100, "Journal A"))
+    for num in range(MIN_JOURNAL_ARTICLES - 1):
+        content.append(_row("Uni B", "1500.55", 200 + num, "Journal B"))
+    content.append(_row("Uni C", "700.00", 300, "Journal C"))
+    return content
+
+@pytest.fixture(params=["numpy", "python"])
+def backend(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(apc_statistics, "numpy", None)
+    return request.param
+
+def test_journal_stats(backend):
+    content = get_apc_content()
+    apc_stats = APCStatistics(content)
+    for journal in ["Journal A", "Journal B", "Journal C"]:
+        sample = [float(line[2]) for line in content if line[6] == journal]
+        count, mean, stddev = apc_stats.get_journal_stats(journal)
+        assert count == len(sample)
+        assert mean == legacy_mean(sample)
+        if len(sample) == 1:
+            assert isnan(stddev)
+        else:
+            assert stddev == legacy_stddev(sample)
+    assert apc_stats.get_journal_stats("Journal D") is None
+
+def test_significant_differences(backend):
+    apc_stats = APCStatistics(get_apc_content())
+    results = {}
+    for institution in ["Uni A", "Uni B", "Uni C"]:
+        expected = legacy_significant_differences(get_apc_content(), institution)
+        results[institution] = apc_stats.find_significant_differences(institution)
+        assert results[institution] == expected
+    assert results["Uni A"][1]["significant"] == 1
+    assert results["Uni B"][1]["not_checked"] == MIN_JOURNAL_ARTICLES - 1
+    assert results["Uni C"][1]["not_checked"] == 1
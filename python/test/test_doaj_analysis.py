@@ -0,0 +1,32 @@
+# -*- coding: UTF-8 -*-
+
+import os
+from sys import path
+
+path.append(os.path.join(path[0], "python"))
+import openapc_toolkit as oat
+
+DOAJ_FILE = [
+    "Journal title,Journal ISSN (print version),Journal EISSN (online version)",
+    "Journal A,1234-5678,2345-678X",
+    "Journal B,3456-789x,",
+    "Journal C,,4567-8901"
+]
+
+def test_doaj_lookup(tmp_path):
+    doaj_file = str(tmp_path / "DOAJ.csv")
+    with open(doaj_file, "w") as out:
+        out.write("\n".join(DOAJ_FILE) + "\n")
+    for _ in range(2):
+        # The second run uses the binary snapshot of the index
+        doaj_analysis = oat.DOAJAnalysis(doaj_file)
+        assert doaj_analysis.lookup("1234-5678") == "Journal A"
+        assert doaj_analysis.lookup("2345-678X") == "Journal A"
+        assert doaj_analysis.lookup("4567-8901") == "Journal C"
+        assert doaj_analysis.lookup("9999-9999") is None
+        # Lookups are exact, the case of the check digit matters
+        assert doaj_analysis.lookup("2345-678x") is None
+        assert doaj_analysis.lookup("3456-789x") == "Journal B"
+        assert doaj_analysis.lookup("3456-789X") is None
+        assert doaj_analysis.lookup("1234-5678\n") is None
+    assert os.path.isfile(doaj_analysis.index_file)
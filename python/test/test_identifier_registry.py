@@ -0,0 +1,53 @@
+# -*- coding: UTF-8 -*-
+
+import os
+from sys import path
+
+path.append(os.path.join(path[0], "python"))
+import openapc_toolkit as oat
+
+APC_FILE = [
+    "institution,period,euro,doi,is_hybrid",
+    "Uni A,2020,1000,10.1234/ABC,FALSE",
+    "Uni B,2021,1200,https://doi.org/10.1234/xyz,TRUE",
+    '"Uni\nC",2021,800,10.1234/multiline,FALSE'
+]
+
+BPC_FILE = [
+    "institution,period,euro,doi,isbn,isbn_print,isbn_electronic",
+    "Uni C,2019,5000,NA,978-3-16-148410-0,NA,9783161484117"
+]
+
+def _write_csv(file_path, lines):
+    with open(file_path, "w", encoding="utf-8") as out:
+        out.write("\n".join(lines) + "\n")
+
+def test_identifier_registry(tmp_path):
+    apc_file = str(tmp_path / "apc.csv")
+    bpc_file = str(tmp_path / "bpc.csv")
+    db_file = str(tmp_path / "registry.db")
+    _write_csv(apc_file, APC_FILE)
+    _write_csv(bpc_file, BPC_FILE)
+
+    registry = oat.IdentifierRegistry(db_file, [apc_file, bpc_file])
+    match = registry.lookup_doi("doi:10.1234/Abc")
+    assert match == [{"file": apc_file, "line": 2, "institution": "Uni A", "period": "2020"}]
+    assert registry.lookup_doi("10.1234/XYZ")[0]["line"] == 3
+    assert registry.lookup_isbn("9783161484100")[0]["institution"] == "Uni C"
+    assert registry.lookup_isbn("978-3-16-148411-7")[0]["file"] == bpc_file
+    # Records spanning several lines are reported with their last line
+    assert registry.lookup_doi("10.1234/multiline")[0]["line"] == 5
+    assert registry.lookup_doi("NA") == []
+    assert registry.update() == []
+
+    # Only changed files are re-indexed
+    _write_csv(apc_file, APC_FILE + ["Uni D,2022,900,10.5678/new,FALSE"])
+    assert registry.update() == [apc_file]
+    assert registry.lookup_doi("10.5678/NEW")[0]["line"] == 6
+    registry.close()
+
+    # Entries of files no longer indexed are removed
+    registry = oat.IdentifierRegistry(db_file, [bpc_file])
+    assert registry.lookup_doi("10.1234/abc") == []
+    assert len(registry.lookup_isbn("9783161484117")) == 1
+    registry.close()
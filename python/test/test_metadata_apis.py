@@ -1,8 +1,10 @@
 # -*- coding: UTF-8 -*-
 
+import json
 import os
 from sys import path
 from time import sleep
+from urllib.error import HTTPError
 from urllib.request import urlretrieve
 
 import pytest
@@ -92,3 +94,75 @@ def test_isbn_doi_lookup(isbn_list, expected_result):
     if expected_result["success"] == True:
         assert answer["dois"] == expected_result["dois"]
     sleep(1)
+
+def test_response_cache(tmpdir):
+    cache_dir = str(tmpdir)
+    oat.RESPONSE_CACHE = oat.HTTPResponseCache(cache_dir)
+    try:
+        online_answer = oat.get_metadata_from_crossref("10.3390/robotics6020009")
+        online_404 = oat.get_metadata_from_crossref("10.3390/does_not_exist")
+        oat.RESPONSE_CACHE = oat.HTTPResponseCache(cache_dir, offline=True)
+        assert oat.get_metadata_from_crossref("10.3390/robotics6020009") == online_answer
+        offline_404 = oat.get_metadata_from_crossref("10.3390/does_not_exist")
+        assert offline_404["success"] == False
+        assert offline_404["error_msg"].startswith("HTTPError: 404")
+        uncached = oat.get_metadata_from_crossref("10.3998/mpub.11325807")
+        assert uncached["success"] == False
+        assert uncached["error_msg"].startswith("URLError: Offline mode")
+    finally:
+        oat.RESPONSE_CACHE = None
+
+def test_crossref_batch():
+    dois = list(CROSSREF_METADATA_TEST_CASES.keys())
+    answer = oat.get_metadata_from_crossref_batch(dois)
+    assert answer["success"] == True
+    for doi, expected_result in CROSSREF_METADATA_TEST_CASES.items():
+        if not expected_result["success"]:
+            continue
+        result = answer["results"][doi]
+        assert result["success"] == True
+        assert set(expected_result["data"].keys()) == set(result["data"].keys())
+        assert result["data"]["doi_type"] == expected_result["data"]["doi_type"]
+        for key in expected_result["data"].keys():
+            if expected_result["data"][key] != result["data"][key]:
+                # See test_crossref
+                msg = 'Crossref batch: Unexpected metadata content for field {}: "{}" (Expected "{}")'
+                msg = msg.format(key, result["data"][key], expected_result["data"][key])
+                warnings.warn(UserWarning(msg))
+    # Invalid DOIs are not part of the batch response and must be left for individual lookups
+    assert "11.234/5678.9" not in answer["results"]
+
+def test_crossref_batch_bad_item(monkeypatch):
+    works = {"message": {"items": [
+        {"DOI": "10.1/good", "type": "journal-article", "prefix": "10.1",
+         "publisher": "Good Publisher", "container-title": ["Good Journal"]},
+        {"DOI": "10.2/unknown_prefix", "type": "journal-article", "prefix": "10.2",
+         "publisher": "Other Publisher", "container-title": ["Other Journal"]},
+        {"DOI": "10.3/no_prefix", "type": "journal-article",
+         "publisher": "Third Publisher", "container-title": ["Third Journal"]},
+        {"DOI": "10.4/no_type", "prefix": "10.1"},
+        {"DOI": "10.5194/acp-2018-644", "type": "posted-content", "prefix": "10.5194"}
+    ]}}
+    def fetch_url(request):
+        url = request.get_full_url()
+        if url.startswith("https://api.crossref.org/works"):
+            return json.dumps(works)
+        if url == "https://api.crossref.org/prefixes/10.1":
+            return json.dumps({"message": {"name": "Good Prefix"}})
+        raise HTTPError(url, 404, "Not Found", None, None)
+    monkeypatch.setattr(oat, "_fetch_url", fetch_url)
+    monkeypatch.setattr(oat, "CROSSREF_PREFIX_NAMES", {})
+    dois = ["10.1/good", "10.2/unknown_prefix", "10.3/no_prefix", "10.4/no_type",
+            "10.5194/acp-2018-644"]
+    answer = oat.get_metadata_from_crossref_batch(dois)
+    assert answer["success"] == True
+    results = answer["results"]
+    assert results["10.1/good"]["data"]["prefix"] == "Good Prefix"
+    assert results["10.2/unknown_prefix"]["success"] == True
+    assert results["10.2/unknown_prefix"]["data"]["prefix"] is None
+    assert results["10.2/unknown_prefix"]["data"]["publisher"] == "Other Publisher"
+    assert results["10.3/no_prefix"]["success"] == True
+    assert results["10.3/no_prefix"]["data"]["prefix"] is None
+    assert results["10.4/no_type"]["success"] == False
+    # Unsupported types must be reported just like in get_metadata_from_crossref()
+    assert results["10.5194/acp-2018-644"] == CROSSREF_METADATA_TEST_CASES["10.5194/acp-2018-644"]
@@ -0,0 +1,123 @@
+# -*- coding: UTF-8 -*-
+
+import io
+import os
+import random
+from sys import path
+import time
+
+import pytest
+
+path.append(os.path.join(path[0], "python"))
+import openapc_toolkit as oat
+
+class LegacyWriter(object):
+    """
+    The previous, cell-by-cell implementation of OpenAPCUnicodeWriter, used as reference.
+    """
+
+    def __init__(self, f, quotemask=None, openapc_quote_rules=True,
+                 has_header=True, minimal_quotes=True):
+        self.outfile = f
+        self.quotemask = quotemask
+        self.openapc_quote_rules = openapc_quote_rules
+        self.has_header = has_header
+        self.minimal_quotes = minimal_quotes
+
+    def _prepare_row(self, row, use_quotemask):
+        for index in range(len(row)):
+            if self.openapc_quote_rules and row[index] in ["TRUE", "FALSE", "NA"]:
+                continue
+            if not use_quotemask or not self.quotemask:
+                row[index] = row[index].replace('"', '""')
+                row[index] = '"' + row[index] + '"'
+                continue
+            if index < len(self.quotemask):
+                if self.quotemask[index] or "," in row[index] and self.minimal_quotes:
+                    row[index] = row[index].replace('"', '""')
+                    row[index] = '"' + row[index] + '"'
+        return row
+
+    def _write_row(self, row):
+        line = ",".join(row) + "\n"
+        self.outfile.write(line)
+
+    def write_rows(self, rows):
+        if self.has_header:
+            self._write_row(self._prepare_row(rows.pop(0), False))
+        for row in rows:
+            self._write_row(self._prepare_row(row, True))
+
+VALUES = ["", "TRUE", "FALSE", "NA", "na", "2019", "1234.5", "Universität Bielefeld",
+          "Springer, Berlin", 'A "quoted" title', '"', ",", "10.1000/xyz", " NA"]
+
+QUOTEMASKS = [None, [], [True, False, True], [False] * 18, oat.OPENAPC_STANDARD_QUOTEMASK,
+              [bool(i % 2) for i in range(25)]]
+
+def _random_rows(rnd, num_rows):
+    width = rnd.choice([3, 18, 19])
+    rows = []
+    for _ in range(num_rows):
+        row_width = width if rnd.random() < 0.9 else rnd.randint(0, 25)
+        rows.append([rnd.choice(VALUES) for _ in range(row_width)])
+    return rows
+
+def _write(writer_class, rows, **kwargs):
+    out = io.StringIO()
+    writer = writer_class(out, **kwargs)
+    writer.write_rows([list(row) for row in rows])
+    return out.getvalue()
+
+@pytest.mark.parametrize("quotemask", QUOTEMASKS)
+@pytest.mark.parametrize("openapc_quote_rules", [True, False])
+@pytest.mark.parametrize("has_header", [True, False])
+@pytest.mark.parametrize("minimal_quotes", [True, False])
+def test_writer_output_identical(quotemask, openapc_quote_rules, has_header, minimal_quotes):
+    rnd = random.Random(42)
+    kwargs = {
+        "quotemask": quotemask,
+        "openapc_quote_rules": openapc_quote_rules,
+        "has_header": has_header,
+        "minimal_quotes": minimal_quotes
+    }
+    for _ in range(20):
+        rows = _random_rows(rnd, 60)
+        expected = _write(LegacyWriter, rows, **kwargs)
+        assert _write(oat.OpenAPCUnicodeWriter, rows, **kwargs) == expected
+        # row-wise writing and generators must produce the same result
+        out = io.StringIO()
+        writer = oat.OpenAPCUnicodeWriter(out, **kwargs)
+        for row in rows:
+            writer.write_row(row)
+        assert out.getvalue() == expected
+        out = io.StringIO()
+        oat.OpenAPCUnicodeWriter(out, **kwargs).write_rows(row for row in rows)
+        assert out.getvalue() == expected
+
+def test_writer_does_not_modify_rows():
+    rows = [["institution", "euro"], ["Uni, Bielefeld", "NA"]]
+    oat.OpenAPCUnicodeWriter(io.StringIO(), [True, False]).write_rows(rows)
+    assert rows == [["institution", "euro"], ["Uni, Bielefeld", "NA"]]
+
+def benchmark(num_rows=200000):
+    # Mostly plain values as found in the core data file, with the occasional comma or quote char
+    rnd = random.Random(0)
+    plain_values = ["Universität Bielefeld", "2019", "1234.5", "10.1000/xyz", "TRUE", "FALSE", "NA",
+                    "Springer Nature", "PLOS ONE", "1932-6203", "https://creativecommons.org/licenses/by/4.0/"]
+    rows = [list(oat.COLUMN_SCHEMAS["journal_article"])]
+    for _ in range(num_rows):
+        pool = VALUES if rnd.random() < 0.01 else plain_values
+        rows.append([rnd.choice(pool) for _ in range(18)])
+    results = {}
+    for writer_class in [LegacyWriter, oat.OpenAPCUnicodeWriter]:
+        copied_rows = [list(row) for row in rows]
+        out = io.StringIO()
+        start = time.perf_counter()
+        writer_class(out, oat.OPENAPC_STANDARD_QUOTEMASK).write_rows(copied_rows)
+        elapsed = time.perf_counter() - start
+        results[writer_class.__name__] = out.getvalue()
+        print("{}: {:.3f}s for {} rows".format(writer_class.__name__, elapsed, num_rows))
+    print("Output identical: {}".format(len(set(results.values())) == 1))
+
+if __name__ == "__main__":
+    benchmark()